@@ -0,0 +1,139 @@
+"""
+Concurrent, deadline-bound quote fetching.
+
+ChunkedFetcher splits a symbol list into chunks, fetches them concurrently on
+an asyncio loop, and gives each chunk `chunk_timeout` seconds and the whole
+call `deadline` seconds. Whatever arrived in time is returned; symbols whose
+chunk timed out or failed are reported per symbol through PartialFetch
+instead of failing the whole request. Slow upstreams therefore cost a
+request at most `deadline` seconds.
+
+Providers may be blocking (fetch(symbols) -> {symbol: price}, run on a
+thread pool) or native async (afetch(symbols), awaited on the loop, like
+HttpQuoteProvider).
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+from price_cache import PartialFetch
+
+CHUNK_SIZE = int(os.environ.get('QUOTE_CHUNK_SIZE', '50'))
+CHUNK_TIMEOUT = float(os.environ.get('QUOTE_CHUNK_TIMEOUT', '5'))
+DEADLINE = float(os.environ.get('QUOTE_DEADLINE', '8'))
+MAX_CONCURRENCY = int(os.environ.get('QUOTE_FETCH_CONCURRENCY', '4'))
+
+# Threads for blocking providers. Not the loop's default executor: asyncio.run()
+# waits for that one at exit, which would let an abandoned call outlive the deadline.
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY * 2, thread_name_prefix='quote-fetch')
+
+TIMEOUT_ERROR = 'Timed out waiting for upstream'
+
+class ChunkedFetcher:
+    """
+    Price provider wrapper: fetch(symbols) returns {symbol: price}, or raises
+    PartialFetch(prices, errors) when some chunks timed out or failed.
+    """
+
+    def __init__(self, provider, chunk_size: int = CHUNK_SIZE, chunk_timeout: float = CHUNK_TIMEOUT,
+                 deadline: float = DEADLINE, max_concurrency: int = MAX_CONCURRENCY):
+        self.provider = provider
+        self.chunk_size = max(1, chunk_size)
+        self.chunk_timeout = chunk_timeout
+        self.deadline = deadline
+        self.max_concurrency = max(1, max_concurrency)
+
+    def fetch(self, symbols: list) -> dict:
+        prices, errors = asyncio.run(self.fetch_async(list(symbols)))
+        if errors:
+            raise PartialFetch(prices, errors)
+        return prices
+
+    async def fetch_async(self, symbols: list) -> tuple:
+        """(prices, errors) where errors is {symbol: reason}."""
+        chunks = [symbols[i:i + self.chunk_size] for i in range(0, len(symbols), self.chunk_size)]
+        limit = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(chunk):
+            async with limit:
+                return await asyncio.wait_for(self._fetch_chunk(chunk), self.chunk_timeout)
+
+        tasks = {asyncio.ensure_future(run(chunk)): chunk for chunk in chunks}
+        prices, errors = {}, {}
+        if not tasks:
+            return prices, errors
+        _, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        for task, chunk in tasks.items():
+            if task.cancelled():
+                reason = TIMEOUT_ERROR
+            elif task.exception() is not None:
+                e = task.exception()
+                reason = TIMEOUT_ERROR if isinstance(e, asyncio.TimeoutError) else f'Price provider error: {e}'
+            else:
+                got = task.result() or {}
+                prices.update((sym, got[sym]) for sym in chunk if sym in got)
+                continue
+            errors.update((sym, reason) for sym in chunk)
+        return prices, errors
+
+    async def _fetch_chunk(self, chunk: list) -> dict:
+        afetch = getattr(self.provider, 'afetch', None)
+        if afetch is not None:
+            return await afetch(chunk)
+        return await asyncio.get_running_loop().run_in_executor(_executor, self.provider.fetch, chunk)
+
+class HttpQuoteProvider:
+    """
+    Quotes over HTTP from a Yahoo-style endpoint:
+
+        GET <url>?symbols=AAPL,MSFT
+        {"quoteResponse": {"result": [{"symbol": "AAPL", "regularMarketPrice": 190.1}, ...]}}
+
+    Requests are made with asyncio streams, so a chunk cancelled at its
+    deadline closes its socket instead of holding a thread. Set
+    QUOTE_HTTP_URL to use it (e.g. a local quote service or a fake in tests).
+    """
+
+    def __init__(self, url: str, timeout: float = CHUNK_TIMEOUT):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported quote URL: {url!r}")
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = parts.scheme == 'https'
+        self.path = parts.path or '/'
+        self.timeout = timeout
+
+    def fetch(self, symbols: list) -> dict:
+        return asyncio.run(self.afetch(symbols))
+
+    async def afetch(self, symbols: list) -> dict:
+        return await asyncio.wait_for(self._get(symbols), self.timeout)
+
+    async def _get(self, symbols: list) -> dict:
+        target = f"{self.path}?symbols={quote(','.join(symbols), safe=',')}"
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+        try:
+            # HTTP/1.0: the body runs to EOF, no chunked transfer encoding
+            writer.write(f"GET {target} HTTP/1.0\r\nHost: {self.host}\r\nAccept: application/json\r\n\r\n".encode())
+            await writer.drain()
+            raw = await reader.read()
+        finally:
+            writer.close()
+        head, _, body = raw.partition(b'\r\n\r\n')
+        status = head.split(b' ', 2)[1:2]
+        if status != [b'200']:
+            raise RuntimeError(f"HTTP {status[0].decode() if status else '?'} from quote server")
+        prices = {}
+        for quote_ in json.loads(body).get('quoteResponse', {}).get('result', []) or []:
+            price = quote_.get('regularMarketPrice')
+            if quote_.get('symbol') and price is not None:
+                prices[quote_['symbol']] = float(price)
+        return prices
@@ -0,0 +1,72 @@
+"""
+Batch uploads: several exports (Robinhood or Fidelity, detected per file)
+parsed concurrently and merged into one chronological trade stream that
+feeds a single gains run, so multiple accounts or year-split exports
+combine into one set of FIFO lots.
+"""
+import heapq
+import io
+import os
+from datetime import date
+
+from capital_gains_calculator import PARALLEL_WORKERS, _EVENT_ORDER, _get_pool
+from csv_parser import iter_export_trades
+
+# Files per batch request
+MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', '20'))
+# Parse on the process pool only when the batch is big enough to repay the IPC
+PARALLEL_MIN_BYTES = int(os.environ.get('BATCH_PARALLEL_MIN_BYTES', str(1 << 20)))
+
+class ExportError(ValueError):
+    """An uploaded export that cannot be parsed; the message names the file."""
+
+def merge_key(t) -> tuple:
+    """
+    Chronological order of trades across files: by date, then the engine's
+    same-day order (SPL, Buy, Sell), with other codes (CDIV) last.
+    """
+    return (t.date, _EVENT_ORDER.get(t.trans_code, 3))
+
+def parse_export(name: str, data: bytes) -> tuple:
+    """
+    Pool task: (broker, trades) for one export's bytes, trades sorted by
+    merge_key. The sort is stable, so same-day trades keep file order as a
+    single-file upload would.
+    """
+    try:
+        broker, trades = iter_export_trades(io.StringIO(data.decode('utf-8'), newline=''))
+        trades = list(trades)
+    except UnicodeDecodeError:
+        raise ExportError(f"{name}: file is not valid UTF-8 CSV")
+    for t in trades:
+        if t.date is None:
+            raise ExportError(f"{name}: unrecognized date {t.activity_date!r}")
+    trades.sort(key=merge_key)
+    return broker, trades
+
+def _should_parallelize(files: list) -> bool:
+    return (PARALLEL_WORKERS >= 2 and len(files) >= 2
+            and sum(len(data) for _, data in files) >= PARALLEL_MIN_BYTES)
+
+def parse_exports(files: list, parallel=None) -> list:
+    """
+    [(name, broker, trades)] for [(name, bytes)] in the same order. Files
+    are parsed on the shared process pool when parallel (None decides from
+    size and worker count), one task per file.
+    """
+    if parallel is None:
+        parallel = _should_parallelize(files)
+    names = [name for name, _ in files]
+    if parallel:
+        parsed = _get_pool().map(parse_export, names, [data for _, data in files])
+    else:
+        parsed = (parse_export(name, data) for name, data in files)
+    return [(name, broker, trades) for name, (broker, trades) in zip(names, parsed)]
+
+def merge_trades(trade_lists):
+    """
+    One chronological stream from per-file sorted trade lists: a lazy k-way
+    merge, O(n log k) for k files, instead of re-sorting everything. Ties
+    keep upload order.
+    """
+    return heapq.merge(*trade_lists, key=merge_key)
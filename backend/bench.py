@@ -0,0 +1,161 @@
+"""
+Throughput benchmark for the upload hot paths, stage by stage:
+
+    parse    CSV text -> Trade records (iter_robinhood_trades)
+    compute  Trade records -> gains result, per engine
+    format   gains result -> JSON response body (serializers)
+
+Inputs come from synthetic_export, so runs are reproducible. Each stage is
+timed (best of --repeat) and, in a separate pass, its peak traced Python
+allocation is measured with tracemalloc (which slows code down, hence the
+separate pass). Results are printed as JSON; with --baseline, stages slower
+than the baseline by more than --tolerance are listed on stderr and the
+exit status is 1, so the script can gate a deploy.
+
+    python bench.py --rows 1000,10000,100000 --out bench.json
+    python bench.py --rows 100000 --baseline bench.json --tolerance 0.25
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from capital_gains_calculator import calculate_capital_gains
+from csv_parser import iter_robinhood_trades
+from serializers import dumps_upload_result
+from synthetic_export import write_export
+from vectorized_engine import calculate_capital_gains_vectorized
+
+ENGINES = {
+    'fifo': lambda trades: calculate_capital_gains(trades, parallel=False),
+    'vectorized': calculate_capital_gains_vectorized,
+}
+
+def _best_time(fn, repeat: int):
+    """(best seconds, last return value) over `repeat` runs."""
+    best = None
+    value = None
+    for _ in range(repeat):
+        value = None
+        gc.collect()
+        start = time.perf_counter()
+        value = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, value
+
+def _peak_kb(fn) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+def _record(rows, tickers, stage, engine, seconds, peak_kb) -> dict:
+    return {
+        'rows': rows,
+        'tickers': tickers,
+        'stage': stage,
+        'engine': engine,
+        'seconds': round(seconds, 6),
+        'rows_per_sec': round(rows / seconds) if seconds > 0 else None,
+        'peak_kb': peak_kb,
+    }
+
+def run(sizes, tickers: int, engines, repeat: int = 3, memory: bool = True, seed: int = 1) -> list:
+    results = []
+    for rows in sizes:
+        buf = io.StringIO()
+        write_export(buf, rows, tickers, seed)
+        text = buf.getvalue()
+        del buf
+
+        parse = lambda: list(iter_robinhood_trades(io.StringIO(text)))
+        seconds, trades = _best_time(parse, repeat)
+        results.append(_record(rows, tickers, 'parse', None, seconds, _peak_kb(parse) if memory else None))
+
+        for engine in engines:
+            compute = lambda: ENGINES[engine](trades)
+            seconds, result = _best_time(compute, repeat)
+            results.append(_record(rows, tickers, 'compute', engine, seconds,
+                                   _peak_kb(compute) if memory else None))
+
+            encode = lambda: dumps_upload_result(result)
+            seconds, _ = _best_time(encode, repeat)
+            results.append(_record(rows, tickers, 'format', engine, seconds,
+                                   _peak_kb(encode) if memory else None))
+            del result
+        del trades, text
+    return results
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """Human-readable lines for stages slower than baseline * (1 + tolerance)."""
+    key = lambda r: (r['rows'], r['tickers'], r['stage'], r['engine'])
+    before = {key(r): r for r in baseline}
+    slower = []
+    for r in results:
+        old = before.get(key(r))
+        if old is None or not old['seconds']:
+            continue
+        ratio = r['seconds'] / old['seconds']
+        if ratio > 1 + tolerance:
+            slower.append(f"{r['stage']} ({r['engine'] or '-'}, {r['rows']} rows): "
+                          f"{old['seconds']:.4f}s -> {r['seconds']:.4f}s (x{ratio:.2f})")
+    return slower
+
+def _meta() -> dict:
+    import numpy
+    return {
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--rows', default='1000,10000,100000', help='comma-separated export sizes')
+    ap.add_argument('--tickers', type=int, default=500)
+    ap.add_argument('--engines', default=','.join(ENGINES))
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    ap.add_argument('--out', help='write results JSON here as well as stdout')
+    ap.add_argument('--baseline', help='results JSON from an earlier run to compare against')
+    ap.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown ratio over baseline')
+    args = ap.parse_args()
+
+    engines = [e for e in args.engines.split(',') if e]
+    unknown = [e for e in engines if e not in ENGINES]
+    if unknown:
+        ap.error(f"unknown engine(s): {', '.join(unknown)}")
+    sizes = [int(n) for n in args.rows.split(',') if n]
+
+    report = {
+        'meta': _meta(),
+        'results': run(sizes, args.tickers, engines, args.repeat, not args.no_memory, args.seed),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            slower = compare(report['results'], json.load(f)['results'], args.tolerance)
+        for line in slower:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Peak-memory benchmark for the upload pipeline: parse -> calculate -> encode.
+
+Generates a synthetic Robinhood export, then runs the pipeline in a fresh
+child process and reports its peak RSS above the post-import baseline, so
+runs are comparable across commits.
+
+    python bench_memory.py [--rows 200000] [--tickers 300] [--engine fifo]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from synthetic_export import write_export
+
+def _peak_rss_kb() -> int:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _child(path: str, engine: str) -> None:
+    import main
+    from csv_parser import iter_robinhood_trades
+    from serializers import iter_upload_result
+
+    baseline = _peak_rss_kb()
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        calculate = main._engine(engine)[0]
+        result = calculate(iter_robinhood_trades(f))
+    calculated = _peak_rss_kb()
+    # Drained chunk by chunk, as the streamed response is
+    body_bytes = sum(len(chunk) for chunk in iter_upload_result(result))
+    peak = _peak_rss_kb()
+    print(json.dumps({
+        'engine': engine,
+        'gains': sum(len(g) for g in result['gains'].values()),
+        'unsold_lots': len(result['unsold_lots']),
+        'response_bytes': body_bytes,
+        'baseline_rss_kb': baseline,
+        'peak_rss_kb': peak,
+        'parse_calculate_rss_kb': calculated - baseline,
+        'pipeline_rss_kb': peak - baseline,
+    }))
+
+def run(rows: int = 200000, tickers: int = 300, engine: str = 'fifo') -> dict:
+    """Run the pipeline over a fresh synthetic export in a child process; returns its report."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'export.csv')
+        write_export(path, rows, tickers)
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', path, '--engine', engine],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True,
+        )
+    if proc.returncode:
+        raise RuntimeError(f"{engine} run failed:\n{proc.stderr}")
+    report = json.loads(proc.stdout.strip().splitlines()[-1])
+    report['rows'] = rows
+    return report
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--rows', type=int, default=200000)
+    ap.add_argument('--tickers', type=int, default=300)
+    ap.add_argument('--engine', default='fifo')
+    ap.add_argument('--child', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        _child(args.child, args.engine)
+        return
+    print(json.dumps(run(args.rows, args.tickers, args.engine), indent=2))
+
+if __name__ == '__main__':
+    main()
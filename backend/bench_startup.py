@@ -0,0 +1,197 @@
+"""
+Startup benchmark: how long a fresh worker takes to import the app and to
+answer its first request on each endpoint.
+
+Every (mode, endpoint) pair runs in a new interpreter, so each first request
+pays for exactly the lazy imports and one-time setup it triggers:
+
+    lazy    import main, then the first request (what a worker does with
+            GUNICORN_PRELOAD=0)
+    warm    import main, run main.warm_up() and gc.freeze() first (what a
+            preloaded gunicorn master does before forking), then the first
+            request
+
+Each run records three stages: 'import' (import main), 'warm_up' (warm mode
+only) and 'first_request'. Quotes come from a fake provider that loads the
+real quote dependencies on its first call, like yfinance does, without going
+to the network. Results (best of --repeat per stage) are printed as JSON;
+--out and --baseline/--tolerance work as in bench.py.
+
+    python bench_startup.py --out startup.json
+    python bench_startup.py --baseline startup.json --tolerance 0.5
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ('lazy', 'warm')
+
+# Endpoint name -> (method, path); request bodies are built in _request()
+ENDPOINTS = {
+    'upload': ('POST', '/api/upload'),
+    'upload_vectorized': ('POST', '/api/upload?engine=vectorized'),
+    'upload_batch': ('POST', '/api/upload_batch'),
+    'plan_sale': ('POST', '/api/plan_sale'),
+    'get_price': ('GET', '/api/get_price?tickers=AAPL,MSFT'),
+    'metrics': ('GET', '/metrics'),
+}
+
+def _request(client, endpoint: str, fixture: dict):
+    method, path = ENDPOINTS[endpoint]
+    if endpoint.startswith('upload'):
+        data = fixture['export'].encode('utf-8')
+        field = 'files' if endpoint == 'upload_batch' else 'file'
+        return client.post(path, data={field: (io.BytesIO(data), 'export.csv')},
+                           content_type='multipart/form-data')
+    if endpoint == 'plan_sale':
+        ticker = fixture['lots'][0]['instrument'] if fixture['lots'] else 'AAPL'
+        return client.post(path, json={'lots': fixture['lots'],
+                                       'queries': [{'ticker': ticker, 'quantity': 1, 'price': 100.0}]})
+    return client.open(path, method=method)
+
+class _FakeQuotes:
+    """Quote provider for the child: fixed prices, loading the real quote dependencies once."""
+
+    def fetch(self, symbols: list) -> dict:
+        from price_provider import load_dependencies
+        load_dependencies()
+        return {sym: 100.0 for sym in symbols}
+
+def _child(mode: str, endpoint: str, fixture_path: str) -> list:
+    """Runs in the fresh interpreter: time the import, warm-up and first request."""
+    with open(fixture_path, encoding='utf-8') as f:
+        fixture = json.load(f)
+    start = time.perf_counter()
+    import main
+    records = [_record(mode, 'import', None, time.perf_counter() - start)]
+    if mode == 'warm':
+        start = time.perf_counter()
+        main.warm_up()
+        # As gunicorn.conf.py's when_ready hook does before forking
+        gc.freeze()
+        records.append(_record(mode, 'warm_up', None, time.perf_counter() - start))
+    main.price_cache.provider = _FakeQuotes()
+    client = main.app.test_client()
+    start = time.perf_counter()
+    resp = _request(client, endpoint, fixture)
+    resp.get_data()
+    elapsed = time.perf_counter() - start
+    if resp.status_code >= 400:
+        raise RuntimeError(f"{endpoint}: HTTP {resp.status_code}")
+    records.append(_record(mode, 'first_request', endpoint, elapsed))
+    return records
+
+def _record(mode, stage, endpoint, seconds) -> dict:
+    return {'mode': mode, 'stage': stage, 'endpoint': endpoint, 'seconds': round(seconds, 6)}
+
+def _fixture(path: str, rows: int, tickers: int, seed: int) -> None:
+    """Write the child's inputs: a synthetic export and the unsold lots it leaves."""
+    from synthetic_export import write_export
+    import main
+
+    out = io.StringIO()
+    write_export(out, rows, tickers=tickers, seed=seed)
+    export = out.getvalue()
+    resp = main.app.test_client().post('/api/upload', data={'file': (io.BytesIO(export.encode('utf-8')), 'x.csv')},
+                                       content_type='multipart/form-data')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'export': export, 'lots': resp.get_json()['unsold_lots'][:200]}, f)
+
+def run(modes, endpoints, repeat: int = 3, rows: int = 2000, tickers: int = 50, seed: int = 1) -> list:
+    """Best seconds per (mode, stage, endpoint) over `repeat` fresh interpreters per pair."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        fixture = os.path.join(tmp, 'fixture.json')
+        _fixture(fixture, rows, tickers, seed)
+        # Keep children off shared state: their own job directory, no quote store
+        env = dict(os.environ, JOB_DIR=os.path.join(tmp, 'jobs'))
+        env.pop('QUOTE_STORE_PATH', None)
+        env.pop('QUOTE_HTTP_URL', None)
+        for mode in modes:
+            for endpoint in endpoints:
+                for _ in range(repeat):
+                    proc = subprocess.run(
+                        [sys.executable, os.path.join(here, 'bench_startup.py'), '--child', mode, endpoint, fixture],
+                        cwd=here, env=env, capture_output=True, text=True)
+                    if proc.returncode:
+                        raise RuntimeError(f"{mode}/{endpoint} run failed:\n{proc.stderr}")
+                    for r in json.loads(proc.stdout.splitlines()[-1]):
+                        key = (r['mode'], r['stage'], r['endpoint'] if r['stage'] == 'first_request' else None)
+                        if key not in best or r['seconds'] < best[key]['seconds']:
+                            best[key] = r
+    return list(best.values())
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """Human-readable lines for stages slower than baseline * (1 + tolerance)."""
+    key = lambda r: (r['mode'], r['stage'], r['endpoint'])
+    before = {key(r): r for r in baseline}
+    slower = []
+    for r in results:
+        old = before.get(key(r))
+        if old is None or not old['seconds']:
+            continue
+        ratio = r['seconds'] / old['seconds']
+        if ratio > 1 + tolerance:
+            slower.append(f"{r['stage']} ({r['mode']}, {r['endpoint'] or '-'}): "
+                          f"{old['seconds']:.4f}s -> {r['seconds']:.4f}s (x{ratio:.2f})")
+    return slower
+
+def _meta() -> dict:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--child':
+        print(json.dumps(_child(*sys.argv[2:])))
+        return
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--modes', default=','.join(MODES))
+    ap.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--rows', type=int, default=2000, help='rows in the uploaded synthetic export')
+    ap.add_argument('--tickers', type=int, default=50)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', help='write results JSON here as well as stdout')
+    ap.add_argument('--baseline', help='results JSON from an earlier run to compare against')
+    ap.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown ratio over baseline')
+    args = ap.parse_args()
+
+    modes = [m for m in args.modes.split(',') if m]
+    endpoints = [e for e in args.endpoints.split(',') if e]
+    unknown = [m for m in modes if m not in MODES] + [e for e in endpoints if e not in ENDPOINTS]
+    if unknown:
+        ap.error(f"unknown mode(s) or endpoint(s): {', '.join(unknown)}")
+
+    report = {
+        'meta': _meta(),
+        'results': run(modes, endpoints, args.repeat, args.rows, args.tickers, args.seed),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            slower = compare(report['results'], json.load(f)['results'], args.tolerance)
+        for line in slower:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
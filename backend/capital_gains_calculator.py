@@ -1,215 +1,656 @@
-from collections import defaultdict
-from datetime import datetime
+import heapq
+import multiprocessing
+import os
+import tempfile
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import partial
+from date_parser import DATE_FORMATS, default_parser
+from lot_inventory import RELIEF_METHODS, new_inventory
+from portfolio_snapshot import FifoState, OutOfOrderDelta, dump_snapshot, load_snapshot
+from records import Lot, RealizedGain, Trade, as_trade
 
-DATE_FORMATS = [
-    "%m/%d/%Y",
-    "%m/%d/%y",
-    "%Y-%m-%d",
-    "%Y-%m-%d %H:%M",
-    "%Y-%m-%d %H:%M:%S",
-    "%m/%d/%Y %H:%M",
-    "%m/%d/%Y %H:%M:%S",
-]
+# Bump whenever a change alters results, so cached responses are not reused
+ENGINE_VERSION = '5'
 
-def _parse_date(s: str) -> datetime:
+def _parse_date(s: str) -> date:
     """
-    Parse a date string from multiple common formats into a datetime.
+    Parse a date string from multiple common formats into a date.
+    Uses the shared memoizing parser, so repeated strings are parsed once.
     """
-    raw = (s or "").strip()
-    for fmt in DATE_FORMATS:
-        try:
-            return datetime.strptime(raw, fmt)
-        except ValueError:
-            pass
-    if " " in raw:
-        token = raw.split(" ", 1)[0]
-        for fmt in DATE_FORMATS:
-            try:
-                return datetime.strptime(token, fmt)
-            except ValueError:
-                pass
-    # Fallback: expect mm/dd/YYYY
-    return datetime.strptime(raw, "%m/%d/%Y")
-
-def calculate_capital_gains_summary(all_capital_gains_by_instrument):
-    """Calculates a summary of capital gains split by past vs current year realized trades."""
-    today = datetime.today()
-    current_year = today.year
+    d = default_parser.parse(s)
+    if d is None:
+        raise ValueError(f"Unrecognized date: {s!r}")
+    return d
+
+def _trade_date(t: Trade) -> date:
+    """Date of a trade: the parser's `date` when present, otherwise parsed from activity_date."""
+    d = t.date
+    return d if d is not None else _parse_date(t.activity_date)
 
+# Report total kinds accumulated per (year, kind) during the FIFO pass
+REPORT_KINDS = ('short_term', 'long_term', 'dividends')
+
+def _summary_from_totals(totals_by_instrument: dict) -> dict:
+    """
+    The upload summary from each instrument's running totals {(year, kind):
+    amount}: realized gains split into past vs current year, and a per-year
+    breakdown (short/long term gains and dividend income), overall and per
+    instrument. Runs over the accumulator cells, never over the gains.
+    """
+    current_year = datetime.today().year
     past_gains = 0.0
     current_year_gains = 0.0
-
-    for instrument, gains in all_capital_gains_by_instrument.items():
-        for gain in gains:
-            sell_date = _parse_date(gain['sell_date'])
-            if sell_date.year < current_year:
-                past_gains += gain['gain_loss']
+    by_year = {}
+    for instrument, totals in totals_by_instrument.items():
+        for (year, kind), amount in sorted(totals.items()):
+            year_totals = by_year.get(year)
+            if year_totals is None:
+                year_totals = by_year[year] = dict.fromkeys(REPORT_KINDS, 0.0)
+                year_totals['instruments'] = {}
+            year_totals[kind] += amount
+            inst_totals = year_totals['instruments'].get(instrument)
+            if inst_totals is None:
+                inst_totals = year_totals['instruments'][instrument] = dict.fromkeys(REPORT_KINDS, 0.0)
+            inst_totals[kind] += amount
+            if kind == 'dividends':
+                continue
+            if year < current_year:
+                past_gains += amount
             else:
-                current_year_gains += gain['gain_loss']
-
+                current_year_gains += amount
     return {
         'past_gains': past_gains,
         'current_year_gains': current_year_gains,
+        'by_year': {str(year): by_year[year] for year in sorted(by_year)},
     }
 
-def _stable_lot_id(instrument: str, buy_dt: datetime, seq: int) -> str:
+def _stable_lot_id(instrument: str, buy_dt: date, seq: int) -> str:
     """
     Build a stable lot id from instrument, ISO date, and a per-date sequence.
     Example: AAPL-20230110-0
     """
     return f"{instrument}-{buy_dt.strftime('%Y%m%d')}-{seq}"
 
-def calculate_capital_gains(trades):
+# Trade codes the engine processes, in same-day processing order: splits first
+# (effective before trading), then buys, then sells. Dividends (CDIV) only add
+# to the report totals, so they go last.
+_EVENT_ORDER = {'SPL': 0, 'Buy': 1, 'Sell': 2, 'CDIV': 3}
+
+def _group_events(trades) -> dict:
+    """
+    Group trades by instrument in a single pass, so `trades` may be a one-shot
+    generator (e.g. a streamed upload). Buy, Sell, SPL and CDIV trades are the
+    events themselves (no per-event copy); other codes only register the
+    instrument. Legacy trade dicts are accepted and converted.
+    """
+    events_by_instrument = defaultdict(list)
+    for t in trades:
+        t = as_trade(t)
+        events = events_by_instrument[t.instrument]
+        if t.trans_code not in _EVENT_ORDER:
+            continue
+        t.date = _trade_date(t)
+        events.append(t)
+    return events_by_instrument
+
+def _event_key(e) -> tuple:
+    return (e.date, _EVENT_ORDER[e.trans_code])
+
+# A loss is a wash sale when replacement shares are bought this many days
+# before or after the sale (a 61-day window around the sale date)
+WASH_SALE_DAYS = 30
+_WASH_WINDOW = timedelta(days=WASH_SALE_DAYS)
+
+class _WashSales:
+    """
+    Wash-sale matching for one instrument, driven by the FIFO pass as it walks
+    the sorted events. Two sliding windows replace an all-pairs search:
+
+    - recent: buys of the last 30 days with replacement shares still unused,
+      matched against a loss sale when it happens;
+    - pending: loss sales of the last 30 days with loss shares still
+      unmatched, matched against each later buy.
+
+    Both are deques in date order, trimmed from the front as the event date
+    moves on, and every share is used as a replacement at most once, so each
+    entry is pushed and popped once: linear in the number of events.
+
+    The disallowed loss is recorded on the sale's RealizedGain, taken out of
+    the report totals and added to the replacement lot's cost basis (spread
+    over the lot), so it is realized when those shares are sold. Shares the
+    sale itself drew from are never its own replacements. Holding periods
+    are not tacked onto the replacement lots.
+    """
+
+    __slots__ = ('totals', 'recent', 'pending')
+
+    def __init__(self, totals):
+        self.totals = totals
+        self.recent = deque()   # [buy date, lot, replacement shares left]
+        self.pending = deque()  # [sell date, loss shares left, loss per share, gain, totals key]
+
+    def buy(self, lot: Lot) -> None:
+        pending = self.pending
+        start = lot.date - _WASH_WINDOW
+        while pending and pending[0][0] < start:
+            pending.popleft()
+        shares = lot.quantity
+        while shares > 0 and pending:
+            entry = pending[0]
+            n = min(shares, entry[1])
+            self._disallow(entry[3], entry[4], lot, entry[2] * n)
+            shares -= n
+            entry[1] -= n
+            if entry[1] <= 0:
+                pending.popleft()
+        if shares > 0:
+            self.recent.append([lot.date, lot, shares])
+
+    def split(self, ratio: float) -> None:
+        """Restate both windows in post-split shares."""
+        for entry in self.recent:
+            entry[2] *= ratio
+        for entry in self.pending:
+            entry[1] *= ratio
+            entry[2] /= ratio
+
+    def sell(self, sell_date: date, gains: list, last_lot: Lot) -> None:
+        """Match the loss rows of one sale; last_lot is the last lot it drew from."""
+        recent = self.recent
+        start = sell_date - _WASH_WINDOW
+        # Lots the sale drew from are the oldest open lots, so any still in the
+        # window are at the front: used up ones, then possibly last_lot
+        while recent and (recent[0][0] < start or recent[0][1].quantity <= 0):
+            recent.popleft()
+        # Shares still held in last_lot replace losses on the other lots the
+        # sale drew from (its last row is last_lot's own)
+        held = None
+        if recent and recent[0][1] is last_lot:
+            held = recent.popleft()
+            held[2] = min(held[2], last_lot.quantity)
+        for gain in gains:
+            if gain.gain_loss >= 0:
+                continue
+            shares = gain.quantity
+            per_share = -gain.gain_loss / shares
+            key = (sell_date.year, gain.gain_type)
+            if held is not None and gain is not gains[-1]:
+                shares = self._replace(gain, key, held, shares, per_share)
+            while shares > 0 and recent:
+                entry = recent[0]
+                shares = self._replace(gain, key, entry, shares, per_share)
+                if entry[2] <= 0:
+                    recent.popleft()
+            if shares > 0:
+                self.pending.append([sell_date, shares, per_share, gain, key])
+        if held is not None and held[2] > 0:
+            recent.appendleft(held)
+
+    def _replace(self, gain: RealizedGain, key: tuple, entry: list, shares: float, per_share: float) -> float:
+        """Match up to `shares` loss shares against a recent entry; returns the shares left."""
+        n = min(shares, entry[2])
+        if n > 0:
+            self._disallow(gain, key, entry[1], per_share * n)
+            entry[2] -= n
+        return shares - n
+
+    def _disallow(self, gain: RealizedGain, key: tuple, lot: Lot, amount: float) -> None:
+        gain.disallowed_loss += amount
+        self.totals[key] += amount
+        lot.price += amount / lot.quantity
+
+def _process_instrument(instrument: str, events: list, state: FifoState = None, wash_sales: bool = False,
+                        relief: str = 'fifo', selections: dict = None):
+    """
+    Run the FIFO engine over one instrument's events, continuing from `state`
+    (a FifoState restored from a snapshot) when given, else from nothing.
+    Returns (gains, unsold_lots, state) as RealizedGain and Lot records and
+    the FifoState the run ended in. Realized gains per (sell year, term) and
+    dividends per year are added to state.totals in the same pass. With
+    wash_sales=True, wash-sale losses are disallowed as they are found (see
+    _WashSales); the windows are not part of the state. `relief` picks the
+    lot a sell draws from (see lot_inventory.RELIEF_METHODS); for 'specific',
+    selections[instrument] maps sell dates to the lot ids designated for them.
+    """
+    events.sort(key=_event_key)
+
+    # Event-driven FIFO inventory and gains
+    if state is None:
+        state = FifoState(buy_lots=new_inventory(relief))
+    buy_lots = state.buy_lots
+    date_seq = state.date_seq  # sequence per date for stable lot ids
+    totals = state.totals
+    capital_gains = []
+    wash = _WashSales(totals) if wash_sales else None
+    disallowed = 0.0 if wash_sales else None
+    designated = (selections or {}).get(instrument) if relief == 'specific' else None
+
+    for ev in events:
+        if ev.trans_code == 'Buy':
+            buy_dt = ev.date
+            seq = date_seq[buy_dt]
+            lot_id = _stable_lot_id(instrument, buy_dt, seq)
+            date_seq[buy_dt] += 1
+            # activity_date keeps the original string for the UI; price is the
+            # cost basis per share and quantity the remaining qty
+            lot = Lot(lot_id, instrument, ev.activity_date, buy_dt, ev.quantity, ev.price)
+            buy_lots.append(lot)
+            if wash is not None:
+                wash.buy(lot)
+
+        elif ev.trans_code == 'SPL':
+            # Proportionally scale all open lots
+            ratio = buy_lots.apply_split(ev.extra_shares or 0.0)
+            if ratio and wash is not None:
+                wash.split(ratio)
+
+        elif ev.trans_code == 'Sell':
+            sell_quantity = ev.quantity
+            sell_date = ev.date
+            sell_price = ev.price
+            short_key = (sell_date.year, 'short_term')
+            long_key = (sell_date.year, 'long_term')
+            first = len(capital_gains)
+            if designated is not None:
+                buy_lots.select(designated.get(sell_date, ()))
+
+            while sell_quantity > 0 and buy_lots:
+                buy = buy_lots.head()
+                buy_quantity = buy.quantity
+                buy_price = buy.price
+
+                quantity_to_sell = min(sell_quantity, buy_quantity)
+                gain_loss = (sell_price - buy_price) * quantity_to_sell
+
+                holding_period_days = (sell_date - buy.date).days
+                gain_type = 'long_term' if holding_period_days > 365 else 'short_term'
+
+                capital_gains.append(RealizedGain(
+                    instrument, ev.activity_date, buy.activity_date, quantity_to_sell,
+                    buy_price, sell_price, gain_loss, gain_type, disallowed,
+                ))
+                totals[long_key if holding_period_days > 365 else short_key] += gain_loss
+
+                # Update quantities; a fully used lot is dropped from the queue
+                sell_quantity -= quantity_to_sell
+                buy_lots.consume(quantity_to_sell)
+
+            # Extra sells beyond total buys (if any) are ignored.
+            if wash is not None and len(capital_gains) > first:
+                wash.sell(sell_date, capital_gains[first:], buy)
+
+        elif ev.trans_code == 'CDIV':
+            totals[(ev.date.year, 'dividends')] += ev.amount
+
+    # Dividends do not touch the lots, so the resume point is the last lot event
+    for ev in reversed(events):
+        if ev.trans_code != 'CDIV':
+            state.last_key = _event_key(ev)
+            break
+
+    # Remaining buy lots are unsold inventory
+    unsold_lots = [lot for lot in buy_lots if lot.quantity > 0]
+
+    return capital_gains, unsold_lots, state
+
+# Instruments are sharded across a process pool once an upload has at least this
+# many events and instruments (and the host has more than one core to use).
+PARALLEL_MIN_EVENTS = int(os.environ.get('GAINS_PARALLEL_MIN_EVENTS', '200000'))
+PARALLEL_MIN_INSTRUMENTS = int(os.environ.get('GAINS_PARALLEL_MIN_INSTRUMENTS', '8'))
+# Each gunicorn worker has its own pool, so by default the cores are split
+# between the WEB_CONCURRENCY workers (see gunicorn.conf.py)
+WEB_WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+PARALLEL_WORKERS = (int(os.environ.get('GAINS_PARALLEL_WORKERS', '0'))
+                    or max(1, (os.cpu_count() or 1) // WEB_WORKERS))
+# Pool processes come from a fork server, not a fork of the threaded worker
+PARALLEL_START_METHOD = os.environ.get('GAINS_PARALLEL_START_METHOD', 'forkserver')
+# Batches per worker: more batches balance load better, fewer amortize IPC
+PARALLEL_BATCHES_PER_WORKER = 4
+
+_pool = None
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Process pool shared by all requests in this (gunicorn worker) process."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PARALLEL_WORKERS,
+                                    mp_context=multiprocessing.get_context(PARALLEL_START_METHOD))
+    return _pool
+
+def _should_parallelize(events_by_instrument: dict) -> bool:
+    if PARALLEL_WORKERS < 2 or len(events_by_instrument) < PARALLEL_MIN_INSTRUMENTS:
+        return False
+    total = sum(len(events) for events in events_by_instrument.values())
+    return total >= PARALLEL_MIN_EVENTS
+
+def _batch_instruments(events_by_instrument: dict, n_batches: int) -> list:
+    """
+    Pack instruments into at most n_batches batches of similar event counts.
+    Largest instruments are placed first, each into the currently lightest
+    batch, so many small tickers share one task instead of paying IPC each.
+    """
+    batches = [[] for _ in range(max(1, n_batches))]
+    heap = [(0, i) for i in range(len(batches))]
+    by_size = sorted(events_by_instrument.items(), key=lambda kv: len(kv[1]), reverse=True)
+    for instrument, events in by_size:
+        load, i = heapq.heappop(heap)
+        batches[i].append((instrument, events))
+        heapq.heappush(heap, (load + len(events), i))
+    return [b for b in batches if b]
+
+def _process_batch(batch: list, keep_state: bool = False, **options) -> list:
+    """
+    Pool task: run the FIFO engine for each (instrument, events) in batch
+    with the run's options (see _run_options).
+    Full FIFO states are only sent back when a snapshot needs them; otherwise
+    just their report totals.
+    """
+    results = []
+    for instrument, events in batch:
+        gains, unsold, state = _process_instrument(instrument, events, **options)
+        results.append((instrument, (gains, unsold, state if keep_state else FifoState(totals=state.totals))))
+    return results
+
+def _process_parallel(events_by_instrument: dict, keep_state: bool = False, **options) -> list:
+    """
+    Process instruments on the shared pool and return per-instrument results
+    in the same order as events_by_instrument, so output matches a serial run.
+    """
+    batches = _batch_instruments(events_by_instrument, PARALLEL_WORKERS * PARALLEL_BATCHES_PER_WORKER)
+    results = {}
+    task = partial(_process_batch, keep_state=keep_state, **options)
+    for batch_result in _get_pool().map(task, batches):
+        results.update(batch_result)
+    return [results[instrument] for instrument in events_by_instrument]
+
+def _run_options(snapshot: bool, wash_sales: bool, relief: str, selections) -> dict:
+    """
+    Validated engine options for _process_instrument. Snapshots and wash
+    sales rely on FIFO relief: resumed runs rebuild FIFO queues, and wash-sale
+    windows assume sells draw from the oldest lots.
+    """
+    if relief not in RELIEF_METHODS:
+        raise ValueError(f"Unknown lot relief method: {relief}")
+    if relief != 'fifo' and (snapshot or wash_sales):
+        raise ValueError(f"{'Snapshots' if snapshot else 'Wash sales'} require fifo lot relief")
+    options = {'wash_sales': wash_sales, 'relief': relief}
+    if relief == 'specific':
+        options['selections'] = {
+            instrument: {(d if isinstance(d, date) else date.fromisoformat(d)): list(lot_ids)
+                         for d, lot_ids in by_date.items()}
+            for instrument, by_date in (selections or {}).items()
+        }
+    return options
+
+def calculate_capital_gains(trades, parallel=None, snapshot=False, wash_sales=False, relief='fifo',
+                            selections=None, progress=None):
     """
     Calculates realized capital gains using FIFO and returns:
-    - gains: { instrument: [ {sell_date, buy_date, quantity, buy_price, sell_price, gain_loss, gain_type} ] }
-    - summary: { past_gains, current_year_gains }
-    - unsold_lots: [ { lotId, instrument, qty, costBasisPerShare, purchaseDate } ]
+    - gains: { instrument: [ RealizedGain(sell_date, buy_date, quantity, buy_price, sell_price, gain_loss, gain_type) ] }
+    - summary: { past_gains, current_year_gains, by_year: { "2024": { short_term, long_term,
+                 dividends, instruments: { "AAPL": { short_term, long_term, dividends } } } } }
+    - unsold_lots: [ Lot(lot_id, instrument, quantity, price, activity_date) ]  (see Lot.to_dict for the API shape)
     - remaining_tickers: [ "AAPL", "MSFT", ... ]
     Splits (SPL) are handled as extra shares credited on the split date. We compute the
     split ratio from current holdings: ratio = 1 + extra_shares / pre_split_total_qty,
-    and proportionally adjust all open lots (qty *= ratio, price /= ratio).
+    and proportionally adjust all open lots (qty *= ratio, price /= ratio). Open lots are
+    kept in a LotQueue, which relieves the oldest lot in O(1).
+    Instruments are independent, so large uploads are processed on a process pool;
+    parallel=None decides from the PARALLEL_MIN_* thresholds, True/False forces it.
+    With snapshot=True the result also has a 'snapshot' (see portfolio_snapshot)
+    that calculate_capital_gains_delta() can resume from.
+    With wash_sales=True, losses on sales with replacement shares bought
+    within 30 days either side are disallowed: each gain row carries its
+    'disallowed_loss', the summary counts only allowed losses and the
+    disallowed amount moves into the replacement lots' cost basis.
+    `relief` picks the lot relief method instead of FIFO ('lifo', 'hifo',
+    'lofo' or 'specific'). With 'specific', selections = {instrument:
+    {sell date (date or ISO string): [lot ids]}} designates the lots each
+    day's sells draw from first, by the ids _stable_lot_id assigns; undesignated
+    shares fall back to FIFO and unknown ids raise LotSelectionError.
+    progress(done, total) is called as each instrument's results come in.
     """
-    # Group trades by instrument
-    trades_by_instrument = defaultdict(list)
-    for trade in trades:
-        trades_by_instrument[trade['instrument']].append(trade)
+    options = _run_options(snapshot, wash_sales, relief, selections)
+    events_by_instrument = _group_events(trades)
 
-    all_capital_gains = {}
-    all_unsold_lots = []
+    if parallel is None:
+        parallel = _should_parallelize(events_by_instrument)
+    instruments = list(events_by_instrument)
+    if parallel:
+        per_instrument = _process_parallel(events_by_instrument, keep_state=snapshot, **options)
+    else:
+        # Pop each instrument's events as it is processed so its trades can be
+        # freed while later instruments run
+        per_instrument = (
+            _process_instrument(instrument, events_by_instrument.pop(instrument), **options)
+            for instrument in instruments
+        )
 
-    for instrument, instrument_trades in trades_by_instrument.items():
-        # Build chronological event list: Buy, Sell, SPL (ignore CDIV for gains)
-        events = []
-        for t in instrument_trades:
-            code = t.get('trans_code')
-            if code not in ('Buy', 'Sell', 'SPL'):
-                continue
-            dt = _parse_date(t['activity_date'])
-            if code == 'Buy':
-                events.append({
-                    'type': 'Buy',
-                    'date': dt,
-                    'activity_date': t['activity_date'],
-                    'quantity': float(t.get('quantity', 0.0)),
-                    'price': float(t.get('price', 0.0)),
-                })
-            elif code == 'Sell':
-                events.append({
-                    'type': 'Sell',
-                    'date': dt,
-                    'activity_date': t['activity_date'],
-                    'quantity': float(t.get('quantity', 0.0)),
-                    'price': float(t.get('price', 0.0)),
-                })
-            elif code == 'SPL':
-                events.append({
-                    'type': 'SPL',
-                    'date': dt,
-                    'activity_date': t['activity_date'],
-                    'extra_shares': float(t.get('extra_shares', 0.0)),
-                })
-
-        # Order events: splits first on a given day (effective before trading), then buys, then sells
-        type_order = {'SPL': 0, 'Buy': 1, 'Sell': 2}
-        events.sort(key=lambda e: (e['date'], type_order[e['type']]))
-
-        # Event-driven FIFO inventory and gains
-        buy_lots = []
-        date_seq = defaultdict(int)  # sequence per date for stable lot ids
-        capital_gains = []
-
-        for ev in events:
-            if ev['type'] == 'Buy':
-                buy_dt = ev['date']
-                seq = date_seq[buy_dt.date()]
-                lot_id = _stable_lot_id(instrument, buy_dt, seq)
-                date_seq[buy_dt.date()] += 1
-
-                buy_lots.append({
-                    'lotId': lot_id,
-                    'instrument': instrument,
-                    'activity_date': ev['activity_date'],  # keep original string for UI
-                    'price': ev['price'],                  # cost basis per share
-                    'quantity': ev['quantity'],            # remaining qty
-                })
-
-            elif ev['type'] == 'SPL':
-                extra = ev.get('extra_shares', 0.0) or 0.0
-                if extra <= 0 or not buy_lots:
-                    # No holdings or no extra shares -> nothing to do
-                    continue
-                pre_total = sum(float(l['quantity']) for l in buy_lots)
-                if pre_total <= 0:
-                    continue
-                ratio = 1.0 + (extra / pre_total)
-                # Proportionally scale all open lots
-                for l in buy_lots:
-                    l['quantity'] = float(l['quantity']) * ratio
-                    # Adjust per-share basis down so total basis stays the same
-                    if ratio != 0:
-                        l['price'] = float(l['price']) / ratio
-
-            elif ev['type'] == 'Sell':
-                sell_quantity = ev['quantity']
-                sell_date = ev['date']
-                sell_price = ev['price']
-
-                while sell_quantity > 0 and buy_lots:
-                    buy = buy_lots[0]
-                    buy_quantity = float(buy['quantity'])
-                    buy_date = _parse_date(buy['activity_date'])
-                    buy_price = float(buy['price'])
-
-                    quantity_to_sell = min(sell_quantity, buy_quantity)
-                    gain_loss = (sell_price - buy_price) * quantity_to_sell
-
-                    holding_period_days = (sell_date - buy_date).days
-                    gain_type = 'long_term' if holding_period_days > 365 else 'short_term'
-
-                    capital_gains.append({
-                        'instrument': instrument,
-                        'sell_date': ev['activity_date'],
-                        'buy_date': buy['activity_date'],
-                        'quantity': quantity_to_sell,
-                        'buy_price': buy_price,
-                        'sell_price': sell_price,
-                        'gain_loss': gain_loss,
-                        'gain_type': gain_type,
-                    })
-
-                    # Update quantities
-                    sell_quantity -= quantity_to_sell
-                    buy['quantity'] = buy_quantity - quantity_to_sell
-
-                    # If the buy lot is fully used, remove it
-                    if buy['quantity'] <= 0:
-                        buy_lots.pop(0)
-
-                # Extra sells beyond total buys (if any) are ignored.
+    return _assemble(instruments, per_instrument, snapshot, progress)
 
+def _assemble(instruments: list, per_instrument, snapshot: bool, progress=None) -> dict:
+    """The calculate_capital_gains() result from per-instrument (gains, unsold, state)."""
+    all_capital_gains = {}
+    all_unsold_lots = []
+    states = {}
+    total = len(instruments)
+    for instrument, (capital_gains, unsold_lots, state) in zip(instruments, per_instrument):
         all_capital_gains[instrument] = capital_gains
+        all_unsold_lots.extend(unsold_lots)
+        states[instrument] = state
+        if progress is not None:
+            progress(len(states), total)
 
-        # Remaining buy lots are unsold inventory
-        for buy in buy_lots:
-            if float(buy['quantity']) > 0:
-                all_unsold_lots.append({
-                    'lotId': buy['lotId'],
-                    'instrument': instrument,
-                    'qty': float(buy['quantity']),
-                    'costBasisPerShare': float(buy['price']),
-                    'purchaseDate': buy['activity_date'],
-                })
-
-    # Build summary
-    summary = calculate_capital_gains_summary(all_capital_gains)
+    # Summary from the totals accumulated during the FIFO pass
+    summary = _summary_from_totals({instrument: state.totals for instrument, state in states.items()})
 
     # Backward compatibility for existing frontend
-    remaining_tickers = sorted(list({lot['instrument'] for lot in all_unsold_lots}))
+    remaining_tickers = sorted(list({lot.instrument for lot in all_unsold_lots}))
 
-    return {
+    result = {
         'gains': all_capital_gains,
         'summary': summary,
         'unsold_lots': all_unsold_lots,
         'remaining_tickers': remaining_tickers,
+    }
+    if snapshot:
+        result['snapshot'] = dump_snapshot(states)
+    return result
+
+def _process_store_batch(path: str, instruments: list, keep_state: bool = False, **options) -> list:
+    """Pool task: like _process_batch, reading each instrument's slice of the store at path."""
+    from trade_store import TradeStore
+    results = []
+    with TradeStore(path) as store:
+        for instrument in instruments:
+            gains, unsold, state = _process_instrument(instrument, store.trades(instrument, _EVENT_ORDER), **options)
+            results.append((instrument, (gains, unsold, state if keep_state else FifoState(totals=state.totals))))
+    return results
+
+def calculate_capital_gains_store(store: 'TradeStore', parallel=None, snapshot=False, wash_sales=False,
+                                  relief='fifo', selections=None, progress=None):
+    """
+    calculate_capital_gains() over a TradeStore, one instrument at a time: an
+    instrument's trades are built from its mapped slice, run, and dropped
+    before the next, so memory follows the largest instrument plus the
+    results. In parallel, workers map the same file and are sent only
+    instrument names, never trades.
+    """
+    options = _run_options(snapshot, wash_sales, relief, selections)
+    counts = {instrument: range(store.count(instrument)) for instrument in store.instruments}
+    if parallel is None:
+        parallel = _should_parallelize(counts)
+    instruments = list(store.instruments)
+    if parallel:
+        batches = _batch_instruments(counts, PARALLEL_WORKERS * PARALLEL_BATCHES_PER_WORKER)
+        names = [[instrument for instrument, _ in batch] for batch in batches]
+        results = {}
+        task = partial(_process_store_batch, store.path, keep_state=snapshot, **options)
+        for batch_result in _get_pool().map(task, names):
+            results.update(batch_result)
+        per_instrument = [results[instrument] for instrument in instruments]
+    else:
+        per_instrument = (
+            _process_instrument(instrument, store.trades(instrument, _EVENT_ORDER), **options)
+            for instrument in instruments
+        )
+    return _assemble(instruments, per_instrument, snapshot, progress)
+
+def calculate_capital_gains_spilled(trades, directory: str = None, parallel=None, snapshot=False,
+                                    wash_sales=False, relief='fifo', selections=None, progress=None):
+    """
+    calculate_capital_gains() for very large histories: the trade stream is
+    written to a temporary TradeStore (in `directory`, default the system
+    temp dir) and computed from the mapping, then the file is removed.
+    """
+    # numpy-backed, so only imported by the uploads that spill
+    from trade_store import TradeStore, write_store
+    fd, path = tempfile.mkstemp(suffix='.cgts', dir=directory)
+    os.close(fd)
+    try:
+        write_store(trades, path)
+        with TradeStore(path) as store:
+            return calculate_capital_gains_store(store, parallel=parallel, snapshot=snapshot, wash_sales=wash_sales,
+                                                 relief=relief, selections=selections, progress=progress)
+    finally:
+        os.remove(path)
+
+class GainsStream:
+    """
+    A calculate_capital_gains() run handed out one instrument at a time, for
+    streamed responses. Iterating yields (instrument, gains, unsold_lots) as
+    each instrument finishes; once exhausted, `summary` and
+    `remaining_tickers` cover the whole run. Only the per-instrument report
+    totals are kept between instruments, so the results never need to be
+    held all at once. Iterate once; close() releases the input early.
+    """
+
+    def __init__(self, per_instrument, on_close=None):
+        self._results = per_instrument
+        self._on_close = on_close
+        self.summary = None
+        self.remaining_tickers = None
+
+    def __iter__(self):
+        totals = {}
+        tickers = set()
+        try:
+            for instrument, (gains, unsold, state) in self._results:
+                totals[instrument] = state.totals
+                tickers.update(lot.instrument for lot in unsold)
+                yield instrument, gains, unsold
+        finally:
+            self.close()
+        self.summary = _summary_from_totals(totals)
+        self.remaining_tickers = sorted(tickers)
+
+    def close(self) -> None:
+        self._results = ()
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close()
+
+def _iter_batches(task, batches):
+    """(instrument, result) pairs from pool tasks, batch by batch as they complete in order."""
+    for batch_result in _get_pool().map(task, batches):
+        yield from batch_result
+
+def stream_capital_gains(trades, parallel=None, wash_sales=False, relief='fifo', selections=None) -> GainsStream:
+    """
+    calculate_capital_gains() as a GainsStream. Trades are read and grouped
+    now (so input errors surface before anything is sent); the FIFO work runs
+    per instrument as the stream is iterated, in input order serially or
+    batch by batch on the pool.
+    """
+    options = _run_options(False, wash_sales, relief, selections)
+    events_by_instrument = _group_events(trades)
+    if parallel is None:
+        parallel = _should_parallelize(events_by_instrument)
+    if parallel:
+        batches = _batch_instruments(events_by_instrument, PARALLEL_WORKERS * PARALLEL_BATCHES_PER_WORKER)
+        events_by_instrument.clear()
+        return GainsStream(_iter_batches(partial(_process_batch, **options), batches))
+    per_instrument = (
+        (instrument, _process_instrument(instrument, events_by_instrument.pop(instrument), **options))
+        for instrument in list(events_by_instrument)
+    )
+    return GainsStream(per_instrument)
+
+def stream_capital_gains_spilled(trades, directory: str = None, parallel=None, wash_sales=False, relief='fifo',
+                                 selections=None) -> GainsStream:
+    """
+    stream_capital_gains() through a temporary TradeStore, like
+    calculate_capital_gains_spilled(): memory follows the largest
+    instrument on the way in as well as out. The store is removed when the
+    stream is exhausted or closed.
+    """
+    from trade_store import TradeStore, write_store
+    options = _run_options(False, wash_sales, relief, selections)
+    fd, path = tempfile.mkstemp(suffix='.cgts', dir=directory)
+    os.close(fd)
+    try:
+        write_store(trades, path)
+        store = TradeStore(path)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    def close():
+        store.close()
+        os.remove(path)
+
+    counts = {instrument: range(store.count(instrument)) for instrument in store.instruments}
+    if parallel is None:
+        parallel = _should_parallelize(counts)
+    if parallel:
+        batches = _batch_instruments(counts, PARALLEL_WORKERS * PARALLEL_BATCHES_PER_WORKER)
+        names = [[instrument for instrument, _ in batch] for batch in batches]
+        return GainsStream(_iter_batches(partial(_process_store_batch, path, **options), names), close)
+    per_instrument = (
+        (instrument, _process_instrument(instrument, store.trades(instrument, _EVENT_ORDER), **options))
+        for instrument in store.instruments
+    )
+    return GainsStream(per_instrument, close)
+
+def calculate_capital_gains_delta(snapshot: dict, trades):
+    """
+    Continue a FIFO run from a snapshot (as returned with snapshot=True) with
+    only the trades that came after it: O(new trades), not O(history).
+    Returns the calculate_capital_gains() shape where 'gains' holds only the
+    gains realized by the new trades, while 'summary', 'unsold_lots' and
+    'remaining_tickers' cover the whole history, plus the next 'snapshot'.
+
+    Each instrument's new events must not sort before the last event already
+    applied to it (same-day events are ordered SPL, Buy, Sell); otherwise the
+    result would differ from a full recomputation and OutOfOrderDelta is raised.
+    """
+    states = load_snapshot(snapshot)
+    events_by_instrument = _group_events(trades)
+
+    for instrument, events in events_by_instrument.items():
+        state = states.get(instrument)
+        if state is None or state.last_key is None or not events:
+            continue
+        first = min(events, key=_event_key)
+        if _event_key(first) < state.last_key:
+            raise OutOfOrderDelta(
+                f"Out-of-order delta: {instrument} {first.trans_code} on {first.activity_date} "
+                f"precedes the snapshot (last event {state.last_key[0].isoformat()})"
+            )
+
+    new_gains = {}
+    for instrument, events in events_by_instrument.items():
+        gains, _, states[instrument] = _process_instrument(instrument, events, states.get(instrument))
+        new_gains[instrument] = gains
+
+    all_unsold_lots = [lot for state in states.values() for lot in state.buy_lots if lot.quantity > 0]
+
+    return {
+        'gains': new_gains,
+        'summary': _summary_from_totals({instrument: state.totals for instrument, state in states.items()}),
+        'unsold_lots': all_unsold_lots,
+        'remaining_tickers': sorted({lot.instrument for lot in all_unsold_lots}),
+        'snapshot': dump_snapshot(states),
     }
\ No newline at end of file
@@ -1,15 +1,9 @@
 import csv
-from datetime import datetime
-
-DATE_FORMATS = [
-    "%m/%d/%Y",
-    "%m/%d/%y",
-    "%Y-%m-%d",
-    "%Y-%m-%d %H:%M",
-    "%Y-%m-%d %H:%M:%S",
-    "%m/%d/%Y %H:%M",
-    "%m/%d/%Y %H:%M:%S",
-]
+import io
+import sys
+from itertools import chain, islice
+from date_parser import DATE_FORMATS, DateParser, default_parser
+from records import Trade
 
 def _normalize_date_str(s: str) -> str:
     """
@@ -18,25 +12,7 @@ def _normalize_date_str(s: str) -> str:
     """
     if not s:
         return s
-    raw = s.strip()
-    # Try as-is
-    for fmt in DATE_FORMATS:
-        try:
-            dt = datetime.strptime(raw, fmt)
-            return dt.strftime("%m/%d/%Y")
-        except ValueError:
-            pass
-    # Try only the date portion before a space (if any)
-    if " " in raw:
-        date_part = raw.split(" ", 1)[0]
-        for fmt in DATE_FORMATS:
-            try:
-                dt = datetime.strptime(date_part, fmt)
-                return dt.strftime("%m/%d/%Y")
-            except ValueError:
-                pass
-    # Last resort: return original (calculator will try to parse too)
-    return raw
+    return default_parser.normalize(s)
 
 def _clean_money(v: str) -> float:
     """
@@ -45,12 +21,9 @@ def _clean_money(v: str) -> float:
     if v is None:
         return 0.0
     s = str(v).strip()
-    neg = False
-    if "(" in s and ")" in s:
-        neg = True
-    s = s.replace("$", "").replace(",", "").replace("(", "").replace(")", "")
+    neg = "(" in s and ")" in s
     try:
-        val = float(s)
+        val = float(s.replace("$", "").replace(",", "").replace("(", "").replace(")", ""))
     except ValueError:
         val = 0.0
     return -val if neg else val
@@ -89,74 +62,314 @@ def _normalize_trans_code(raw: str, description: str = "") -> str:
         return "SPL"
     return (raw or "").strip()
 
-def parse_robinhood_csv(file_path):
-    """Parses a Robinhood CSV file and returns a list of trades."""
-    trades = []
-    with open(file_path, 'r', newline='', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        header = next(reader, None)  # Skip header if present
+# Columns read from an export, by header name (matched case-insensitively)
+COLUMNS = {
+    'activity_date': 'activity date',
+    'instrument': 'instrument',
+    'description': 'description',
+    'trans_code': 'trans code',
+    'quantity': 'quantity',
+    'price': 'price',
+    'amount': 'amount',
+}
+# Positions in the standard Robinhood export, used when the header does not name them
+DEFAULT_COLUMNS = {
+    'activity_date': 0, 'instrument': 3, 'description': 4, 'trans_code': 5,
+    'quantity': 6, 'price': 7, 'amount': 8,
+}
+# Index standing in for an optional column the header lacks: never < len(row)
+_ABSENT = sys.maxsize
+
+def _header_names(header) -> dict:
+    """{lowercased column name: first index} for a header row."""
+    names = {}
+    for i, name in enumerate(header or []):
+        names.setdefault(str(name).strip().lstrip("\ufeff").lower(), i)
+    return names
+
+def column_map(header) -> dict:
+    """
+    {field: column index} from the header row. Falls back to DEFAULT_COLUMNS
+    unless the header names at least the date, instrument and trans code.
+    """
+    names = _header_names(header)
+    mapped = {field: names.get(name) for field, name in COLUMNS.items()}
+    if None in (mapped['activity_date'], mapped['instrument'], mapped['trans_code']):
+        return dict(DEFAULT_COLUMNS)
+    return {field: (_ABSENT if i is None else i) for field, i in mapped.items()}
+
+_TRADE_CODES = frozenset(('Buy', 'Sell', 'CDIV', 'SPL'))
+
+class _RowParser:
+    """
+    Converts CSV rows of one export into Trade records, with columns mapped
+    once from the header. Trans codes are classified through a memo of the
+    (code, description) pairs already seen, so the keyword scans of
+    _normalize_trans_code run once per distinct pair rather than per row.
+    """
+
+    # Distinct (code, description) pairs remembered; descriptions repeat per ticker
+    MEMO_SIZE = 65536
 
+    def __init__(self, columns: dict = None, dates: DateParser = default_parser):
+        cols = columns or DEFAULT_COLUMNS
+        self.i_date = cols['activity_date']
+        self.i_inst = cols['instrument']
+        self.i_desc = cols['description']
+        self.i_code = cols['trans_code']
+        self.i_qty = cols['quantity']
+        self.i_price = cols['price']
+        self.i_amount = cols['amount']
+        # Shortest row that has every mapped column (the fast path needs no length checks)
+        self.full_len = 1 + max(i for i in cols.values() if i != _ABSENT)
+        self.complete = _ABSENT not in cols.values()
+        self.dates = dates
+        self._codes = {}
+
+    def classify(self, raw: str, description: str):
+        """Canonical trade code for a row, or None for non-trade rows."""
+        key = (raw, description)
+        code = self._codes.get(key, False)
+        if code is False:
+            code = _normalize_trans_code(raw, description)
+            if code not in _TRADE_CODES:
+                code = None
+            if len(self._codes) >= self.MEMO_SIZE:
+                self._codes.clear()
+            self._codes[key] = code
+        return code
+
+    def __call__(self, row):
+        """
+        Convert one Robinhood CSV row into a Trade record.
+        Returns None for blank, non-trade, or unparseable rows.
+        The parsed `date` travels with the trade so the calculator never re-parses it;
+        the description is only used to classify the row and is not kept.
+        """
+        if not row:
+            return None
+        n = len(row)
+        try:
+            instrument = row[self.i_inst]
+        except IndexError:
+            return None
+        trans_code = self.classify(
+            row[self.i_code] if n > self.i_code else "",
+            row[self.i_desc] if n > self.i_desc else "",
+        )
+        if trans_code is None:
+            return None
+        instrument = sys.intern(instrument.strip())  # one shared string per ticker
+        try:
+            trade_date, activity_date = self.dates.parse_normalized(row[self.i_date])
+        except IndexError:
+            return None
+
+        if trans_code == 'CDIV':
+            amount = _clean_money(row[self.i_amount]) if n > self.i_amount else 0.0
+            return Trade(activity_date, trade_date, instrument, trans_code, 0.0, 0.0, amount)
+        if trans_code == 'SPL':
+            # Quantity column contains the additional shares credited
+            extra = _clean_number(row[self.i_qty]) if n > self.i_qty else 0.0
+            return Trade(activity_date, trade_date, instrument, 'SPL', extra, 0.0, 0.0)
+        qty = _clean_number(row[self.i_qty]) if n > self.i_qty else 0.0
+        price = _clean_money(row[self.i_price]) if n > self.i_price else 0.0
+        amt = _clean_money(row[self.i_amount]) if n > self.i_amount else qty * price
+        # Some exports may show negative qty for Sell; normalize to positive
+        if qty < 0:
+            qty = abs(qty)
+        return Trade(activity_date, trade_date, instrument, trans_code, qty, price, amt)
+
+def _parse_row(row, dates: DateParser = default_parser):
+    """Convert one row laid out like a standard Robinhood export (see _RowParser)."""
+    return _RowParser(DEFAULT_COLUMNS, dates)(row)
+
+def iter_robinhood_trades(stream):
+    """
+    Lazily parse a Robinhood CSV export from an open text stream.
+    Rows are read one at a time and trades are yielded as they are parsed,
+    so the caller never holds the raw file or a full trade list in memory.
+    Columns are located by header name (standard positions if the header
+    does not name them).
+    """
+    reader = csv.reader(stream)
+    return _iter_robinhood_rows(reader, next(reader, None))
+
+def _iter_robinhood_rows(reader, header):
+    # Per file: locks onto this export's date format and memoizes its trans codes
+    parse = _RowParser(column_map(header), DateParser())
+    if not parse.complete:
         for row in reader:
-            if not row:
-                continue
-            # Typical indices:
-            # 0: Activity Date, 3: Instrument, 4: Description, 5: Trans Code, 6: Quantity, 7: Price, 8: Amount
-            try:
-                activity_date_raw = row[0]
-                instrument = row[3].strip()
-                description = row[4] if len(row) > 4 else ""
-                trans_code = _normalize_trans_code(row[5] if len(row) > 5 else "", description)
-            except IndexError:
-                continue
-
-            if trans_code not in ['Buy', 'Sell', 'CDIV', 'SPL']:
-                continue
-
-            activity_date = _normalize_date_str(activity_date_raw)
-
-            try:
-                if trans_code == 'CDIV':
-                    trade = {
-                        'activity_date': activity_date,
-                        'instrument': instrument,
-                        'trans_code': trans_code,
-                        'quantity': 0.0,
-                        'price': 0.0,
-                        'amount': _clean_money(row[8]) if len(row) > 8 else 0.0,
-                        'description': description,
-                    }
-                elif trans_code == 'SPL':
-                    # Quantity column contains the additional shares credited
-                    extra = _clean_number(row[6]) if len(row) > 6 else 0.0
-                    trade = {
-                        'activity_date': activity_date,
-                        'instrument': instrument,
-                        'trans_code': 'SPL',
-                        'extra_shares': extra,
-                        'description': description,
-                    }
-                else:
-                    qty = _clean_number(row[6]) if len(row) > 6 else 0.0
-                    price = _clean_money(row[7]) if len(row) > 7 else 0.0
-                    amt = _clean_money(row[8]) if len(row) > 8 else qty * price
-                    # Some exports may show negative qty for Sell; normalize to positive
-                    if qty < 0:
-                        qty = abs(qty)
-                    trade = {
-                        'activity_date': activity_date,
-                        'instrument': instrument,
-                        'trans_code': trans_code,
-                        'quantity': qty,
-                        'price': price,
-                        'amount': amt,
-                        'description': description,
-                    }
-                trades.append(trade)
-            except (ValueError, IndexError):
-                # Ignore rows that can't be parsed as trades
-                continue
-
-    return trades
+            trade = parse(row)
+            if trade is not None:
+                yield trade
+        return
+
+    # Fast path for rows that have every column: the _RowParser logic inlined
+    # with everything bound to locals. Short or odd rows go through parse().
+    full_len = parse.full_len
+    i_date, i_inst, i_desc, i_code = parse.i_date, parse.i_inst, parse.i_desc, parse.i_code
+    i_qty, i_price, i_amount = parse.i_qty, parse.i_price, parse.i_amount
+    codes_get = parse._codes.get
+    classify = parse.classify
+    dates = parse.dates.parse_normalized
+    intern = sys.intern
+    money = _clean_money
+    number = _clean_number
+    for row in reader:
+        if len(row) < full_len:
+            trade = parse(row)
+            if trade is not None:
+                yield trade
+            continue
+        raw_code = row[i_code]
+        description = row[i_desc]
+        code = codes_get((raw_code, description), False)
+        if code is False:
+            code = classify(raw_code, description)
+        if code is None:
+            continue
+        trade_date, activity_date = dates(row[i_date])
+        if code == 'Buy' or code == 'Sell':
+            qty = number(row[i_qty])
+            if qty < 0:
+                qty = -qty
+            yield Trade(activity_date, trade_date, intern(row[i_inst].strip()), code,
+                        qty, money(row[i_price]), money(row[i_amount]))
+        elif code == 'CDIV':
+            yield Trade(activity_date, trade_date, intern(row[i_inst].strip()), code,
+                        0.0, 0.0, money(row[i_amount]))
+        else:
+            yield Trade(activity_date, trade_date, intern(row[i_inst].strip()), 'SPL',
+                        number(row[i_qty]), 0.0, 0.0)
+
+# Fidelity "Accounts History" export columns, by header name
+FIDELITY_COLUMNS = {
+    'activity_date': 'run date',
+    'action': 'action',
+    'instrument': 'symbol',
+    'quantity': 'quantity',
+    'price': 'price ($)',
+    'amount': 'amount ($)',
+}
+
+# Fidelity describes each row in its Action text ("YOU BOUGHT APPLE INC (AAPL)
+# (Cash)"); these prefixes map it onto trade codes. Splits are credited as a
+# DISTRIBUTION of the extra shares, like Robinhood's SPL quantity.
+_FIDELITY_ACTIONS = (
+    ('YOU BOUGHT', 'Buy'),
+    ('REINVESTMENT', 'Buy'),
+    ('YOU SOLD', 'Sell'),
+    ('DIVIDEND RECEIVED', 'CDIV'),
+    ('DISTRIBUTION', 'SPL'),
+)
+
+def _fidelity_code(action: str):
+    """Trade code for a Fidelity Action, or None for non-trade rows."""
+    u = (action or "").strip().upper()
+    for prefix, code in _FIDELITY_ACTIONS:
+        if u.startswith(prefix):
+            return code
+    return None
+
+def iter_fidelity_trades(stream):
+    """
+    Lazily parse a Fidelity "Accounts History" CSV export, which has blank
+    lines before its header and a disclaimer after the rows. Money columns
+    are plain signed numbers and sells carry a negative quantity.
+    """
+    reader = csv.reader(stream)
+    header, rows = _find_header(reader)
+    return _iter_fidelity_rows(rows, header)
+
+def _iter_fidelity_rows(reader, header):
+    names = _header_names(header)
+    cols = {field: names.get(name, _ABSENT) for field, name in FIDELITY_COLUMNS.items()}
+    i_date, i_action, i_inst = cols['activity_date'], cols['action'], cols['instrument']
+    i_qty, i_price, i_amount = cols['quantity'], cols['price'], cols['amount']
+    # Rows shorter than this are the notes around the table
+    min_len = 1 + max(i_date, i_action, i_inst)
+    dates = DateParser()
+    codes = {}
+    for row in reader:
+        n = len(row)
+        if n < min_len:
+            continue
+        action = row[i_action]
+        code = codes.get(action, False)
+        if code is False:
+            code = codes[action] = _fidelity_code(action)
+        instrument = row[i_inst].strip()
+        if code is None or not instrument:
+            continue
+        instrument = sys.intern(instrument)
+        trade_date, activity_date = dates.parse_normalized(row[i_date])
+        qty = _clean_number(row[i_qty]) if n > i_qty else 0.0
+        if code == 'CDIV':
+            amount = _clean_money(row[i_amount]) if n > i_amount else 0.0
+            yield Trade(activity_date, trade_date, instrument, code, 0.0, 0.0, amount)
+        elif code == 'SPL':
+            if qty > 0:
+                yield Trade(activity_date, trade_date, instrument, code, qty, 0.0, 0.0)
+        else:
+            qty = abs(qty)
+            price = _clean_money(row[i_price]) if n > i_price else 0.0
+            amount = _clean_money(row[i_amount]) if n > i_amount else 0.0
+            yield Trade(activity_date, trade_date, instrument, code, qty, price, amount)
+
+# Supported export layouts, recognized by the columns their header names
+BROKERS = ('robinhood', 'fidelity')
+
+# Rows scanned for a header before falling back to Robinhood's layout
+HEADER_SCAN_ROWS = 20
+
+def detect_broker(header):
+    """'robinhood' or 'fidelity' for a recognized header row, else None."""
+    names = _header_names(header)
+    if 'run date' in names and 'action' in names and 'symbol' in names:
+        return 'fidelity'
+    if 'activity date' in names and 'trans code' in names:
+        return 'robinhood'
+    return None
+
+def _find_header(reader):
+    """
+    (header, rows): the first recognized header row within HEADER_SCAN_ROWS,
+    and an iterator over the rows after it. If none is recognized, the
+    first row is the header and the scanned rows are replayed.
+    """
+    scanned = []
+    for row in islice(reader, HEADER_SCAN_ROWS):
+        if detect_broker(row) is not None:
+            return row, reader
+        scanned.append(row)
+    if not scanned:
+        return None, reader
+    return scanned[0], chain(scanned[1:], reader)
+
+def iter_export_trades(stream):
+    """
+    (broker, trades) for an export from any broker in BROKERS, detected from
+    its header; trades is a lazy iterator like iter_robinhood_trades().
+    Unrecognized files are read as Robinhood exports by column position.
+    """
+    reader = csv.reader(stream)
+    header, rows = _find_header(reader)
+    if detect_broker(header) == 'fidelity':
+        return 'fidelity', _iter_fidelity_rows(rows, header)
+    return 'robinhood', _iter_robinhood_rows(rows, header)
+
+def open_upload_stream(binary_stream, encoding='utf-8'):
+    """
+    Wrap a binary file-like object (e.g. an uploaded request file) as a text
+    stream suitable for iter_robinhood_trades, without copying it to disk.
+    """
+    return io.TextIOWrapper(binary_stream, encoding=encoding, newline='')
+
+def parse_robinhood_csv(file_path):
+    """Parses a Robinhood CSV file and returns a list of Trade records."""
+    with open(file_path, 'r', newline='', encoding='utf-8') as f:
+        return list(iter_robinhood_trades(f))
 
 if __name__ == '__main__':
     # Example manual test (adjust file path as needed)
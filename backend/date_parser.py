@@ -0,0 +1,79 @@
+from datetime import datetime
+from functools import lru_cache
+
+DATE_FORMATS = [
+    "%m/%d/%Y",
+    "%m/%d/%y",
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y %H:%M:%S",
+]
+
+# Distinct date strings remembered per parser; a multi-decade daily history is ~10k
+MEMO_SIZE = 16384
+
+class DateParser:
+    """
+    Parses activity date strings into `date` objects.
+
+    An export uses one date format throughout, so the first format that matches
+    is locked in and tried before any other. Results are memoized in a bounded
+    LRU, so each distinct string goes through strptime at most once.
+    Formats in DATE_FORMATS never match the same string, so trying the locked
+    format first returns exactly what an in-order scan would.
+    """
+
+    def __init__(self, formats=DATE_FORMATS, memo_size: int = MEMO_SIZE):
+        self.formats = list(formats)
+        self.locked_format = None
+        self._lookup = lru_cache(maxsize=memo_size)(self._parse_uncached)
+
+    def parse(self, s: str):
+        """Return the `date` for s, or None if no known format matches."""
+        return self._lookup((s or "").strip())[0]
+
+    def normalize(self, s: str) -> str:
+        """
+        Normalize s to mm/dd/YYYY. Unparseable values are returned stripped
+        so the caller can still show them.
+        """
+        return self._lookup((s or "").strip())[1]
+
+    def parse_normalized(self, s: str) -> tuple:
+        """(parse(s), normalize(s)) with a single memo lookup."""
+        return self._lookup((s or "").strip())
+
+    def cache_info(self):
+        return self._lookup.cache_info()
+
+    def _match(self, raw: str):
+        locked = self.locked_format
+        if locked is not None:
+            try:
+                return datetime.strptime(raw, locked).date()
+            except ValueError:
+                pass
+        for fmt in self.formats:
+            if fmt == locked:
+                continue
+            try:
+                dt = datetime.strptime(raw, fmt)
+            except ValueError:
+                continue
+            self.locked_format = fmt
+            return dt.date()
+        return None
+
+    def _parse_uncached(self, raw: str):
+        d = self._match(raw) if raw else None
+        # Try only the date portion before a space (if any)
+        if d is None and " " in raw:
+            d = self._match(raw.split(" ", 1)[0])
+        if d is None:
+            return None, raw
+        return d, d.strftime("%m/%d/%Y")
+
+# Shared parser for callers that hand over bare date strings
+default_parser = DateParser()
@@ -0,0 +1,57 @@
+"""
+gunicorn settings, read from the working directory (`gunicorn main:app`).
+
+    GUNICORN_PRELOAD=1   (default) import the app in the master and warm it
+                         up (main.warm_up) before forking: workers start
+                         serving at once and share the loaded modules
+    GUNICORN_PRELOAD=0   each worker imports the app itself; heavy
+                         dependencies then load on the first request that
+                         needs them
+
+bench_startup.py measures both.
+
+    WEB_CONCURRENCY      worker processes (default 1). Set it rather than
+                         passing -w: capital_gains_calculator reads it too
+    GAINS_PARALLEL_WORKERS
+                         processes in each worker's calculation pool
+                         (default: cores // WEB_CONCURRENCY, so the pools
+                         of all workers together use each core once).
+                         Pool processes are started by a fork server
+                         (GAINS_PARALLEL_START_METHOD, default forkserver),
+                         never forked from a worker's running threads
+    METRICS_DIR          where workers share their /metrics counters
+                         (default <tmp>/capgains-metrics-<port>), so a
+                         scrape of any worker reports the whole server.
+                         Emptied when the server starts; give each server
+                         on a host its own directory
+"""
+import gc
+import glob
+import os
+import tempfile
+
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1').lower() not in ('0', 'false', 'no')
+
+# Set before the app (and so metrics.py) is imported, in the master or the workers
+os.environ.setdefault('METRICS_DIR', os.path.join(
+    tempfile.gettempdir(), f"capgains-metrics-{os.environ.get('PORT', '8000')}"))
+
+def on_starting(server):
+    # Counters of a previous run of this server would otherwise be added in
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], '*.json')):
+        os.remove(path)
+
+def worker_exit(server, worker):
+    # Keep the exiting worker's last counters in the totals
+    import metrics
+    metrics.REGISTRY.flush()
+
+def when_ready(server):
+    # Runs in the master once the app is loaded, before any worker is forked
+    if preload_app:
+        import main
+        main.warm_up()
+        # Leave everything loaded so far out of garbage collection, so the
+        # collector never writes to (and so copies) the shared pages
+        gc.freeze()
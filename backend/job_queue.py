@@ -0,0 +1,338 @@
+"""
+Background jobs for large uploads, on one box and without a broker.
+
+A submitted upload is spooled to JOB_DIR and recorded as a row in a
+host-wide SQLite job table (WAL mode, like the quote store), and the
+request returns the job id at once. Runner threads in every gunicorn
+worker claim queued rows atomically and run the job (parse, calculate,
+encode), writing the encoded body next to the upload and reporting
+progress counters to the row as they go. Any worker can then answer
+status and result polls from the table and the result file.
+
+    JOB_DIR            spooled uploads, results and jobs.sqlite
+    JOB_WORKERS        runner threads per worker process (default 1)
+    JOB_QUEUE_DEPTH    queued + running jobs per host before submissions
+                       are refused (default 8)
+    JOB_RESULT_TTL     seconds finished jobs and their results are kept
+"""
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+JOB_DIR = os.environ.get('JOB_DIR') or os.path.join(tempfile.gettempdir(), 'capgains-jobs')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '1'))
+JOB_QUEUE_DEPTH = int(os.environ.get('JOB_QUEUE_DEPTH', '8'))
+JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', '3600'))
+
+# Running jobs' heartbeats are renewed this often; a job whose heartbeat is
+# STALE_AFTER seconds old lost its worker and is failed
+HEARTBEAT_INTERVAL = 5.0
+STALE_AFTER = 60.0
+# Stale and expired jobs are swept at most this often per process, from
+# status polls and the heartbeat thread as well as from submissions
+SWEEP_INTERVAL = 5.0
+# Idle runners look for jobs queued by other processes this often
+POLL_INTERVAL = 1.0
+# Progress counters are written to the table at most this often
+PROGRESS_INTERVAL = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat REAL,
+    rows INTEGER NOT NULL DEFAULT 0,
+    instruments_done INTEGER NOT NULL DEFAULT 0,
+    instruments_total INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+class QueueFull(Exception):
+    """The host already has JOB_QUEUE_DEPTH jobs queued or running."""
+
+class JobStore:
+    """
+    The job table plus each job's spooled upload (<id>.upload) and encoded
+    result (<id>.result) in `directory`.
+    """
+
+    def __init__(self, directory: str = JOB_DIR, max_depth: int = JOB_QUEUE_DEPTH,
+                 ttl: float = JOB_RESULT_TTL):
+        self.directory = directory
+        self.path = os.path.join(directory, 'jobs.sqlite')
+        self.max_depth = max_depth
+        self.ttl = ttl
+        self._local = threading.local()
+        self._swept = float('-inf')
+
+    def _conn(self) -> sqlite3.Connection:
+        # Opened on first use, per thread, and never across a fork
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def upload_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, job_id + '.upload')
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, job_id + '.result')
+
+    def depth(self) -> int:
+        """Queued and running jobs on the host."""
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def submit(self, stream, params: dict) -> str:
+        """
+        Spool a binary upload stream and queue a job for it; returns the job
+        id. Raises QueueFull (before and after spooling, so a burst of
+        submissions cannot overshoot the depth).
+        """
+        self.sweep()
+        if self.depth() >= self.max_depth:
+            raise QueueFull()
+        job_id = uuid.uuid4().hex
+        upload = self.upload_path(job_id)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(upload, 'wb') as f:
+            shutil.copyfileobj(stream, f, 1 << 20)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            full = self.depth() >= self.max_depth
+            if not full:
+                conn.execute("INSERT INTO jobs (id, status, params, created_at) VALUES (?, 'queued', ?, ?)",
+                             [job_id, json.dumps(params), time.time()])
+        finally:
+            conn.execute("COMMIT")
+        if full:
+            os.remove(upload)
+            raise QueueFull()
+        return job_id
+
+    def claim(self, owner: str):
+        """Take the oldest queued job for `owner`: (job id, params), or None."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, params FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', owner = ?, started_at = ?, heartbeat = ? WHERE id = ?",
+                         [owner, now, now, row[0]])
+            return row[0], json.loads(row[1])
+        finally:
+            conn.execute("COMMIT")
+
+    def progress(self, job_id: str, rows: int, instruments_done: int, instruments_total) -> None:
+        self._conn().execute(
+            "UPDATE jobs SET rows = ?, instruments_done = ?, instruments_total = ?, heartbeat = ? WHERE id = ?",
+            [rows, instruments_done, instruments_total, time.time(), job_id])
+
+    def heartbeat(self, owner: str) -> None:
+        """Renew the heartbeat of every job `owner` is running."""
+        self._conn().execute("UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = 'running'",
+                             [time.time(), owner])
+
+    def finish(self, job_id: str, owner: str, error: str = None) -> bool:
+        """
+        Mark a job `owner` is running done (its result file written) or
+        failed with `error`, and remove its upload. False, changing nothing,
+        when the job is no longer running for `owner` (e.g. swept as stale).
+        """
+        finished = self._conn().execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status = 'running' AND owner = ?",
+            ['failed' if error else 'done', error, time.time(), job_id, owner]).rowcount
+        if finished:
+            _remove(self.upload_path(job_id))
+        return bool(finished)
+
+    def get(self, job_id: str):
+        """Status view of a job (what GET /api/jobs/<id> returns), or None."""
+        self.maybe_sweep()
+        row = self._conn().execute(
+            "SELECT status, created_at, started_at, finished_at, rows, instruments_done, instruments_total, error "
+            "FROM jobs WHERE id = ?", [job_id]).fetchone()
+        if row is None:
+            return None
+        status, created, started, finished, rows, done, total, error = row
+        job = {
+            'job_id': job_id,
+            'status': status,
+            'created_at': created,
+            'started_at': started,
+            'finished_at': finished,
+            'progress': {'rows': rows, 'instruments_done': done, 'instruments_total': total},
+        }
+        if error:
+            job['error'] = error
+        return job
+
+    def maybe_sweep(self) -> None:
+        """sweep() unless this process swept within SWEEP_INTERVAL seconds."""
+        if time.monotonic() - self._swept >= SWEEP_INTERVAL:
+            self.sweep()
+
+    def sweep(self) -> None:
+        """Fail running jobs whose worker died and drop finished jobs older than the TTL."""
+        self._swept = time.monotonic()
+        conn = self._conn()
+        now = time.time()
+        stale = conn.execute(
+            "SELECT id, owner FROM jobs WHERE status = 'running' AND heartbeat < ?", [now - STALE_AFTER]).fetchall()
+        for job_id, owner in stale:
+            self.finish(job_id, owner, 'Worker exited before the job finished')
+        expired = [r[0] for r in conn.execute(
+            "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", [now - self.ttl])]
+        for job_id in expired:
+            # Row first: a poll never sees a finished job without its result
+            conn.execute("DELETE FROM jobs WHERE id = ?", [job_id])
+            _remove(self.result_path(job_id))
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class Progress:
+    """
+    Counters one job reports while it runs (rows parsed, instruments done
+    of total), written to the store at most every PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self.rows = 0
+        self.instruments_done = 0
+        self.instruments_total = None
+        self._flushed = 0.0
+
+    def count_rows(self, trades):
+        """Pass trades through, counting them."""
+        for t in trades:
+            self.rows += 1
+            if not self.rows & 0xFFF:
+                self._maybe_flush()
+            yield t
+
+    def instruments(self, done: int, total: int) -> None:
+        """Engine progress callback: `done` of `total` instruments computed."""
+        self.instruments_done = done
+        self.instruments_total = total
+        self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        now = time.monotonic()
+        if now - self._flushed >= PROGRESS_INTERVAL:
+            self.flush()
+            self._flushed = now
+
+    def flush(self) -> None:
+        self.store.progress(self.job_id, self.rows, self.instruments_done, self.instruments_total)
+
+class JobRunner:
+    """
+    Runner threads for one worker process: each claims queued jobs and runs
+    execute(upload_path, params, progress), which returns the encoded body
+    as an iterable of str chunks. Bodies are written to a temporary file and
+    renamed into place before the job is marked done. A heartbeat thread
+    keeps this process's running jobs from being failed as stale, and
+    sweeps the jobs of workers that died.
+    """
+
+    def __init__(self, store: JobStore, execute, workers: int = JOB_WORKERS):
+        self.store = store
+        self.execute = execute
+        self.workers = max(1, workers)
+        self._token = uuid.uuid4().hex[:8]
+        self._wake = threading.Event()
+        self._threads = []
+        self._pid = None
+
+    @property
+    def owner(self) -> str:
+        # Includes the pid so forked workers never share an owner
+        return f"{os.getpid()}-{self._token}"
+
+    def start(self) -> None:
+        """Start the threads in this process (idempotent; safe to call per request)."""
+        if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        self._pid = os.getpid()
+        self._threads = [threading.Thread(target=self._run, name=f'job-runner-{i}', daemon=True)
+                         for i in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._beat, name='job-heartbeat', daemon=True))
+        for t in self._threads:
+            t.start()
+
+    def wake(self) -> None:
+        """A job was just queued: stop waiting for the next poll."""
+        self._wake.set()
+
+    def run_once(self) -> bool:
+        """Claim and run one queued job; False when there was none."""
+        claimed = self.store.claim(self.owner)
+        if claimed is None:
+            return False
+        job_id, params = claimed
+        progress = Progress(self.store, job_id)
+        result = self.store.result_path(job_id)
+        try:
+            with open(result + '.tmp', 'w', encoding='utf-8') as f:
+                for chunk in self.execute(self.store.upload_path(job_id), params, progress):
+                    f.write(chunk)
+            os.replace(result + '.tmp', result)
+            progress.flush()
+        except Exception as e:
+            _remove(result + '.tmp')
+            self.store.finish(job_id, self.owner, str(e) or type(e).__name__)
+        else:
+            if not self.store.finish(job_id, self.owner):
+                # Failed as stale meanwhile: the job stays failed, without a result
+                _remove(result)
+        return True
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                # Store hiccups (e.g. a locked database): retry on the next poll
+                pass
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+    def _beat(self) -> None:
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                self.store.heartbeat(self.owner)
+                self.store.maybe_sweep()
+            except Exception:
+                pass
@@ -0,0 +1,242 @@
+import heapq
+from collections import deque
+
+from records import Lot
+
+# Lot relief methods: which open lot a sell draws from first
+#   fifo      oldest purchase first (the broker default)
+#   lifo      newest purchase first
+#   hifo      highest split-adjusted cost basis per share first
+#   lofo      lowest split-adjusted cost basis per share first
+#   specific  lots designated per sale by lot id, then oldest first
+RELIEF_METHODS = ('fifo', 'lifo', 'hifo', 'lofo', 'specific')
+
+class LotSelectionError(ValueError):
+    """A specific-ID designation naming a lot that was never bought."""
+
+class _Inventory:
+    """
+    Open buy lots for one instrument, relieved in an order chosen by the
+    subclass through head() and _pop_head().
+
+    A split rewrites every open lot (qty *= ratio, price /= ratio), with the
+    ratio taken from the holdings summed over the open lots in purchase
+    order, exactly as the original list-based engine did. Splits are rare
+    next to buys and sells, and a running total or a lazily applied ratio
+    would round differently on fractional histories and change the output,
+    so they stay eager; relief is what the subclasses make cheap.
+
+    Lots are records.Lot, updated in place.
+    """
+
+    @property
+    def total_qty(self) -> float:
+        """Open shares, summed oldest lot first."""
+        return sum(lot.quantity for lot in self)
+
+    def consume(self, quantity: float) -> None:
+        """
+        Take quantity (at most the head lot's quantity) from the head lot and
+        drop the lot once it is fully used.
+        """
+        lot = self.head()
+        lot.quantity = lot.quantity - quantity
+        if lot.quantity <= 0:
+            self._pop_head()
+
+    def apply_split(self, extra_shares: float) -> float:
+        """
+        Credit extra_shares across all open lots pro rata.
+        ratio = 1 + extra_shares / pre_split_total_qty. Returns the ratio, or
+        0.0 when there is nothing to split.
+        """
+        if extra_shares <= 0 or not self:
+            return 0.0
+        pre_total = self.total_qty
+        if pre_total <= 0:
+            return 0.0
+        ratio = 1.0 + (extra_shares / pre_total)
+        for lot in self:
+            lot.quantity = lot.quantity * ratio
+            # Adjust per-share basis down so total basis stays the same
+            lot.price = lot.price / ratio
+        return ratio
+
+class LotQueue(_Inventory):
+    """
+    FIFO inventory: lots live in a deque, so relieving the oldest lot is O(1).
+    """
+
+    def __init__(self):
+        self._lots = deque()
+
+    @classmethod
+    def from_lots(cls, lots) -> 'LotQueue':
+        """Rebuild a queue from lots (oldest first), e.g. from a saved snapshot."""
+        queue = cls()
+        queue._lots.extend(lots)
+        return queue
+
+    def __len__(self):
+        return len(self._lots)
+
+    def __bool__(self):
+        return bool(self._lots)
+
+    def __iter__(self):
+        """Iterate open lots oldest first."""
+        return iter(self._lots)
+
+    def append(self, lot: Lot) -> None:
+        self._lots.append(lot)
+
+    def head(self) -> Lot:
+        """Oldest open lot."""
+        return self._lots[0]
+
+    def _pop_head(self) -> None:
+        self._lots.popleft()
+
+    def consume(self, quantity: float) -> None:
+        # _Inventory.consume inlined for the default method: the engine's hottest call
+        lot = self._lots[0]
+        lot.quantity = lot.quantity - quantity
+        if lot.quantity <= 0:
+            self._lots.popleft()
+
+class LotStack(LotQueue):
+    """LIFO inventory: the same deque, relieved from the newest end in O(1)."""
+
+    def head(self) -> Lot:
+        """Newest open lot."""
+        return self._lots[-1]
+
+    def _pop_head(self) -> None:
+        self._lots.pop()
+
+    consume = _Inventory.consume
+
+class LotHeap(_Inventory):
+    """
+    HIFO (highest=True) or LOFO inventory: a binary heap keyed on
+    split-adjusted cost basis, so each relief step is O(log n). A split
+    divides every open lot's basis by the same ratio, which never reorders
+    lots, so keys are taken once in pre-split units (basis times the
+    cumulative split ratio when the lot is bought) and never rewritten. Ties go to the
+    older lot. Lots are also kept in purchase order for iteration.
+    """
+
+    def __init__(self, highest: bool = True):
+        self._heap = []
+        self._lots = {}  # purchase sequence -> lot, oldest first
+        self._scale = 1.0  # cumulative split ratio so far
+        self._sign = -1.0 if highest else 1.0
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._lots)
+
+    def __bool__(self):
+        return bool(self._lots)
+
+    def __iter__(self):
+        """Iterate open lots oldest first."""
+        return iter(self._lots.values())
+
+    def append(self, lot: Lot) -> None:
+        seq = self._seq
+        self._seq += 1
+        self._lots[seq] = lot
+        heapq.heappush(self._heap, (self._sign * lot.price * self._scale, seq, lot))
+
+    def apply_split(self, extra_shares: float) -> float:
+        ratio = super().apply_split(extra_shares)
+        if ratio:
+            self._scale *= ratio
+        return ratio
+
+    def head(self) -> Lot:
+        """Open lot with the highest (or lowest) basis."""
+        return self._heap[0][2]
+
+    def _pop_head(self) -> None:
+        _, seq, _ = heapq.heappop(self._heap)
+        del self._lots[seq]
+
+class SpecificLots(LotQueue):
+    """
+    Specific-ID inventory: a FIFO queue plus a lot id hash index. select()
+    designates lots for the next sale; head() returns the first designated
+    lot with shares left, then falls back to the oldest lot. Designated lots
+    are relieved out of queue order and left in the queue, skipped once they
+    reach the front, so every step is O(1) amortized. Lots bought with zero
+    shares reach the front like any other and are relieved through a
+    zero-share match, as in the FIFO queue.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._index = {}  # lot id -> lot, every lot ever appended
+        self._chosen = deque()
+        self._relieved = set()  # ids of designated lots relieved but still queued
+        self._open = 0
+
+    def __len__(self):
+        return self._open
+
+    def __bool__(self):
+        return self._open > 0
+
+    def __iter__(self):
+        for lot in self._lots:
+            if lot.quantity > 0:
+                yield lot
+
+    def append(self, lot: Lot) -> None:
+        super().append(lot)
+        self._index[lot.lot_id] = lot
+        self._open += 1
+
+    def select(self, lot_ids) -> None:
+        """Designate lots (by id, in order) for the next sale; ids must have been bought."""
+        chosen = deque()
+        for lot_id in lot_ids:
+            lot = self._index.get(lot_id)
+            if lot is None:
+                raise LotSelectionError(f"Unknown lot: {lot_id}")
+            chosen.append(lot)
+        self._chosen = chosen
+
+    def head(self) -> Lot:
+        chosen = self._chosen
+        while chosen:
+            lot = chosen[0]
+            if lot.quantity > 0:
+                return lot
+            chosen.popleft()
+        lots = self._lots
+        relieved = self._relieved
+        while lots[0].lot_id in relieved:
+            relieved.discard(lots.popleft().lot_id)
+        return lots[0]
+
+    consume = _Inventory.consume
+
+    def _pop_head(self) -> None:
+        self._open -= 1
+        if self._chosen:
+            self._relieved.add(self._chosen.popleft().lot_id)
+        else:
+            self._lots.popleft()
+
+def new_inventory(relief: str = 'fifo') -> _Inventory:
+    """An empty inventory for a lot relief method."""
+    if relief == 'fifo':
+        return LotQueue()
+    if relief == 'lifo':
+        return LotStack()
+    if relief in ('hifo', 'lofo'):
+        return LotHeap(highest=relief == 'hifo')
+    if relief == 'specific':
+        return SpecificLots()
+    raise ValueError(f"Unknown lot relief method: {relief}")
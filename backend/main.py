@@ -1,15 +1,106 @@
-from flask import Flask, request, jsonify
-from csv_parser import parse_robinhood_csv
-from capital_gains_calculator import calculate_capital_gains
+from flask import Flask, Response, request, jsonify, send_file
+from csv_parser import iter_robinhood_trades, open_upload_stream
+from capital_gains_calculator import (
+    calculate_capital_gains, calculate_capital_gains_delta, calculate_capital_gains_spilled,
+    stream_capital_gains, stream_capital_gains_spilled,
+)
+from datetime import date, datetime
+from functools import partial
+import importlib
 import os
 from dotenv import load_dotenv
-import yfinance as yf
-import pandas as pd
+from price_cache import PriceCache
+from price_provider import YFinanceProvider, load_dependencies
+from async_quotes import ChunkedFetcher, HttpQuoteProvider
+from quote_store import PriceRefresher, QuoteStore, QuoteStoreProvider
+from serializers import MIMETYPES, iter_ndjson, iter_upload_result, negotiate_shape
+import json
 import re
+from portfolio_snapshot import OutOfOrderDelta, SnapshotError
+from lot_inventory import RELIEF_METHODS, LotSelectionError
+from result_cache import ResultCache, hash_upload
+import metrics
+from sale_planner import STRATEGIES, TickerLots, index_lots, lots_from_dicts
+import batch_upload
+from batch_upload import ExportError, merge_trades, parse_exports
+from job_queue import JobRunner, JobStore, QueueFull
 
 load_dotenv()
 
 app = Flask(__name__)
+# /metrics, Server-Timing headers and the optional profiler (see metrics.py)
+metrics.init_app(app)
+
+# Gains engines selectable via /api/upload?engine=<name>, as (module, function);
+# all return the same shape. fifo is the default and the one to use for
+# speed on typical exports: vectorized only outruns it on whole-share
+# histories without splits (see vectorized_engine._exact). Modules load on
+# first use: the vectorized engine pulls in numpy, which uploads on the
+# default engine never need.
+ENGINES = {
+    'fifo': ('capital_gains_calculator', 'calculate_capital_gains'),
+    'vectorized': ('vectorized_engine', 'calculate_capital_gains_vectorized'),
+}
+DEFAULT_ENGINE = 'fifo'
+
+def _engine(name: str) -> tuple:
+    """(calculate, ENGINE_VERSION) of an engine in ENGINES."""
+    module_name, function = ENGINES[name]
+    module = importlib.import_module(module_name)
+    return getattr(module, function), module.ENGINE_VERSION
+
+# Uploads of at least TRADE_STORE_MIN_BYTES (0 = never) are spilled to a
+# memory-mapped trade store in TRADE_STORE_DIR and computed one instrument at
+# a time, so a worker holds the largest instrument rather than the whole file
+TRADE_STORE_MIN_BYTES = int(os.environ.get('TRADE_STORE_MIN_BYTES', '0'))
+TRADE_STORE_DIR = os.environ.get('TRADE_STORE_DIR') or None
+
+# Encoded /api/upload responses by content hash; RESULT_CACHE_MAX_BYTES=0 disables
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(64 << 20))),
+    max_entry_bytes=int(os.environ.get('RESULT_CACHE_MAX_ENTRY_BYTES', str(16 << 20))),
+)
+metrics.register_cache('result', result_cache)
+
+# Background jobs (/api/jobs) for uploads too large to compute within a request;
+# a host-wide SQLite queue in JOB_DIR, so any worker can run or report a job
+job_store = JobStore()
+
+# Upstream quotes: yfinance, or a Yahoo-style HTTP quote endpoint at QUOTE_HTTP_URL
+QUOTE_HTTP_URL = os.environ.get('QUOTE_HTTP_URL')
+def _upstream_provider():
+    return HttpQuoteProvider(QUOTE_HTTP_URL) if QUOTE_HTTP_URL else YFinanceProvider()
+
+# With QUOTE_STORE_PATH set, quotes live in a host-wide SQLite store that a
+# background refresher keeps warm, so workers share them and rarely go upstream.
+QUOTE_STORE_PATH = os.environ.get('QUOTE_STORE_PATH')
+if QUOTE_STORE_PATH:
+    quote_store = QuoteStore(QUOTE_STORE_PATH)
+    price_refresher = PriceRefresher(
+        quote_store,
+        _upstream_provider(),
+        interval=float(os.environ.get('PRICE_REFRESH_INTERVAL', '30')),
+        window=float(os.environ.get('PRICE_REFRESH_WINDOW', '3600')),
+    )
+    price_provider = QuoteStoreProvider(
+        quote_store,
+        _upstream_provider(),
+        max_age=float(os.environ.get('QUOTE_MAX_AGE', '120')),
+    )
+else:
+    quote_store = None
+    price_refresher = None
+    price_provider = _upstream_provider()
+
+# Per-worker quote cache; swap price_cache.provider for a fake in tests. Misses
+# are fetched in concurrent chunks under deadlines (QUOTE_CHUNK_SIZE,
+# QUOTE_CHUNK_TIMEOUT, QUOTE_DEADLINE), so a slow upstream returns partial results.
+price_cache = PriceCache(
+    metrics.TimedProvider(ChunkedFetcher(price_provider)),
+    ttl=float(os.environ.get('PRICE_CACHE_TTL', '60')),
+    max_entries=int(os.environ.get('PRICE_CACHE_MAX_ENTRIES', '5000')),
+)
+metrics.register_cache('price', price_cache)
 
 # -------- Formatting helpers --------
 def _round_price(val):
@@ -24,91 +115,522 @@ def _round_qty(val):
     except Exception:
         return val
 
-def _format_upload_result(result: dict) -> dict:
+def _calculate_upload(file, calculate):
     """
-    Enforce:
-      - Prices -> 2 decimals
-      - Quantities (stock units) -> 5 decimals
-    on the result of calculate_capital_gains().
+    Run calculate(trades) over an uploaded CSV. Parsed straight from the upload
+    stream: no temp file, and trades are generated row by row into the
+    calculator instead of materialized as a list.
     """
-    if not isinstance(result, dict):
-        return result
+    stream = open_upload_stream(file.stream)
+    try:
+        return metrics.measure_calculation(calculate, iter_robinhood_trades(stream))
+    finally:
+        stream.detach()
 
-    out = {
-        'gains': {},
-        'summary': {},
-        'unsold_lots': [],
-        'remaining_tickers': result.get('remaining_tickers', []),
-    }
+def _result_response(result: dict, shape: str, cache_key=None) -> Response:
+    # Encoded straight from the records (rounding inline) and streamed out in
+    # chunks; same bytes jsonify would give for the rows shape.
+    chunks = metrics.timed_body(iter_upload_result(result, shape))
+    if cache_key is None:
+        return Response(chunks, mimetype=MIMETYPES[shape])
+    return Response(result_cache.tee(cache_key, chunks), mimetype=MIMETYPES[shape],
+                    headers={'X-Result-Cache': 'miss'})
 
-    # Summary: currency fields (2 decimals)
-    summary = result.get('summary', {}) or {}
-    out['summary'] = {
-        'past_gains': _round_price(summary.get('past_gains', 0)),
-        'current_year_gains': _round_price(summary.get('current_year_gains', 0)),
-    }
+def _streamed_response(file, plan: dict) -> Response:
+    """
+    ?format=ndjson on the fifo engine: the upload is parsed and grouped, then
+    records go out as each instrument is calculated (serializers.iter_ndjson),
+    so the first bytes follow the parse and the worker holds about one
+    instrument's results at a time. Uploads of at least TRADE_STORE_MIN_BYTES
+    are read back from a spilled trade store, keeping the input side small
+    too. Not cached: a cached copy is the whole body this avoids holding.
+    """
+    options = plan['options']
+    if 0 < TRADE_STORE_MIN_BYTES <= (request.content_length or 0):
+        start = partial(stream_capital_gains_spilled, directory=TRADE_STORE_DIR, **options)
+    else:
+        start = partial(stream_capital_gains, **options)
+    try:
+        stream = _calculate_upload(file, start)
+    except UnicodeDecodeError:
+        return jsonify({'error': 'File is not valid UTF-8 CSV'}), 400
+    response = Response(metrics.timed_body(iter_ndjson(stream)), mimetype=MIMETYPES['ndjson'])
+    # Drops a spilled store even if the client goes away mid-stream
+    response.call_on_close(stream.close)
+    return response
 
-    # Gains per instrument
-    gains = result.get('gains', {}) or {}
-    for instrument, entries in gains.items():
-        formatted_entries = []
-        for e in entries or []:
-            formatted_entries.append({
-                'instrument': e.get('instrument'),
-                'sell_date': e.get('sell_date'),
-                'buy_date': e.get('buy_date'),
-                'quantity': _round_qty(e.get('quantity', 0)),
-                'buy_price': _round_price(e.get('buy_price', 0)),
-                'sell_price': _round_price(e.get('sell_price', 0)),
-                'gain_loss': _round_price(e.get('gain_loss', 0)),
-                'gain_type': e.get('gain_type'),
-            })
-        out['gains'][instrument] = formatted_entries
-
-    # Unsold lots: qty (5), costBasisPerShare (2)
-    unsold = result.get('unsold_lots', []) or []
-    for lot in unsold:
-        out['unsold_lots'].append({
-            'lotId': lot.get('lotId'),
-            'instrument': lot.get('instrument'),
-            'qty': _round_qty(lot.get('qty', 0)),
-            'costBasisPerShare': _round_price(lot.get('costBasisPerShare', 0)),
-            'purchaseDate': lot.get('purchaseDate'),
-        })
+def _upload_cache_key(file, engine: str, shape: str, snapshot: bool, options: dict = None):
+    """
+    Everything an /api/upload body depends on: the file bytes, the engine and
+    its version and options, the response shape and the current year (the summary's
+    past/current split moves at New Year, so last year's entries stop matching).
+    None when the result is not cached: NDJSON bodies are streams, not
+    stored or replayed.
+    """
+    if result_cache.max_bytes <= 0 or shape == 'ndjson':
+        return None
+    digest = hash_upload(file.stream)
+    if digest is None:
+        return None
+    options = json.dumps(options, sort_keys=True) if options else None
+    return (digest, engine, _engine(engine)[1], shape, snapshot, options, datetime.today().year)
 
-    return out
+def _upload_file_or_error():
+    """(file, None) for a usable 'file' part, else (None, error response)."""
+    if 'file' not in request.files:
+        return None, (jsonify({'error': 'No file part'}), 400)
+    file = request.files['file']
+    if file.filename == '':
+        return None, (jsonify({'error': 'No selected file'}), 400)
+    return file, None
+
+def _engine_options_or_error(engine: str):
+    """
+    (options, None) with the calculate_capital_gains() options the request
+    asks for (only those set: ?wash_sales=1, ?relief=<method> and, for
+    relief=specific, a 'lot_selections' JSON form field or file part
+    {instrument: {sell date: [lot ids]}}), else (None, error response).
+    """
+    options = {}
+    if request.args.get('wash_sales') in ('1', 'true'):
+        options['wash_sales'] = True
+    relief = request.args.get('relief', 'fifo')
+    if relief not in RELIEF_METHODS:
+        return None, (jsonify({'error': f'Unknown relief method: {relief}'}), 400)
+    if relief != 'fifo':
+        options['relief'] = relief
+    if options and engine != 'fifo':
+        return None, (jsonify({'error': 'Wash sales and lot relief methods require the fifo engine'}), 400)
+    if relief != 'fifo' and 'wash_sales' in options:
+        return None, (jsonify({'error': 'Wash sales require fifo lot relief'}), 400)
+    if relief == 'specific':
+        raw = request.form.get('lot_selections')
+        if raw is None and 'lot_selections' in request.files:
+            raw = request.files['lot_selections'].read()
+        try:
+            selections = json.loads(raw) if raw else {}
+            for by_date in selections.values():
+                for day, lot_ids in by_date.items():
+                    date.fromisoformat(day)
+                    if not isinstance(lot_ids, list):
+                        raise ValueError(day)
+        except (ValueError, TypeError, AttributeError):
+            return None, (jsonify({'error': 'lot_selections must be {instrument: {"YYYY-MM-DD": [lot ids]}}'}), 400)
+        options['selections'] = selections
+    return options, None
+
+def _shape_or_error():
+    # Response shape: ?format=rows|columns, or Accept: application/vnd.capitalgains.columns+json
+    shape = negotiate_shape(request.args.get('format'), request.headers.get('Accept'))
+    if shape is None:
+        return None, (jsonify({'error': f"Unknown format: {request.args.get('format')}"}), 400)
+    return shape, None
+
+def _upload_plan_or_error():
+    """
+    (plan, None) for an upload's query (engine, response shape, snapshot and
+    engine options), else (None, error response). Plans are plain JSON data,
+    so a queued job can carry one.
+    """
+    engine = request.args.get('engine', DEFAULT_ENGINE)
+    if engine not in ENGINES:
+        return None, (jsonify({'error': f'Unknown engine: {engine}'}), 400)
+    shape, error = _shape_or_error()
+    if error:
+        return None, error
+    options, error = _engine_options_or_error(engine)
+    if error:
+        return None, error
+    snapshot = request.args.get('snapshot') in ('1', 'true')
+    if snapshot:
+        if engine != 'fifo':
+            return None, (jsonify({'error': 'Snapshots require the fifo engine'}), 400)
+        if options:
+            # Deltas resume FIFO queues and cannot see wash sales across the snapshot boundary
+            return None, (jsonify({'error': 'Snapshots cannot be combined with wash_sales or relief'}), 400)
+    return {'engine': engine, 'shape': shape, 'snapshot': snapshot, 'options': options}, None
+
+def _upload_calculator(plan: dict, size: int, progress=None):
+    """
+    calculate(trades) for a plan and an upload of `size` bytes: fifo uploads
+    of at least TRADE_STORE_MIN_BYTES go through a spilled trade store.
+    progress(done, total) follows instruments (fifo engine only).
+    """
+    engine, snapshot, options = plan['engine'], plan['snapshot'], plan['options']
+    if engine != 'fifo':
+        return _engine(engine)[0]
+    if 0 < TRADE_STORE_MIN_BYTES <= size:
+        return partial(calculate_capital_gains_spilled, directory=TRADE_STORE_DIR, snapshot=snapshot,
+                       progress=progress, **options)
+    if snapshot or options or progress is not None:
+        return partial(calculate_capital_gains, snapshot=snapshot, progress=progress, **options)
+    return _engine(engine)[0]
 
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+    """
+    Full calculation over an uploaded export. With ?snapshot=1 the response
+    also carries a 'snapshot' to send to /api/upload_delta next time. With
+    ?wash_sales=1 wash-sale losses are disallowed, and ?relief=lifo|hifo|lofo|specific
+    replaces FIFO lot relief (fifo engine only; see _engine_options_or_error).
+    With ?format=ndjson (or Accept: application/x-ndjson) the response is
+    newline-delimited JSON records, streamed per instrument as they are
+    calculated on the fifo engine (see _streamed_response).
+    """
+    file, error = _upload_file_or_error()
+    if error:
+        return error
+    plan, error = _upload_plan_or_error()
+    if error:
+        return error
+    if plan['shape'] == 'ndjson' and plan['engine'] == 'fifo' and not plan['snapshot']:
+        return _streamed_response(file, plan)
+    calculate = _upload_calculator(plan, request.content_length or 0)
 
-    filename = file.filename
-    file_path = os.path.join(os.getcwd(), filename)
-    file.save(file_path)
+    # Identical re-uploads are answered from the result cache: no parsing or FIFO work
+    with metrics.stage('hash'):
+        cache_key = _upload_cache_key(file, plan['engine'], plan['shape'], plan['snapshot'], plan['options'])
+    if cache_key is not None:
+        with metrics.stage('cache'):
+            body = result_cache.get(cache_key)
+        if body is not None:
+            return Response(body, mimetype='application/json', headers={'X-Result-Cache': 'hit'})
 
     try:
-        trades = parse_robinhood_csv(file_path)
-        result = calculate_capital_gains(trades)
-        result = _format_upload_result(result)
-        return jsonify(result)
-    finally:
+        result = _calculate_upload(file, calculate)
+    except UnicodeDecodeError:
+        return jsonify({'error': 'File is not valid UTF-8 CSV'}), 400
+    except LotSelectionError as e:
+        return jsonify({'error': str(e)}), 400
+    return _result_response(result, plan['shape'], cache_key)
+
+
+@app.route('/api/upload_delta', methods=['POST'])
+def upload_delta():
+    """
+    Continue from a saved snapshot with only the new activity. Multipart
+    fields: 'file' (CSV of new rows) and 'snapshot' (the JSON from the
+    previous response, as a form field or file part). 'gains' holds only
+    newly realized gains; summary and lots cover the whole history, and the
+    response carries the next snapshot. Deltas older than the snapshot are
+    rejected with 409.
+    """
+    file, error = _upload_file_or_error()
+    if error:
+        return error
+    shape, error = _shape_or_error()
+    if error:
+        return error
+    raw = request.form.get('snapshot')
+    if raw is None and 'snapshot' in request.files:
+        raw = request.files['snapshot'].read()
+    if not raw:
+        return jsonify({'error': 'Snapshot is required'}), 400
+    try:
+        snapshot = json.loads(raw)
+    except ValueError:
+        return jsonify({'error': 'Snapshot is not valid JSON'}), 400
+
+    try:
+        result = _calculate_upload(file, lambda trades: calculate_capital_gains_delta(snapshot, trades))
+    except UnicodeDecodeError:
+        return jsonify({'error': 'File is not valid UTF-8 CSV'}), 400
+    except OutOfOrderDelta as e:
+        return jsonify({'error': str(e)}), 409
+    except SnapshotError as e:
+        return jsonify({'error': str(e)}), 400
+    return _result_response(result, shape)
+
+
+@app.route('/api/upload_batch', methods=['POST'])
+def upload_batch():
+    """
+    One calculation over several exports ('files' parts, Robinhood or
+    Fidelity, detected per file), e.g. multiple accounts or year-split
+    exports. Files are parsed concurrently, each sorted chronologically, and
+    k-way merged into one trade stream for a single FIFO run. The response
+    adds 'sources': [{filename, broker, trades}] in upload order.
+    ?engine, ?wash_sales and ?relief work as for /api/upload.
+    """
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    if len(files) > batch_upload.MAX_FILES:
+        return jsonify({'error': f'At most {batch_upload.MAX_FILES} files per batch'}), 400
+    engine = request.args.get('engine', DEFAULT_ENGINE)
+    if engine not in ENGINES:
+        return jsonify({'error': f'Unknown engine: {engine}'}), 400
+    shape, error = _shape_or_error()
+    if error:
+        return error
+    options, error = _engine_options_or_error(engine)
+    if error:
+        return error
+    calculate = partial(calculate_capital_gains, **options) if options else _engine(engine)[0]
+
+    with metrics.stage('read'):
+        exports = [(f.filename, f.read()) for f in files]
+    try:
+        with metrics.stage('parse'):
+            parsed = parse_exports(exports)
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+    del exports
+    try:
+        with metrics.stage('compute'):
+            result = calculate(merge_trades([trades for _, _, trades in parsed]))
+    except LotSelectionError as e:
+        return jsonify({'error': str(e)}), 400
+    result['sources'] = [{'filename': name, 'broker': broker, 'trades': len(trades)}
+                         for name, broker, trades in parsed]
+    return _result_response(result, shape)
+
+
+def _run_upload_job(path: str, plan: dict, progress):
+    """
+    JobRunner task: the /api/upload pipeline over a spooled upload, with
+    rows parsed and instruments done reported to the job as they happen.
+    Returns the encoded body chunks.
+    """
+    calculate = _upload_calculator(plan, os.path.getsize(path), progress.instruments)
+    with open(path, 'rb') as f:
+        stream = open_upload_stream(f)
         try:
-            os.remove(file_path)
-        except Exception:
-            pass
+            result = calculate(progress.count_rows(iter_robinhood_trades(stream)))
+        except UnicodeDecodeError:
+            raise ValueError('File is not valid UTF-8 CSV')
+        finally:
+            stream.detach()
+    return iter_upload_result(result, plan['shape'])
+
+job_runner = JobRunner(job_store, _run_upload_job)
+
+def _job_urls(job_id: str) -> dict:
+    return {'status_url': f'/api/jobs/{job_id}', 'result_url': f'/api/jobs/{job_id}/result'}
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    /api/upload as a background job: same file part and query options, but
+    the upload is queued and 202 {job_id, status, status_url, result_url}
+    comes back at once. Poll the status URL for progress and fetch the
+    result URL once the job is done. 503 with Retry-After when the host
+    already has JOB_QUEUE_DEPTH jobs queued or running.
+    """
+    file, error = _upload_file_or_error()
+    if error:
+        return error
+    plan, error = _upload_plan_or_error()
+    if error:
+        return error
+    if plan['shape'] == 'ndjson':
+        # Results are fetched whole once done; there is nothing to stream
+        return jsonify({'error': 'Jobs support the rows and columns formats'}), 400
+    try:
+        with metrics.stage('spool'):
+            job_id = job_store.submit(file.stream, plan)
+    except QueueFull:
+        return jsonify({'error': 'Too many jobs queued, retry later'}), 503, {'Retry-After': '30'}
+    # Started lazily so each (forked) worker process runs its own runners
+    job_runner.start()
+    job_runner.wake()
+    body = dict({'job_id': job_id, 'status': 'queued'}, **_job_urls(job_id))
+    return jsonify(body), 202, {'Location': body['status_url']}
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    { job_id, status: queued|running|done|failed, created_at, started_at,
+      finished_at, progress: { rows, instruments_done, instruments_total },
+      error (failed jobs), status_url, result_url }
+    Times are Unix seconds; instruments_total is null until parsing is done.
+    """
+    job_runner.start()
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    job.update(_job_urls(job_id))
+    return jsonify(job)
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """The finished job's response body, as /api/upload would have sent it; 409 until then."""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job['status'] != 'done':
+        error = job.get('error') or f"Job is {job['status']}"
+        return jsonify({'error': error, 'status': job['status']}), 409
+    return send_file(job_store.result_path(job_id), mimetype='application/json')
+
+
+def _format_plan(ticker: str, plan: dict) -> dict:
+    out = {
+        'ticker': ticker,
+        'strategy': plan['strategy'],
+        'quantity': _round_qty(plan['quantity']),
+        'shortfall': _round_qty(plan['shortfall']),
+        'price': _round_price(plan['price']),
+        'proceeds': _round_price(plan['proceeds']),
+        'cost_basis': _round_price(plan['cost_basis']),
+        'gain_loss': _round_price(plan['gain_loss']),
+        'long_term_gain': _round_price(plan['long_term_gain']),
+        'short_term_gain': _round_price(plan['short_term_gain']),
+    }
+    if 'lots' in plan:
+        price = plan['price']
+        out['lots'] = [{
+            'lotId': lot.lot_id,
+            'purchaseDate': lot.activity_date,
+            'qty': _round_qty(qty),
+            'costBasisPerShare': _round_price(lot.price),
+            'gain_loss': _round_price((price - lot.price) * qty),
+            'gain_type': 'long_term' if long_term else 'short_term',
+        } for lot, qty, long_term in plan['lots']]
+    return out
+
+
+@app.route('/api/plan_sale', methods=['POST'])
+def plan_sale():
+    """
+    Plans sales against the unsold lots returned by /api/upload. JSON body:
+      {
+        "lots": [ ...unsold_lots... ],
+        "date": "2024-06-30",           (optional: sale date, default today)
+        "include_lots": true,           (optional: false returns totals only)
+        "queries": [ { "ticker": "AAPL", "quantity": 10, "price": 190.0, "strategy": "fifo" }, ... ]
+      }
+    A single query may be given inline instead of "queries". Strategies:
+    fifo, highest_cost, max_loss, long_term_only. Queries without a price use
+    the current quote. Lots are indexed once per request, so each query costs
+    O(log n) plus the lots it returns. Returns {"plans": [...]} in query order.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('lots'), list):
+        return jsonify({'error': 'JSON body with a "lots" list is required'}), 400
+    queries = body.get('queries')
+    if queries is None:
+        queries = [body]
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'error': 'At least one query is required'}), 400
+
+    try:
+        as_of = date.fromisoformat(body['date']) if body.get('date') else date.today()
+        lots = lots_from_dicts(body['lots'])
+        parsed = []
+        for q in queries:
+            strategy = q.get('strategy', 'fifo')
+            if strategy not in STRATEGIES:
+                raise ValueError(f"Unknown strategy: {strategy}")
+            price = q.get('price')
+            parsed.append((str(q['ticker']).strip().upper(), float(q['quantity']),
+                           None if price is None else float(price), strategy))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid request: {e}'}), 400
+
+    need_quotes = sorted({ticker for ticker, _, price, _ in parsed if price is None})
+    quotes = {}
+    if need_quotes:
+        # Symbols whose fetch failed plan as 'No price found', like unknown ones
+        with metrics.stage('quote'):
+            quotes = price_cache.get_many(need_quotes, errors={})
+
+    with metrics.stage('index'):
+        index = index_lots(lots, as_of)
+    with_lots = bool(body.get('include_lots', True))
+    with metrics.stage('plan'):
+        plans = _plan_queries(index, parsed, quotes, as_of, with_lots)
+
+    return jsonify({'as_of': as_of.isoformat(), 'plans': plans})
+
+
+def _plan_queries(index: dict, parsed: list, quotes: dict, as_of, with_lots: bool) -> list:
+    plans = []
+    for ticker, quantity, price, strategy in parsed:
+        if price is None:
+            price = quotes.get(ticker)
+        if price is None:
+            plans.append({'ticker': ticker, 'strategy': strategy, 'error': 'No price found'})
+            continue
+        # A ticker with no open lots plans to nothing sold (all shortfall)
+        ticker_lots = index.get(ticker) or TickerLots([], as_of)
+        plans.append(_format_plan(ticker, ticker_lots.plan(quantity, price, strategy, with_lots)))
+    return plans
+
+
+@app.route('/api/scenarios', methods=['POST'])
+def scenarios():
+    """
+    What-if unrealized P/L of the unsold lots returned by /api/upload over a
+    grid of prices per ticker and a set of as-of dates. JSON body:
+      {
+        "lots": [ ...unsold_lots... ],
+        "prices": { "AAPL": [150, 175, 200], "MSFT": [400] },
+        "dates": ["2024-06-30", "2025-01-01"]      (optional, default today)
+      }
+    Returns, per ticker in "prices", values indexed [price] or [price][date]:
+      {
+        "dates": [...],
+        "scenarios": { "AAPL": { "quantity", "cost_basis", "prices": [...],
+                                 "net": [...], "gains": [...], "losses": [...],
+                                 "long_term": [[...]], "short_term": [[...]] } }
+      }
+    Net P/L and the gains/losses split depend on the price only; the holding
+    term split also on the date. Lots are long term once held more than 365
+    days, as in /api/plan_sale.
+    """
+    # numpy-backed, so loaded on the first scenario request (or by warm_up)
+    from scenario_matrix import ScenarioError, scenario_matrix
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('lots'), list):
+        return jsonify({'error': 'JSON body with a "lots" list is required'}), 400
+    if not isinstance(body.get('prices'), dict) or not body['prices']:
+        return jsonify({'error': 'A "prices" map of ticker to price list is required'}), 400
+
+    try:
+        dates = body.get('dates') or [date.today().isoformat()]
+        if not isinstance(dates, list):
+            raise ValueError('"dates" must be a list')
+        as_of = [date.fromisoformat(d) for d in dates]
+        grids = {}
+        for ticker, grid in body['prices'].items():
+            if not isinstance(grid, list):
+                grid = [grid]
+            grids[str(ticker).strip().upper()] = [float(p) for p in grid]
+        lots = lots_from_dicts(body['lots'])
+        with metrics.stage('scenarios'):
+            matrix = scenario_matrix(lots, grids, as_of)
+    except (KeyError, TypeError, ValueError) as e:
+        # ScenarioError is a ValueError
+        return jsonify({'error': f'Invalid request: {e}'}), 400
+
+    out = {}
+    for ticker, result in matrix.items():
+        out[ticker] = {
+            'quantity': _round_qty(result['quantity']),
+            'cost_basis': _round_price(result['cost_basis']),
+            'prices': grids[ticker],
+        }
+        for key in ('net', 'gains', 'losses', 'long_term', 'short_term'):
+            out[ticker][key] = result[key].round(2).tolist()
+    return jsonify({'dates': [d.isoformat() for d in as_of], 'scenarios': out})
 
 
 @app.route('/api/get_price', methods=['GET'])
 def get_price():
     """
-    Returns a flat map of ticker -> price using a single yfinance download call.
-    Prices are rounded to 2 decimals.
+    Returns a flat map of ticker -> price. Quotes come from the shared
+    PriceCache, so only missing or expired symbols reach the provider, in
+    concurrent chunks with deadlines. Prices are rounded to 2 decimals.
     Example: { "AAPL": 190.12, "MSFT": 413.88 }
+    If some symbols timed out or failed upstream, the prices that did arrive
+    are returned with 207:
+      { "prices": { "AAPL": 190.12 }, "errors": [ { "MSFT": "Timed out waiting for upstream" } ] }
     """
     tickers_param = request.args.get('tickers', '')
     if not tickers_param.strip():
@@ -118,50 +640,23 @@ def get_price():
     symbols = [s.strip().upper() for s in re.split(r'[,\s;]+', tickers_param) if s.strip()]
     if not symbols:
         return jsonify({'error': 'No valid ticker symbols provided'}), 400
+    symbols = list(dict.fromkeys(symbols))
 
-    try:
-        df = yf.download(
-            tickers=" ".join(symbols),
-            period="1d",
-            interval="1d",
-            auto_adjust=False,
-            progress=False,
-            threads=True
-        )
-    except Exception as e:
-        return jsonify({'error': f'yfinance error: {str(e)}'}), 502
-
-    prices = {}
-
-    if isinstance(df.columns, pd.MultiIndex):
-        # Multiple tickers
-        for sym in symbols:
-            price = None
-            if ('Close', sym) in df.columns:
-                series = df[('Close', sym)].dropna()
-                if not series.empty:
-                    price = float(series.iloc[-1])
-            if price is None and ('Adj Close', sym) in df.columns:
-                series = df[('Adj Close', sym)].dropna()
-                if not series.empty:
-                    price = float(series.iloc[-1])
-            if price is not None:
-                prices[sym] = _round_price(price)
-    else:
-        # Single ticker
-        cols = {str(c).lower(): c for c in df.columns}
-        sym = symbols[0]
-        price = None
-        if 'close' in cols:
-            series = df[cols['close']].dropna()
-            if not series.empty:
-                price = float(series.iloc[-1])
-        if price is None and 'adj close' in cols:
-            series = df[cols['adj close']].dropna()
-            if not series.empty:
-                price = float(series.iloc[-1])
-        if price is not None:
-            prices[sym] = _round_price(price)
+    if price_refresher is not None:
+        # Started lazily so each (forked) worker process runs its own thread
+        price_refresher.start()
+
+    failed = {}
+    with metrics.stage('quote'):
+        found = price_cache.get_many(symbols, errors=failed)
+
+    prices = {sym: _round_price(found[sym]) for sym in symbols if sym in found}
+
+    if failed:
+        errors = [{sym: failed.get(sym, 'No price found')} for sym in symbols if sym not in prices]
+        if not prices:
+            return jsonify({'error': 'Price provider error', 'errors': errors}), 502
+        return jsonify({'prices': prices, 'errors': errors}), 207
 
     if not prices:
         return jsonify({'error': 'No prices found for provided tickers'}), 404
@@ -169,6 +664,22 @@ def get_price():
     return jsonify(prices)
 
 
+def warm_up() -> None:
+    """
+    Import everything requests would otherwise load lazily: the quote
+    dependencies (pandas, yfinance), every engine, the trade store and the
+    scenario matrix (numpy).
+    Run in a preloaded gunicorn master (see gunicorn.conf.py), so workers
+    fork with the modules loaded and share their pages copy-on-write.
+    Starts no threads or pools; those stay per worker.
+    """
+    load_dependencies()
+    for name in ENGINES:
+        _engine(name)
+    importlib.import_module('trade_store')
+    importlib.import_module('scenario_matrix')
+
+
 if __name__ == "__main__":
     # Default to port 5000 to match CRA proxy config
     port = int(os.environ.get("PORT", "5000"))
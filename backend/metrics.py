@@ -0,0 +1,451 @@
+"""
+Request instrumentation: per-stage timers, per-upload counts and cache
+statistics, exposed as a Prometheus text endpoint (/metrics) and a
+Server-Timing response header, plus an optional sampling profiler.
+
+    METRICS_ENABLED=0            turn all of it off (hooks are not installed,
+                                 stage() is a no-op, iterators pass through)
+    PROFILER_INTERVAL_MS=10      sample request thread stacks every 10 ms and
+                                 serve them at /debug/profile (collapsed
+                                 stacks, ready for flamegraph.pl / speedscope)
+    METRICS_DIR=<dir>            share counters between the worker processes
+                                 of one server: each process writes its own
+                                 to <dir> every FLUSH_INTERVAL seconds, and
+                                 /metrics on any worker serves the sum over
+                                 all of them (gunicorn.conf.py sets this up)
+
+Without METRICS_DIR, /metrics shows only the process that answers it.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+
+ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', '0') or 0)
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+# Seconds between writes of this process's counters to METRICS_DIR
+FLUSH_INTERVAL = 1.0
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+def _labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join('%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+def _combine(a, b):
+    """Sum of two samples of the same series: numbers, or histogram lists."""
+    if isinstance(a, list):
+        return [x + y for x, y in zip(a, b)]
+    return a + b
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *label_values) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self) -> dict:
+        """{label values: [bucket counts..., sum, count]} observed in this process."""
+        with self._lock:
+            return {values: list(series) for values, series in self._series.items()}
+
+    def render(self, merged: dict = None) -> list:
+        """Text lines for this process's series, or for merged[self.name] (see Registry)."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        items = sorted((merged[self.name] if merged is not None else self.collect()).items())
+        for values, series in items:
+            names = self.label_names + ('le',)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(names, values + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(names, values + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, values)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, values)} {series[-1]}")
+        return lines
+
+class Counter:
+    """Read at scrape time from a callback returning {label values: number}."""
+
+    def __init__(self, name: str, help: str, labels, read):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.read = read
+
+    def collect(self) -> dict:
+        return dict(self.read())
+
+    def render(self, merged: dict = None) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        items = sorted((merged[self.name] if merged is not None else self.collect()).items())
+        for values, value in items:
+            lines.append(f"{self.name}{_labels(self.label_names, values)} {value}")
+        return lines
+
+class Ratio:
+    """Gauge of hits / (hits + misses) per series, from two Counters' (merged) values."""
+
+    def __init__(self, name: str, help: str, hits: Counter, misses: Counter):
+        self.name = name
+        self.help = help
+        self.hits = hits
+        self.misses = misses
+
+    def collect(self) -> dict:
+        return {}
+
+    def render(self, merged: dict = None) -> list:
+        if merged is None:
+            merged = {m.name: m.collect() for m in (self.hits, self.misses)}
+        hits = merged[self.hits.name]
+        misses = merged[self.misses.name]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for values in sorted(set(hits) | set(misses)):
+            total = hits.get(values, 0) + misses.get(values, 0)
+            ratio = hits.get(values, 0) / total if total else 0.0
+            lines.append(f"{self.name}{_labels(self.hits.label_names, values)} {ratio}")
+        return lines
+
+class Registry:
+    """
+    The metrics of this process. With a `directory`, flush() writes their
+    values to <directory>/<pid>-<token>.json and render() adds up every
+    other file there: the other workers' counters, and the last counters of
+    workers that have exited, so totals never go backwards when a worker is
+    replaced.
+    """
+
+    def __init__(self, directory: str = ''):
+        self.metrics = []
+        self.directory = directory
+        self._token = uuid.uuid4().hex[:8]
+
+    @property
+    def filename(self) -> str:
+        # Includes the pid so forked workers never share a file
+        return f"{os.getpid()}-{self._token}.json"
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self) -> dict:
+        """{metric name: {label values: value}} for this process."""
+        return {metric.name: metric.collect() for metric in self.metrics}
+
+    def flush(self) -> None:
+        """Write this process's values to the shared directory (no-op without one)."""
+        if not self.directory:
+            return
+        doc = {name: [[list(values), value] for values, value in samples.items()]
+               for name, samples in self.collect().items()}
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, self.filename)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(doc, f)
+        os.replace(path + '.tmp', path)
+
+    def _merged(self) -> dict:
+        merged = self.collect()
+        if not self.directory or not os.path.isdir(self.directory):
+            return merged
+        own = self.filename
+        for name in os.listdir(self.directory):
+            if name == own or not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    doc = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric, rows in doc.items():
+                samples = merged.get(metric)
+                if samples is None:
+                    continue
+                for values, value in rows:
+                    values = tuple(values)
+                    samples[values] = _combine(samples[values], value) if values in samples else value
+        return merged
+
+    def render(self) -> str:
+        merged = self._merged()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(merged))
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry(METRICS_DIR)
+STAGE_SECONDS = REGISTRY.add(Histogram(
+    'capgains_stage_seconds', 'Time spent in each request stage.', ('endpoint', 'stage')))
+REQUEST_SECONDS = REGISTRY.add(Histogram(
+    'capgains_request_seconds', 'Request handling time until the response starts.', ('endpoint', 'status')))
+UPLOAD_ROWS = REGISTRY.add(Histogram(
+    'capgains_upload_trades', 'Trades parsed per upload.', (), COUNT_BUCKETS))
+UPLOAD_INSTRUMENTS = REGISTRY.add(Histogram(
+    'capgains_upload_instruments', 'Instruments per upload.', (), COUNT_BUCKETS))
+UPLOAD_LOTS = REGISTRY.add(Histogram(
+    'capgains_upload_unsold_lots', 'Unsold lots per upload.', (), COUNT_BUCKETS))
+
+_caches = {}
+
+def register_cache(name: str, cache) -> None:
+    """Export hits/misses (and the hit ratio) of a cache with those counters."""
+    _caches[name] = cache
+
+def _cache_stat(attr):
+    return lambda: {(name,): getattr(cache, attr) for name, cache in _caches.items()}
+
+CACHE_HITS = REGISTRY.add(Counter(
+    'capgains_cache_hits_total', 'Cache lookups answered from cache.', ('cache',), _cache_stat('hits')))
+CACHE_MISSES = REGISTRY.add(Counter(
+    'capgains_cache_misses_total', 'Cache lookups that missed.', ('cache',), _cache_stat('misses')))
+REGISTRY.add(Ratio('capgains_cache_hit_ratio', 'Hits / lookups since start.', CACHE_HITS, CACHE_MISSES))
+
+class RequestTimer:
+    """Stage durations of one request, in the order they were recorded."""
+
+    __slots__ = ('endpoint', 'start', 'stages')
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, self.endpoint, stage)
+
+    def server_timing(self, total: float) -> str:
+        parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.stages.items()]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ', '.join(parts)
+
+def _timer():
+    if ENABLED and has_request_context():
+        return g.get('request_timer')
+    return None
+
+def record(stage: str, seconds: float) -> None:
+    """Add a measured stage to the current request (no-op outside requests or when disabled)."""
+    timer = _timer()
+    if timer is not None:
+        timer.add(stage, seconds)
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as a stage of the current request."""
+    timer = _timer()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+class TimedIterator:
+    """
+    Wraps an iterator and accumulates the time spent producing its items, for
+    stages that are interleaved with their consumer (parsing streamed into
+    the engine, encoding streamed into the response). `on_done(seconds,
+    count)` runs once the iterator is exhausted.
+    """
+
+    __slots__ = ('_it', 'seconds', 'count', '_on_done')
+
+    def __init__(self, iterable, on_done=None):
+        self._it = iter(iterable)
+        self.seconds = 0.0
+        self.count = 0
+        self._on_done = on_done
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            item = next(self._it)
+        except StopIteration:
+            self.seconds += time.perf_counter() - start
+            if self._on_done is not None:
+                on_done, self._on_done = self._on_done, None
+                on_done(self.seconds, self.count)
+            raise
+        self.seconds += time.perf_counter() - start
+        self.count += 1
+        return item
+
+def measure_calculation(calculate, trades):
+    """
+    Run calculate(trades), recording the time spent inside the trade iterator
+    (streamed CSV parsing) as the 'parse' stage and the rest as 'compute',
+    plus the upload's trade/instrument/lot counts.
+    """
+    timer = _timer()
+    if timer is None:
+        return calculate(trades)
+    trades = TimedIterator(trades)
+    start = time.perf_counter()
+    result = calculate(trades)
+    total = time.perf_counter() - start
+    timer.add('parse', trades.seconds)
+    timer.add('compute', total - trades.seconds)
+    UPLOAD_ROWS.observe(trades.count)
+    if isinstance(result, dict):
+        # Streamed runs (GainsStream) have not computed anything yet
+        UPLOAD_INSTRUMENTS.observe(len(result.get('gains', ())))
+        UPLOAD_LOTS.observe(len(result.get('unsold_lots', ())))
+    return result
+
+def timed_body(chunks, stage_name: str = 'encode'):
+    """
+    Time a streamed response body as a stage. It is recorded once the body
+    has been sent, so it shows in /metrics but not in Server-Timing.
+    """
+    timer = _timer()
+    if timer is None:
+        return chunks
+    endpoint = timer.endpoint
+    return TimedIterator(chunks, lambda seconds, _: STAGE_SECONDS.observe(seconds, endpoint, stage_name))
+
+class TimedProvider:
+    """Price provider wrapper that records upstream fetches as the 'upstream' stage."""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def fetch(self, symbols):
+        with stage('upstream'):
+            return self.provider.fetch(symbols)
+
+class SamplingProfiler:
+    """
+    Samples every other thread's Python stack each `interval` seconds and
+    counts identical stacks; collapsed() renders them one per line as
+    "outer;...;inner count".
+    """
+
+    def __init__(self, interval: float, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.counts = defaultdict(int)
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Start sampling in this process (idempotent; safe to call per request)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def sample(self) -> None:
+        me = threading.get_ident()
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stacks.append(';'.join(reversed(stack)))
+        with self._lock:
+            self.samples += 1
+            for stack in stacks:
+                self.counts[stack] += 1
+
+    def collapsed(self, reset: bool = False) -> str:
+        with self._lock:
+            lines = [f"{stack} {n}" for stack, n in sorted(self.counts.items(), key=lambda kv: -kv[1])]
+            if reset:
+                self.counts.clear()
+                self.samples = 0
+        return "\n".join(lines) + "\n"
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+profiler = SamplingProfiler(PROFILER_INTERVAL_MS / 1000.0) if PROFILER_INTERVAL_MS > 0 else None
+
+_flusher = None
+
+def _start_flusher() -> None:
+    """Start writing REGISTRY to METRICS_DIR every FLUSH_INTERVAL in this process (idempotent)."""
+    global _flusher
+    if _flusher is None or not _flusher.is_alive():
+        _flusher = threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True)
+        _flusher.start()
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            REGISTRY.flush()
+        except OSError:
+            # A full or missing directory just leaves the last flush in place
+            pass
+
+def init_app(app) -> None:
+    """Install the request hooks and the /metrics (and /debug/profile) routes."""
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def _start_timer():
+        g.request_timer = RequestTimer(request.endpoint or 'unknown')
+        if REGISTRY.directory:
+            # Started lazily so each (forked) worker process flushes its own counters
+            _start_flusher()
+        if profiler is not None:
+            # Started lazily so each (forked) worker process samples its own threads
+            profiler.start()
+
+    @app.after_request
+    def _finish_timer(response):
+        timer = g.pop('request_timer', None)
+        if timer is not None:
+            total = time.perf_counter() - timer.start
+            REQUEST_SECONDS.observe(total, timer.endpoint, response.status_code)
+            response.headers['Server-Timing'] = timer.server_timing(total)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    if profiler is not None:
+        @app.route('/debug/profile', methods=['GET'])
+        def debug_profile():
+            return Response(profiler.collapsed(reset=request.args.get('reset') == '1'), mimetype='text/plain')
@@ -0,0 +1,75 @@
+from collections import defaultdict
+from datetime import date
+
+from lot_inventory import LotQueue
+from records import Lot
+
+# Bump when the snapshot layout changes; older snapshots are then rejected
+SNAPSHOT_VERSION = 2
+
+class SnapshotError(ValueError):
+    """A snapshot that cannot be used: malformed or from another version."""
+
+class OutOfOrderDelta(SnapshotError):
+    """New trades that sort before what the snapshot already applied."""
+
+class FifoState:
+    """
+    Where one instrument's FIFO run stopped: the open lot queue, the
+    per-date lot id sequence, the (date, event order) key of the last lot
+    event applied, and the running report totals {(year, kind): amount} for kind in short_term, long_term
+    and dividends. Continuing from it gives the same lots, lot ids, gains and
+    totals as re-running the whole history.
+    """
+
+    __slots__ = ('buy_lots', 'date_seq', 'last_key', 'totals')
+
+    def __init__(self, buy_lots=None, date_seq=None, last_key=None, totals=None):
+        self.buy_lots = buy_lots if buy_lots is not None else LotQueue()
+        self.date_seq = date_seq if date_seq is not None else defaultdict(int)
+        self.last_key = last_key
+        self.totals = totals if totals is not None else defaultdict(float)
+
+    def to_dict(self) -> dict:
+        # Lots are written split-adjusted; zero-quantity lots stay (a later
+        # sell still matches them). Lot id counters of dates before the last
+        # event can never be used again, so only the rest are kept.
+        last_day = self.last_key[0] if self.last_key else None
+        return {
+            'lots': [[lot.lot_id, lot.activity_date, lot.date.isoformat(), lot.quantity, lot.price]
+                     for lot in self.buy_lots],
+            'last': [last_day.isoformat(), self.last_key[1]] if last_day else None,
+            'date_seq': {d.isoformat(): n for d, n in self.date_seq.items()
+                         if last_day is not None and d >= last_day},
+            'totals': [[year, kind, amount] for (year, kind), amount in sorted(self.totals.items())],
+        }
+
+    @classmethod
+    def from_dict(cls, instrument: str, d: dict) -> 'FifoState':
+        lots = [Lot(lot_id, instrument, activity_date, date.fromisoformat(day), float(qty), float(price))
+                for lot_id, activity_date, day, qty, price in d['lots']]
+        last = d.get('last')
+        last_key = (date.fromisoformat(last[0]), int(last[1])) if last else None
+        date_seq = defaultdict(int, {date.fromisoformat(k): int(n) for k, n in d.get('date_seq', {}).items()})
+        totals = defaultdict(float, {(int(year), str(kind)): float(amount) for year, kind, amount in d.get('totals', [])})
+        return cls(LotQueue.from_lots(lots), date_seq, last_key, totals)
+
+def dump_snapshot(states: dict) -> dict:
+    """
+    JSON-ready snapshot of a finished run: {instrument: FifoState}, whose
+    report totals keep the whole-history summary right whenever the snapshot
+    is resumed.
+    """
+    return {
+        'version': SNAPSHOT_VERSION,
+        'instruments': {inst: state.to_dict() for inst, state in states.items()},
+    }
+
+def load_snapshot(doc) -> dict:
+    """Inverse of dump_snapshot: {instrument: FifoState}. Raises SnapshotError."""
+    if not isinstance(doc, dict) or doc.get('version') != SNAPSHOT_VERSION:
+        raise SnapshotError('Unsupported snapshot version')
+    try:
+        return {inst: FifoState.from_dict(inst, d) for inst, d in doc['instruments'].items()}
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise SnapshotError(f'Malformed snapshot: {e}') from e
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+
+class PartialFetch(Exception):
+    """
+    Raised by a provider that got some prices but not others (chunks that
+    timed out or failed). `errors` is {symbol: reason}; those symbols are
+    not cached, so the next request retries them.
+    """
+
+    def __init__(self, prices: dict, errors: dict):
+        super().__init__(f"{len(errors)} symbol(s) failed")
+        self.prices = prices
+        self.errors = errors
+
+class _Flight:
+    """One upstream fetch, shared by every request waiting on its symbols."""
+
+    def __init__(self):
+        self.symbols = set()
+        self.prices = {}
+        self.errors = {}
+        self.error = None
+        self.done = threading.Event()
+
+class PriceCache:
+    """
+    In-process quote cache in front of a price provider.
+
+    - Entries expire after `ttl` seconds (`missing_ttl` for symbols the
+      provider had no price for, so bad tickers are not refetched each call).
+    - At most `max_entries` symbols are kept; least recently used go first.
+      An entry is a symbol, a float and a timestamp, so the cap bounds memory.
+    - Fetches are single-flight: a request that misses opens a flight and
+      waits `coalesce_window` seconds for concurrent requests to add their
+      missing symbols, then one provider.fetch() covers the union. Requests
+      whose symbols are already in flight wait for that flight instead of
+      fetching again. Partial hits only fetch the symbols that missed.
+
+    The provider is any object with fetch(symbols) -> {symbol: price}.
+    """
+
+    def __init__(self, provider, ttl: float = 60.0, missing_ttl: float = 10.0,
+                 max_entries: int = 5000, coalesce_window: float = 0.005, clock=time.monotonic):
+        self.provider = provider
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.max_entries = max_entries
+        self.coalesce_window = coalesce_window
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # symbol -> (price or None, expires_at)
+        self._inflight = {}            # symbol -> _Flight
+        self._collecting = None        # flight still accepting symbols
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+
+    def get_many(self, symbols, errors: dict = None) -> dict:
+        """
+        Return {symbol: price} for the symbols that have a price, fetching
+        whatever is missing or stale. Provider errors propagate to callers
+        waiting on the failed flight, unless an `errors` dict is passed: then
+        failed symbols are recorded there ({symbol: reason}) and the prices
+        that did arrive are still returned.
+        """
+        requested = set(symbols)
+        result = {}
+        waits = set()
+        leading = None
+        with self._lock:
+            now = self._clock()
+            for sym in requested:
+                entry = self._entries.get(sym)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(sym)
+                    self.hits += 1
+                    if entry[0] is not None:
+                        result[sym] = entry[0]
+                    continue
+                self.misses += 1
+                flight = self._inflight.get(sym)
+                if flight is None:
+                    if self._collecting is None:
+                        self._collecting = leading = _Flight()
+                    flight = self._collecting
+                    flight.symbols.add(sym)
+                    self._inflight[sym] = flight
+                waits.add(flight)
+
+        if leading is not None:
+            self._fly(leading)
+
+        for flight in waits:
+            flight.done.wait()
+            if flight.error is not None:
+                if errors is None:
+                    raise flight.error
+                errors.update((sym, str(flight.error)) for sym in flight.symbols & requested)
+                continue
+            failed = flight.errors.keys() & requested
+            if failed:
+                if errors is None:
+                    raise PartialFetch({s: p for s, p in flight.prices.items() if s in requested},
+                                       {s: flight.errors[s] for s in failed})
+                errors.update((sym, flight.errors[sym]) for sym in failed)
+            for sym in flight.symbols:
+                if sym in requested and sym in flight.prices:
+                    result[sym] = flight.prices[sym]
+        return result
+
+    def _fly(self, flight: _Flight) -> None:
+        try:
+            if self.coalesce_window > 0:
+                time.sleep(self.coalesce_window)
+            with self._lock:
+                if self._collecting is flight:
+                    self._collecting = None
+                wanted = sorted(flight.symbols)
+            self.fetches += 1
+            flight.prices = self.provider.fetch(wanted) or {}
+        except PartialFetch as e:
+            flight.prices = e.prices
+            flight.errors = e.errors
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                if self._collecting is flight:
+                    self._collecting = None
+                if flight.error is None:
+                    now = self._clock()
+                    for sym in flight.symbols:
+                        if sym in flight.errors:
+                            continue
+                        price = flight.prices.get(sym)
+                        ttl = self.ttl if price is not None else self.missing_ttl
+                        self._entries[sym] = (price, now + ttl)
+                        self._entries.move_to_end(sym)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                for sym in flight.symbols:
+                    if self._inflight.get(sym) is flight:
+                        del self._inflight[sym]
+            flight.done.set()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,63 @@
+def load_dependencies() -> tuple:
+    """
+    (pandas, yfinance), imported on first use: together they take most of a
+    worker's import time and only quote fetches need them. Call it early
+    (e.g. in a preloaded gunicorn master, see main.warm_up) to pay the
+    import once before forking instead of on a request.
+    """
+    import pandas
+    import yfinance
+    return pandas, yfinance
+
+class YFinanceProvider:
+    """
+    Latest close prices from yfinance. Any object with the same
+    fetch(symbols) -> {symbol: price} method can stand in for it (e.g. a fake
+    in tests); symbols without a price are simply left out of the result.
+    """
+
+    def fetch(self, symbols: list) -> dict:
+        pd, yf = load_dependencies()
+        # Single download call for all symbols; raises on upstream failure
+        df = yf.download(
+            tickers=" ".join(symbols),
+            period="1d",
+            interval="1d",
+            auto_adjust=False,
+            progress=False,
+            threads=True
+        )
+
+        prices = {}
+
+        if isinstance(df.columns, pd.MultiIndex):
+            # Multiple tickers
+            for sym in symbols:
+                price = None
+                if ('Close', sym) in df.columns:
+                    series = df[('Close', sym)].dropna()
+                    if not series.empty:
+                        price = float(series.iloc[-1])
+                if price is None and ('Adj Close', sym) in df.columns:
+                    series = df[('Adj Close', sym)].dropna()
+                    if not series.empty:
+                        price = float(series.iloc[-1])
+                if price is not None:
+                    prices[sym] = price
+        else:
+            # Single ticker
+            cols = {str(c).lower(): c for c in df.columns}
+            sym = symbols[0]
+            price = None
+            if 'close' in cols:
+                series = df[cols['close']].dropna()
+                if not series.empty:
+                    price = float(series.iloc[-1])
+            if price is None and 'adj close' in cols:
+                series = df[cols['adj close']].dropna()
+                if not series.empty:
+                    price = float(series.iloc[-1])
+            if price is not None:
+                prices[sym] = price
+
+        return prices
@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quotes (
+    symbol TEXT PRIMARY KEY,
+    price REAL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS requested (
+    symbol TEXT PRIMARY KEY,
+    last_requested REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+class QuoteStore:
+    """
+    Host-wide quote table in a local SQLite database in WAL mode.
+
+    Every gunicorn worker opens the same file. In WAL mode readers never
+    block (and are never blocked by) the single writer, so a lookup is a
+    local indexed read. Besides quotes, the store records when each symbol
+    was last requested, which tells the refresher what to keep warm, and a
+    lease row so only one worker on the host refreshes at a time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are per thread, and must not cross a fork
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def get_many(self, symbols, max_age: float) -> dict:
+        """
+        {symbol: price} for quotes fetched within max_age seconds. A price of
+        None means the provider recently had no quote for the symbol.
+        """
+        symbols = list(symbols)
+        if not symbols:
+            return {}
+        cutoff = time.time() - max_age
+        marks = ",".join("?" * len(symbols))
+        rows = self._conn().execute(
+            f"SELECT symbol, price FROM quotes WHERE fetched_at >= ? AND symbol IN ({marks})",
+            [cutoff, *symbols],
+        )
+        return dict(rows.fetchall())
+
+    def put_many(self, symbols, prices: dict) -> None:
+        """Store the fetch result for symbols; ones missing from prices are stored as None."""
+        now = time.time()
+        self._conn().executemany(
+            "INSERT OR REPLACE INTO quotes (symbol, price, fetched_at) VALUES (?, ?, ?)",
+            [(sym, prices.get(sym), now) for sym in symbols],
+        )
+
+    def touch(self, symbols) -> None:
+        """Record that symbols were just requested."""
+        now = time.time()
+        self._conn().executemany(
+            "INSERT OR REPLACE INTO requested (symbol, last_requested) VALUES (?, ?)",
+            [(sym, now) for sym in symbols],
+        )
+
+    def recent_symbols(self, window: float) -> list:
+        """Symbols requested within the last `window` seconds."""
+        rows = self._conn().execute(
+            "SELECT symbol FROM requested WHERE last_requested >= ? ORDER BY symbol",
+            [time.time() - window],
+        )
+        return [r[0] for r in rows.fetchall()]
+
+    def prune(self, window: float) -> int:
+        """
+        Forget symbols not requested within the last `window` seconds, with
+        their quotes, so both tables stay the size of the working set.
+        Returns the number of symbols dropped.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            dropped = conn.execute("DELETE FROM requested WHERE last_requested < ?",
+                                   [time.time() - window]).rowcount
+            conn.execute("DELETE FROM quotes WHERE symbol NOT IN (SELECT symbol FROM requested)")
+            return dropped
+        finally:
+            conn.execute("COMMIT")
+
+    def try_acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Take or renew the named lease unless another owner holds an unexpired one."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", [name]).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                [name, owner, now + ttl],
+            )
+            return True
+        finally:
+            conn.execute("COMMIT")
+
+class QuoteStoreProvider:
+    """
+    Price provider that answers from the QuoteStore and only falls through to
+    `upstream` for symbols without a fresh quote (writing the result back for
+    every other worker). Requested symbols are recorded for the refresher.
+    """
+
+    # Skip re-recording a symbol this process recorded within this many seconds
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, store: QuoteStore, upstream, max_age: float = 120.0):
+        self.store = store
+        self.upstream = upstream
+        self.max_age = max_age
+        self._touched = OrderedDict()  # symbol -> when recorded, oldest first
+        # fetch() runs on the ChunkedFetcher's threads
+        self._lock = threading.Lock()
+
+    def fetch(self, symbols: list) -> dict:
+        touched = self._touched
+        with self._lock:
+            now = time.monotonic()
+            stale = [s for s in symbols if now - touched.get(s, -self.TOUCH_INTERVAL) >= self.TOUCH_INTERVAL]
+            for s in stale:
+                touched[s] = now
+                touched.move_to_end(s)
+            # Entries past the interval no longer skip anything: drop them, so
+            # the map holds only the symbols recorded in the last interval
+            while touched and now - next(iter(touched.values())) >= self.TOUCH_INTERVAL:
+                touched.popitem(last=False)
+        if stale:
+            self.store.touch(stale)
+        stored = self.store.get_many(symbols, self.max_age)
+        missing = [s for s in symbols if s not in stored]
+        if missing:
+            fetched = self.upstream.fetch(missing)
+            self.store.put_many(missing, fetched)
+            stored.update({s: fetched.get(s) for s in missing})
+        return {s: p for s, p in stored.items() if p is not None}
+
+class PriceRefresher:
+    """
+    Daemon thread that re-fetches quotes for recently requested symbols every
+    `interval` seconds, so request-path lookups find them warm. Each worker
+    may run one, but a store lease lets only one per host fetch per round,
+    keeping upstream traffic constant regardless of request volume. Symbols
+    not requested within `window` are pruned from the store each round.
+    """
+
+    LEASE = 'price-refresher'
+
+    def __init__(self, store: QuoteStore, upstream, interval: float = 30.0,
+                 window: float = 3600.0, chunk_size: int = 200):
+        self.store = store
+        self.upstream = upstream
+        self.interval = interval
+        self.window = window
+        self.chunk_size = chunk_size
+        self._token = uuid.uuid4().hex[:8]
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def owner(self) -> str:
+        # Includes the pid so forked workers never share a lease identity
+        return f"{os.getpid()}-{self._token}"
+
+    def start(self) -> None:
+        """Start the thread in this process (idempotent; safe to call per request)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='price-refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def refresh_once(self) -> int:
+        """Refresh all recent symbols if this process holds the lease; returns symbols fetched."""
+        if not self.store.try_acquire_lease(self.LEASE, self.owner, self.interval * 2):
+            return 0
+        self.store.prune(self.window)
+        symbols = self.store.recent_symbols(self.window)
+        for i in range(0, len(symbols), self.chunk_size):
+            chunk = symbols[i:i + self.chunk_size]
+            self.store.put_many(chunk, self.upstream.fetch(chunk))
+        return len(symbols)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh_once()
+            except Exception:
+                # Upstream hiccups just leave the previous quotes in place
+                pass
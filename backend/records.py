@@ -0,0 +1,89 @@
+class _Record:
+    """
+    Base for the compact record types that flow through the backend.
+    Subclasses list their fields in __slots__: no per-instance __dict__, so
+    a record costs one pointer per field. Records are converted to plain
+    dicts only at the JSON edge.
+    """
+
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Positional __init__ generated per record type: records are created
+        # once per CSV row, and plain attribute stores are several times
+        # faster than a setattr loop. Omitted trailing fields default to None.
+        args = ''.join(f', {name}=None' for name in cls.__slots__)
+        body = ''.join(f'\n    self.{name} = {name}' for name in cls.__slots__) or '\n    pass'
+        namespace = {}
+        exec(f'def __init__(self{args}):{body}\n', namespace)
+        cls.__init__ = namespace['__init__']
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values() == other._values()
+
+    def __repr__(self):
+        fields = ", ".join(f"{n}={getattr(self, n)!r}" for n in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def __reduce__(self):
+        # Pickled positionally (process pool IPC), without field names
+        return (type(self), self._values())
+
+    def _values(self) -> tuple:
+        return tuple(getattr(self, n) for n in self.__slots__)
+
+class Trade(_Record):
+    """
+    One parsed activity row. For SPL rows `quantity` holds the extra shares
+    credited (also readable as `extra_shares`); CDIV rows carry `amount`.
+    """
+
+    __slots__ = ('activity_date', 'date', 'instrument', 'trans_code', 'quantity', 'price', 'amount')
+
+    @property
+    def extra_shares(self) -> float:
+        return self.quantity
+
+    @classmethod
+    def from_mapping(cls, t) -> 'Trade':
+        """Build a Trade from the legacy dict shape (keys as parse_robinhood_csv used to emit)."""
+        code = t.get('trans_code')
+        qty = t.get('extra_shares', 0.0) if code == 'SPL' else t.get('quantity', 0.0)
+        return cls(t['activity_date'], t.get('date'), t['instrument'], code,
+                   float(qty or 0.0), float(t.get('price', 0.0) or 0.0), float(t.get('amount', 0.0) or 0.0))
+
+def as_trade(t) -> Trade:
+    """Accept a Trade or a legacy trade dict."""
+    return t if isinstance(t, Trade) else Trade.from_mapping(t)
+
+class Lot(_Record):
+    """
+    An open buy lot. `quantity` and `price` (cost basis per share) are
+    split-adjusted; see lot_inventory.
+    """
+
+    __slots__ = ('lot_id', 'instrument', 'activity_date', 'date', 'quantity', 'price')
+
+    def to_dict(self) -> dict:
+        return {
+            'lotId': self.lot_id,
+            'instrument': self.instrument,
+            'qty': float(self.quantity),
+            'costBasisPerShare': float(self.price),
+            'purchaseDate': self.activity_date,
+        }
+
+class RealizedGain(_Record):
+    """
+    One FIFO match between a sell and a buy lot. `disallowed_loss` is the
+    part of a loss disallowed as a wash sale (positive), or None when the run
+    did not check wash sales.
+    """
+
+    __slots__ = ('instrument', 'sell_date', 'buy_date', 'quantity', 'buy_price', 'sell_price',
+                 'gain_loss', 'gain_type', 'disallowed_loss')
+
+    def to_dict(self) -> dict:
+        return {n: getattr(self, n) for n in self.__slots__
+                if n != 'disallowed_loss' or self.disallowed_loss is not None}
@@ -0,0 +1,90 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+def hash_upload(stream, chunk_size: int = 1 << 20):
+    """
+    sha256 hex digest of a binary upload stream, read from its current
+    position, which is restored afterwards so the stream can still be parsed.
+    Returns None for streams that cannot seek back.
+    """
+    try:
+        start = stream.tell()
+    except (AttributeError, OSError):
+        return None
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(start)
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Encoded upload responses keyed by content (upload hash plus whatever else
+    the body depends on), so re-uploading the same export skips parsing and
+    the gains engine entirely.
+
+    Bounded by the total size of stored bodies (`max_bytes`); least recently
+    used bodies are evicted first. Bodies larger than `max_entry_bytes` are
+    not stored.
+    """
+
+    def __init__(self, max_bytes: int = 64 << 20, max_entry_bytes: int = None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes or max_bytes, max_bytes)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body: bytes) -> None:
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def tee(self, key, chunks):
+        """
+        Pass text chunks through (as a streamed response body) and store the
+        joined body under key once they are exhausted. Collection stops once
+        the body outgrows max_entry_bytes, so large responses still stream.
+        """
+        kept = []
+        size = 0
+        for chunk in chunks:
+            data = chunk.encode('utf-8')
+            if kept is not None:
+                size += len(data)
+                if size > self.max_entry_bytes:
+                    kept = None
+                else:
+                    kept.append(data)
+            yield data
+        if kept is not None:
+            self.put(key, b''.join(kept))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
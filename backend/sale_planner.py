@@ -0,0 +1,185 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date, timedelta
+
+from date_parser import default_parser
+from records import Lot
+
+# Strategies for choosing which open lots a planned sale draws from:
+#   fifo            oldest purchase first (what the broker does by default)
+#   highest_cost    highest cost basis per share first
+#   max_loss        short-term losses, then long-term losses (largest loss per
+#                   share first), then long-term gains, then short-term gains
+#                   (smallest gain per share first)
+#   long_term_only  oldest first, but only lots held long term
+STRATEGIES = ('fifo', 'highest_cost', 'max_loss', 'long_term_only')
+
+# Same rule as the FIFO engine: long term means held more than 365 days
+LONG_TERM_DAYS = 365
+
+class _Run:
+    """
+    Lots in one selling order with prefix sums (index i = total of the first
+    i lots) of quantity and cost, overall and for long-term lots only. Any
+    run of consecutive lots is then summed in O(1), and the lot where a
+    quantity runs out is found by bisection in O(log n).
+    """
+
+    __slots__ = ('lots', 'long_term', 'qty', 'cost', 'lt_qty', 'lt_cost')
+
+    def __init__(self, lots: list, long_term: list):
+        self.lots = lots
+        self.long_term = long_term
+        self.qty = [0.0]
+        self.cost = [0.0]
+        self.lt_qty = [0.0]
+        self.lt_cost = [0.0]
+        for lot, lt in zip(lots, long_term):
+            cost = lot.quantity * lot.price
+            self.qty.append(self.qty[-1] + lot.quantity)
+            self.cost.append(self.cost[-1] + cost)
+            self.lt_qty.append(self.lt_qty[-1] + (lot.quantity if lt else 0.0))
+            self.lt_cost.append(self.lt_cost[-1] + (cost if lt else 0.0))
+
+    def __len__(self):
+        return len(self.lots)
+
+    def take(self, lo: int, hi: int, want: float) -> tuple:
+        """
+        Draw up to `want` shares from lots[lo:hi] in order. Returns
+        (end, partial, qty, cost, lt_qty, lt_cost): lots[lo:end] are sold in
+        full plus `partial` shares of lots[end] (when partial > 0).
+        """
+        base = self.qty[lo]
+        if want <= 0 or lo >= hi:
+            return lo, 0.0, 0.0, 0.0, 0.0, 0.0
+        if self.qty[hi] - base <= want:
+            return (hi, 0.0, self.qty[hi] - base, self.cost[hi] - self.cost[lo],
+                    self.lt_qty[hi] - self.lt_qty[lo], self.lt_cost[hi] - self.lt_cost[lo])
+        # First k whose prefix reaches the wanted quantity; lot k-1 is the partial one
+        k = bisect_left(self.qty, base + want, lo + 1, hi)
+        end = k - 1
+        partial = want - (self.qty[end] - base)
+        lot = self.lots[end]
+        cost = self.cost[end] - self.cost[lo] + partial * lot.price
+        lt_qty = self.lt_qty[end] - self.lt_qty[lo]
+        lt_cost = self.lt_cost[end] - self.lt_cost[lo]
+        if self.long_term[end]:
+            lt_qty += partial
+            lt_cost += partial * lot.price
+        return end, partial, want, cost, lt_qty, lt_cost
+
+    def picks(self, lo: int, end: int, partial: float) -> list:
+        """(lot, quantity, long_term) for a take() result."""
+        out = [(lot, lot.quantity, lt) for lot, lt in zip(self.lots[lo:end], self.long_term[lo:end])]
+        if partial > 0:
+            out.append((self.lots[end], partial, self.long_term[end]))
+        return out
+
+class TickerLots:
+    """
+    One ticker's open lots indexed for planning sales as of a given date:
+    by purchase date (FIFO order, where long-term lots form a prefix) and by
+    cost basis (highest first, overall and per holding term). Building is
+    O(n log n); each plan() is O(log n) plus the size of the returned lot list.
+    """
+
+    def __init__(self, lots: list, as_of: date):
+        cutoff = as_of - timedelta(days=LONG_TERM_DAYS + 1)
+        # Stable: same-day lots keep their FIFO queue order
+        by_date = sorted(lots, key=lambda lot: lot.date)
+        self.long_term_count = bisect_right([lot.date for lot in by_date], cutoff)
+        lt_flags = [i < self.long_term_count for i in range(len(by_date))]
+        self.fifo = _Run(by_date, lt_flags)
+
+        by_cost = sorted(zip(by_date, lt_flags), key=lambda p: -p[0].price)
+        self.by_cost = _Run([p[0] for p in by_cost], [p[1] for p in by_cost])
+        short = [p[0] for p in by_cost if not p[1]]
+        long_ = [p[0] for p in by_cost if p[1]]
+        self.short_by_cost = _Run(short, [False] * len(short))
+        self.long_by_cost = _Run(long_, [True] * len(long_))
+        # Ascending bases, negated, for bisecting the loss/gain boundary
+        self._short_neg_price = [-lot.price for lot in short]
+        self._long_neg_price = [-lot.price for lot in long_]
+
+    @property
+    def total_qty(self) -> float:
+        return self.fifo.qty[-1]
+
+    def _segments(self, strategy: str, price: float) -> list:
+        """(run, lo, hi) ranges in selling order for a strategy."""
+        if strategy == 'fifo':
+            return [(self.fifo, 0, len(self.fifo))]
+        if strategy == 'long_term_only':
+            return [(self.fifo, 0, self.long_term_count)]
+        if strategy == 'highest_cost':
+            return [(self.by_cost, 0, len(self.by_cost))]
+        if strategy == 'max_loss':
+            # Lots with basis above the price are at a loss: a prefix of each cost-ordered run
+            st_loss = bisect_left(self._short_neg_price, -price)
+            lt_loss = bisect_left(self._long_neg_price, -price)
+            return [
+                (self.short_by_cost, 0, st_loss),
+                (self.long_by_cost, 0, lt_loss),
+                (self.long_by_cost, lt_loss, len(self.long_by_cost)),
+                (self.short_by_cost, st_loss, len(self.short_by_cost)),
+            ]
+        raise ValueError(f"Unknown strategy: {strategy}")
+
+    def plan(self, quantity: float, price: float, strategy: str = 'fifo', with_lots: bool = True) -> dict:
+        """
+        Plan selling `quantity` shares at `price`. Totals are raw floats; the
+        API layer rounds. 'shortfall' is the part the strategy's lots cannot cover.
+        """
+        remaining = quantity
+        qty = cost = lt_qty = lt_cost = 0.0
+        lots = []
+        for run, lo, hi in self._segments(strategy, price):
+            if remaining <= 0:
+                break
+            end, partial, q, c, lq, lc = run.take(lo, hi, remaining)
+            qty += q
+            cost += c
+            lt_qty += lq
+            lt_cost += lc
+            remaining -= q
+            if with_lots:
+                lots.extend(run.picks(lo, end, partial))
+
+        long_term_gain = price * lt_qty - lt_cost
+        short_term_gain = price * (qty - lt_qty) - (cost - lt_cost)
+        plan = {
+            'strategy': strategy,
+            'quantity': qty,
+            'shortfall': max(quantity - qty, 0.0),
+            'price': price,
+            'proceeds': price * qty,
+            'cost_basis': cost,
+            'gain_loss': long_term_gain + short_term_gain,
+            'long_term_gain': long_term_gain,
+            'short_term_gain': short_term_gain,
+        }
+        if with_lots:
+            plan['lots'] = lots
+        return plan
+
+def lots_from_dicts(rows) -> list:
+    """Lot records from API-shaped unsold lots (see Lot.to_dict)."""
+    lots = []
+    for row in rows:
+        d = default_parser.parse(row['purchaseDate'])
+        if d is None:
+            raise ValueError(f"Unrecognized purchaseDate: {row['purchaseDate']!r}")
+        qty = float(row['qty'])
+        if qty > 0:
+            lots.append(Lot(row.get('lotId'), row['instrument'], row['purchaseDate'], d,
+                            qty, float(row['costBasisPerShare'])))
+    return lots
+
+def index_lots(lots, as_of: date) -> dict:
+    """{ticker: TickerLots} over Lot records, e.g. calculate_capital_gains()['unsold_lots']."""
+    by_ticker = defaultdict(list)
+    for lot in lots:
+        if lot.quantity > 0:
+            by_ticker[lot.instrument].append(lot)
+    return {ticker: TickerLots(ticker_lots, as_of) for ticker, ticker_lots in by_ticker.items()}
@@ -0,0 +1,114 @@
+"""
+What-if unrealized gains: the open lots' P/L for a grid of prices per ticker
+and a set of as-of dates, in one call.
+
+Each ticker's lots are sorted once by purchase date and once by cost basis,
+with prefix sums of quantity and cost. P/L at price p over any prefix is
+then p * qty - cost, so every cell of the grid is O(1) after a bisection:
+
+  - net P/L depends on the price only: p * total_qty - total_cost
+  - long-term lots are a prefix of the purchase-date order (bought on or
+    before as_of - 366 days), so the long-term part for each date is one
+    searchsorted into the purchase days
+  - lots at a gain are a prefix of the basis order (basis <= p), so the
+    gains and losses split for each price is one searchsorted into the bases
+
+The price × date matrices are formed by broadcasting the per-price and
+per-date prefix sums against each other: O((n + prices + dates) log n +
+prices × dates) per ticker, rather than a pass over the lots per scenario.
+"""
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from sale_planner import LONG_TERM_DAYS
+
+# Upper bound on ticker × price × date cells per request (the response size)
+MAX_CELLS = int(os.environ.get('SCENARIO_MAX_CELLS', '1000000'))
+
+class ScenarioError(ValueError):
+    """A scenario grid that is empty or larger than MAX_CELLS."""
+
+class TickerScenarios:
+    """One ticker's open lots as prefix sums, by purchase date and by cost basis."""
+
+    def __init__(self, lots: list):
+        day = np.fromiter((lot.date.toordinal() for lot in lots), dtype=np.int64, count=len(lots))
+        qty = np.fromiter((lot.quantity for lot in lots), dtype=np.float64, count=len(lots))
+        basis = np.fromiter((lot.price for lot in lots), dtype=np.float64, count=len(lots))
+        cost = qty * basis
+
+        by_date = np.argsort(day, kind='stable')
+        self.days = day[by_date]
+        self.date_qty = np.concatenate(([0.0], np.cumsum(qty[by_date])))
+        self.date_cost = np.concatenate(([0.0], np.cumsum(cost[by_date])))
+
+        by_basis = np.argsort(basis, kind='stable')
+        self.bases = basis[by_basis]
+        self.basis_qty = np.concatenate(([0.0], np.cumsum(qty[by_basis])))
+        self.basis_cost = np.concatenate(([0.0], np.cumsum(cost[by_basis])))
+
+    @property
+    def total_qty(self) -> float:
+        return float(self.date_qty[-1])
+
+    @property
+    def total_cost(self) -> float:
+        return float(self.date_cost[-1])
+
+    def evaluate(self, prices, cutoffs) -> dict:
+        """
+        P/L at each of `prices` (shape (m,)), split by holding term at each
+        long-term cutoff day (ordinals, shape (d,)). Returns raw float arrays:
+        net, gains and losses (m,), long_term and short_term (m, d).
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        net = prices * self.date_qty[-1] - self.date_cost[-1]
+
+        at_gain = np.searchsorted(self.bases, prices, side='right')
+        gains = prices * self.basis_qty[at_gain] - self.basis_cost[at_gain]
+
+        held_long = np.searchsorted(self.days, cutoffs, side='right')
+        long_term = prices[:, None] * self.date_qty[held_long][None, :] - self.date_cost[held_long][None, :]
+        return {
+            'net': net,
+            'gains': gains,
+            'losses': net - gains,
+            'long_term': long_term,
+            'short_term': net[:, None] - long_term,
+        }
+
+def long_term_cutoffs(as_of_dates) -> np.ndarray:
+    """Last purchase day (ordinal) still long term on each as-of date."""
+    return np.fromiter((d.toordinal() - (LONG_TERM_DAYS + 1) for d in as_of_dates),
+                       dtype=np.int64, count=len(as_of_dates))
+
+def scenario_matrix(lots, prices: dict, as_of_dates: list) -> dict:
+    """
+    {ticker: TickerScenarios.evaluate() plus total quantity and cost} for
+    each ticker in `prices` ({ticker: [price, ...]}), over Lot records such
+    as calculate_capital_gains()['unsold_lots']. Lots of other tickers are
+    ignored; a ticker without lots evaluates to zeros.
+    """
+    if not as_of_dates:
+        raise ScenarioError("At least one as-of date is required")
+    cells = sum(len(grid) for grid in prices.values()) * len(as_of_dates)
+    if cells > MAX_CELLS:
+        raise ScenarioError(f"Scenario grid has {cells} cells; the limit is {MAX_CELLS}")
+
+    by_ticker = defaultdict(list)
+    for lot in lots:
+        if lot.quantity > 0 and lot.instrument in prices:
+            by_ticker[lot.instrument].append(lot)
+    cutoffs = long_term_cutoffs(as_of_dates)
+    out = {}
+    for ticker, grid in prices.items():
+        if not len(grid):
+            raise ScenarioError(f"No prices given for {ticker}")
+        scenarios = TickerScenarios(by_ticker.get(ticker, []))
+        result = scenarios.evaluate(grid, cutoffs)
+        result['quantity'] = scenarios.total_qty
+        result['cost_basis'] = scenarios.total_cost
+        out[ticker] = result
+    return out
@@ -0,0 +1,262 @@
+"""
+One-pass JSON encoding of upload results.
+
+iter_upload_result() walks the RealizedGain/Lot records once and yields
+JSON text chunks, rounding prices (2 dp) and quantities (5 dp) as it goes.
+It skips intermediate per-row dicts, the generic encoder's second walk
+and, when streamed, the fully joined body. The default "rows" shape is
+byte-for-byte what jsonify would produce for the same values: sorted keys,
+compact separators, ASCII escapes and a trailing newline.
+
+The "columns" shape carries the same values as one array per field
+(per instrument for gains), which is much smaller for large histories.
+
+The "ndjson" shape is one JSON record per line: gain and lot batches per
+instrument, then a summary record (see iter_ndjson). Encoded from a
+GainsStream, it goes out as each instrument is calculated.
+"""
+import json
+from collections import defaultdict
+from json.encoder import encode_basestring_ascii
+from math import isfinite
+
+COLUMNS_MIMETYPE = 'application/vnd.capitalgains.columns+json'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+SHAPES = ('rows', 'columns', 'ndjson')
+# Response Content-Type per shape
+MIMETYPES = {'rows': 'application/json', 'columns': 'application/json', 'ndjson': NDJSON_MIMETYPE}
+
+# Unsold lots encoded per chunk when streaming
+CHUNK_ROWS = 2000
+
+def _num(val, ndigits: int) -> str:
+    try:
+        r = round(float(val), ndigits)
+    except Exception:
+        return _any(val)
+    if isfinite(r):
+        return float.__repr__(r)
+    # Same spellings as the json module
+    return 'NaN' if r != r else ('Infinity' if r > 0 else '-Infinity')
+
+def _any(val) -> str:
+    if val is None:
+        return 'null'
+    if isinstance(val, str):
+        return encode_basestring_ascii(val)
+    if isinstance(val, bool):
+        return 'true' if val else 'false'
+    if isinstance(val, int):
+        return int.__repr__(val)
+    return _num(val, 17)
+
+class _Strings(dict):
+    """Memo of encoded strings; dates and tickers repeat on almost every row."""
+
+    def __missing__(self, s):
+        enc = self[s] = _any(s)
+        return enc
+
+def _totals(totals: dict) -> str:
+    return '"dividends":%s,%s"long_term":%s,"short_term":%s' % (
+        _num(totals.get('dividends', 0), 2),
+        '' if 'instruments' not in totals else '"instruments":{%s},' % ','.join(
+            '%s:{%s}' % (_any(inst), _totals(inst_totals))
+            for inst, inst_totals in sorted(totals['instruments'].items())
+        ),
+        _num(totals.get('long_term', 0), 2),
+        _num(totals.get('short_term', 0), 2),
+    )
+
+def _summary(summary: dict) -> str:
+    by_year = ''
+    if 'by_year' in summary:
+        by_year = '"by_year":{%s},' % ','.join(
+            '%s:{%s}' % (_any(year), _totals(totals)) for year, totals in sorted(summary['by_year'].items())
+        )
+    return '{%s"current_year_gains":%s,"past_gains":%s}' % (
+        by_year,
+        _num(summary.get('current_year_gains', 0), 2),
+        _num(summary.get('past_gains', 0), 2),
+    )
+
+def _tickers(tickers) -> str:
+    return '[' + ','.join(_any(t) for t in tickers) + ']'
+
+def _middle(result: dict) -> str:
+    """remaining_tickers, the optional snapshot and sources, and summary, in sorted key order."""
+    text = '},"remaining_tickers":' + _tickers(result.get('remaining_tickers', []))
+    # Plain JSON data, and small next to the gains
+    for key in ('snapshot', 'sources'):
+        if key in result:
+            text += ',"%s":' % key + json.dumps(result[key], sort_keys=True, separators=(',', ':'))
+    return text + ',"summary":' + _summary(result.get('summary', {}) or {})
+
+def _gain_rows(entries: list, enc: _Strings) -> list:
+    """Encoded RealizedGain rows, with disallowed_loss when the run computed it."""
+    if entries and entries[0].disallowed_loss is not None:
+        # Wash-sale runs: every row carries disallowed_loss
+        return [
+            '{"buy_date":%s,"buy_price":%s,"disallowed_loss":%s,"gain_loss":%s,"gain_type":%s,'
+            '"instrument":%s,"quantity":%s,"sell_date":%s,"sell_price":%s}' % (
+                enc[e.buy_date], _num(e.buy_price, 2), _num(e.disallowed_loss, 2), _num(e.gain_loss, 2),
+                enc[e.gain_type], enc[e.instrument], _num(e.quantity, 5), enc[e.sell_date],
+                _num(e.sell_price, 2),
+            )
+            for e in entries
+        ]
+    return [
+        '{"buy_date":%s,"buy_price":%s,"gain_loss":%s,"gain_type":%s,"instrument":%s,'
+        '"quantity":%s,"sell_date":%s,"sell_price":%s}' % (
+            enc[e.buy_date], _num(e.buy_price, 2), _num(e.gain_loss, 2), enc[e.gain_type],
+            enc[e.instrument], _num(e.quantity, 5), enc[e.sell_date], _num(e.sell_price, 2),
+        )
+        for e in entries
+    ]
+
+def _lot_rows(lots: list, enc: _Strings) -> list:
+    return [
+        '{"costBasisPerShare":%s,"instrument":%s,"lotId":%s,"purchaseDate":%s,"qty":%s}' % (
+            _num(lot.price, 2), enc[lot.instrument], enc[lot.lot_id], enc[lot.activity_date],
+            _num(lot.quantity, 5),
+        )
+        for lot in lots
+    ]
+
+def _iter_rows(result: dict):
+    enc = _Strings()
+    yield '{"gains":{'
+    gains = result.get('gains', {}) or {}
+    sep = ''
+    for instrument in sorted(gains):
+        yield sep + enc[instrument] + ':[' + ','.join(_gain_rows(gains[instrument] or [], enc)) + ']'
+        sep = ','
+    yield _middle(result) + ',"unsold_lots":['
+    lots = result.get('unsold_lots', []) or []
+    sep = ''
+    for i in range(0, len(lots), CHUNK_ROWS):
+        yield sep + ','.join(_lot_rows(lots[i:i + CHUNK_ROWS], enc))
+        sep = ','
+    yield ']}\n'
+
+def _column(values, encode) -> str:
+    return '[' + ','.join([encode(v) for v in values]) + ']'
+
+def _iter_columns(result: dict):
+    enc = _Strings()
+    price = lambda v: _num(v, 2)
+    qty = lambda v: _num(v, 5)
+    text = enc.__getitem__
+    yield '{"format":"columns","gains":{'
+    gains = result.get('gains', {}) or {}
+    sep = ''
+    for instrument in sorted(gains):
+        entries = gains[instrument] or []
+        disallowed = ''
+        if entries and entries[0].disallowed_loss is not None:
+            disallowed = '"disallowed_loss":%s,' % _column((e.disallowed_loss for e in entries), price)
+        yield sep + enc[instrument] + (
+            ':{"buy_date":%s,"buy_price":%s,%s"gain_loss":%s,"gain_type":%s,'
+            '"quantity":%s,"sell_date":%s,"sell_price":%s}' % (
+            _column((e.buy_date for e in entries), text),
+            _column((e.buy_price for e in entries), price),
+            disallowed,
+            _column((e.gain_loss for e in entries), price),
+            _column((e.gain_type for e in entries), text),
+            _column((e.quantity for e in entries), qty),
+            _column((e.sell_date for e in entries), text),
+            _column((e.sell_price for e in entries), price),
+            ))
+        sep = ','
+    lots = result.get('unsold_lots', []) or []
+    yield _middle(result)
+    yield (',"unsold_lots":{"costBasisPerShare":%s,"instrument":%s,"lotId":%s,"purchaseDate":%s,"qty":%s}}\n' % (
+        _column((l.price for l in lots), price),
+        _column((l.instrument for l in lots), text),
+        _column((l.lot_id for l in lots), text),
+        _column((l.activity_date for l in lots), text),
+        _column((l.quantity for l in lots), qty),
+    ))
+
+def iter_ndjson(stream):
+    """
+    Encode a GainsStream (see capital_gains_calculator) as newline-delimited
+    JSON, one text chunk per instrument as it comes out of the calculator:
+
+        {"gains":[...],"instrument":"AAPL","type":"gains"}     every instrument
+        {"instrument":"AAPL","lots":[...],"type":"lots"}       instruments with open lots
+        {"remaining_tickers":[...],"summary":{...},"type":"summary"}   last
+
+    Rows are encoded as in the rows shape, CHUNK_ROWS per record at most, so
+    a large instrument spans several records. Instruments come in
+    calculation order, not sorted. An error raised mid-stream ends it with
+    {"error":"...","type":"error"} instead of the summary.
+    """
+    enc = _Strings()
+    try:
+        for instrument, gains, lots in stream:
+            name = enc[instrument]
+            lines = []
+            for i in range(0, max(len(gains), 1), CHUNK_ROWS):
+                lines.append('{"gains":[%s],"instrument":%s,"type":"gains"}\n' % (
+                    ','.join(_gain_rows(gains[i:i + CHUNK_ROWS], enc)), name))
+            for i in range(0, len(lots), CHUNK_ROWS):
+                lines.append('{"instrument":%s,"lots":[%s],"type":"lots"}\n' % (
+                    name, ','.join(_lot_rows(lots[i:i + CHUNK_ROWS], enc))))
+            yield ''.join(lines)
+    except Exception as e:
+        yield '{"error":%s,"type":"error"}\n' % _any(str(e) or type(e).__name__)
+        return
+    extra = ''
+    for key in ('snapshot', 'sources'):
+        value = getattr(stream, key, None)
+        if value is not None:
+            extra += '"%s":%s,' % (key, json.dumps(value, sort_keys=True, separators=(',', ':')))
+    yield '{"remaining_tickers":%s,%s"summary":%s,"type":"summary"}\n' % (
+        _tickers(stream.remaining_tickers), extra, _summary(stream.summary or {}))
+
+class _ResultStream:
+    """A finished calculate_capital_gains() result in the GainsStream shape, for iter_ndjson."""
+
+    def __init__(self, result: dict):
+        self.result = result
+        self.summary = result.get('summary', {}) or {}
+        self.remaining_tickers = result.get('remaining_tickers', [])
+        self.snapshot = result.get('snapshot')
+        self.sources = result.get('sources')
+
+    def __iter__(self):
+        lots_by_instrument = defaultdict(list)
+        for lot in self.result.get('unsold_lots', []) or []:
+            lots_by_instrument[lot.instrument].append(lot)
+        gains = self.result.get('gains', {}) or {}
+        for instrument, entries in gains.items():
+            yield instrument, entries or [], lots_by_instrument.pop(instrument, [])
+        # Lots of instruments missing from gains (not produced by the engines, but keep them)
+        for instrument, lots in lots_by_instrument.items():
+            yield instrument, [], lots
+
+def iter_upload_result(result: dict, shape: str = 'rows'):
+    """
+    Encode a calculate_capital_gains() result as JSON text chunks (one per
+    instrument, CHUNK_ROWS lots at a time), suitable for a streamed Response.
+    """
+    if shape == 'columns':
+        return _iter_columns(result)
+    if shape == 'ndjson':
+        return iter_ndjson(_ResultStream(result))
+    return _iter_rows(result)
+
+def dumps_upload_result(result: dict, shape: str = 'rows') -> str:
+    """The whole encoded document as one string."""
+    return ''.join(iter_upload_result(result, shape))
+
+def negotiate_shape(format_param, accept_header) -> str:
+    """Pick the response shape from ?format= (wins) or the Accept header; default rows."""
+    if format_param:
+        return format_param if format_param in SHAPES else None
+    if accept_header and COLUMNS_MIMETYPE in accept_header:
+        return 'columns'
+    if accept_header and NDJSON_MIMETYPE in accept_header:
+        return 'ndjson'
+    return 'rows'
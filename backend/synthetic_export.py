@@ -0,0 +1,158 @@
+"""
+Deterministic synthetic Robinhood activity exports, for benchmarks and tests.
+
+The same (rows, tickers, seed, date_style) always yields the same bytes.
+Histories look like real ones: a few tickers get most of the activity
+(Zipf-like popularity), prices random-walk over the years, sells and
+dividends only happen on held positions, and the file is newest first as
+Robinhood writes it. Rows include Buy/Sell, CDIV, dividend reinvestment
+(DRIP) buys with fractional shares, occasional splits (SPL), non-trade
+cash rows, and money in Robinhood's "$1,234.56" / "($1,234.56)" style.
+
+    python synthetic_export.py out.csv --rows 100000 --tickers 500
+"""
+import argparse
+import random
+import sys
+from bisect import bisect
+from itertools import accumulate
+from datetime import date, timedelta
+
+HEADER = '"Activity Date","Process Date","Settle Date","Instrument","Description","Trans Code","Quantity","Price","Amount"'
+
+# Activity date styles drawn from date_parser.DATE_FORMATS, with weights for
+# "mixed" files.
+_DATE_STYLES = [
+    ('robinhood', 65),  # 1/5/2024, as the app exports
+    ('%m/%d/%Y', 10),
+    ('%m/%d/%y', 5),
+    ('%Y-%m-%d', 10),
+    ('%Y-%m-%d %H:%M', 3),
+    ('%Y-%m-%d %H:%M:%S', 3),
+    ('%m/%d/%Y %H:%M', 2),
+    ('%m/%d/%Y %H:%M:%S', 2),
+]
+
+_CASH_ROWS = [
+    ('ACH', 'ACH Deposit'),
+    ('INT', 'Interest Payment'),
+    ('GOLD', 'Gold Subscription Fee'),
+]
+
+def _money(value: float) -> str:
+    text = f"${abs(value):,.2f}"
+    return f"({text})" if value < 0 else text
+
+def _qty(value: float) -> str:
+    return f"{value:.6f}".rstrip('0').rstrip('.')
+
+def _format_date(d: date, style: str, rng: random.Random) -> str:
+    if style == 'robinhood':
+        return f"{d.month}/{d.day}/{d.year}"
+    if '%H' in style:
+        return d.strftime(style.replace('%H', f"{rng.randrange(9, 16):02d}")
+                          .replace('%M', f"{rng.randrange(60):02d}")
+                          .replace('%S', f"{rng.randrange(60):02d}"))
+    return d.strftime(style)
+
+class _Ticker:
+    __slots__ = ('symbol', 'price', 'held')
+
+    def __init__(self, symbol: str, price: float):
+        self.symbol = symbol
+        self.price = price
+        self.held = 0.0
+
+def generate_rows(rows: int, tickers: int = 500, seed: int = 1, date_style: str = 'mixed',
+                  start: date = date(2015, 1, 2), years: int = 10):
+    """
+    Yield `rows` CSV lines (without newline) in chronological order.
+    date_style is 'mixed' (per-row styles from _DATE_STYLES) or one style name.
+    """
+    rng = random.Random(seed)
+    book = [_Ticker(f"T{i:04d}", rng.uniform(5, 400)) for i in range(tickers)]
+    # Zipf-like popularity: a handful of tickers dominate activity
+    ticker_cum = list(accumulate(1.0 / (i + 1) ** 1.1 for i in range(tickers)))
+    styles = [s for s, _ in _DATE_STYLES]
+    style_cum = list(accumulate(w for _, w in _DATE_STYLES))
+    span = years * 365
+    dates = {}  # (date, style) -> text, for styles without a time of day
+
+    def fmt(d, style):
+        if '%H' in style:
+            return _format_date(d, style, rng)
+        text = dates.get((d, style))
+        if text is None:
+            text = dates[d, style] = _format_date(d, style, rng)
+        return text
+
+    emitted = 0
+    while emitted < rows:
+        d = start + timedelta(days=emitted * span // max(rows, 1))
+        style = styles[bisect(style_cum, rng.random() * style_cum[-1])] if date_style == 'mixed' else date_style
+        day = fmt(d, style)
+        settle = fmt(d + timedelta(days=2), style)
+        t = book[bisect(ticker_cum, rng.random() * ticker_cum[-1])]
+        t.price = max(0.5, t.price * (1 + rng.gauss(0.0003, 0.02)))
+        price = round(t.price, 2)
+        r = rng.random()
+
+        if r < 0.03:
+            code, desc = rng.choice(_CASH_ROWS)
+            yield f'"{day}","{day}","{settle}","","{desc}","{code}","","","{_money(rng.uniform(1, 500))}"'
+        elif t.held > 0 and r < 0.0305:
+            # 2-for-1 or 3-for-1 forward split: Quantity is the extra shares credited
+            extra = t.held * rng.choice((1, 2))
+            t.held += extra
+            t.price /= 1 + extra / (t.held - extra)
+            yield f'"{day}","{day}","{day}","{t.symbol}","Stock Split","SPL","{_qty(extra)}","",""'
+        elif t.held > 0 and r < 0.15:
+            amount = round(t.held * price * rng.uniform(0.002, 0.01), 2) or 0.01
+            yield f'"{day}","{day}","{day}","{t.symbol}","Cash Div: R/D {day} P/D {day}","CDIV","","","{_money(amount)}"'
+            if rng.random() < 0.4 and emitted + 1 < rows:
+                # DRIP: the dividend bought back as fractional shares
+                qty = round(amount / price, 6) or 0.000001
+                t.held += qty
+                emitted += 1
+                yield (f'"{day}","{day}","{settle}","{t.symbol}","Dividend Reinvestment","Buy",'
+                       f'"{_qty(qty)}","{_money(price)}","{_money(-qty * price)}"')
+        elif t.held > 0 and r < 0.40:
+            qty = t.held if rng.random() < 0.2 else round(t.held * rng.uniform(0.1, 0.9), 4)
+            qty = min(qty, t.held) or t.held
+            t.held -= qty
+            yield (f'"{day}","{day}","{settle}","{t.symbol}","{t.symbol} Market Sell","Sell",'
+                   f'"{_qty(qty)}","{_money(price)}","{_money(qty * price)}"')
+        else:
+            qty = float(rng.randint(1, 50)) if rng.random() < 0.8 else round(rng.uniform(0.01, 10), 5)
+            t.held += qty
+            yield (f'"{day}","{day}","{settle}","{t.symbol}","{t.symbol} Market Buy","Buy",'
+                   f'"{_qty(qty)}","{_money(price)}","{_money(-qty * price)}"')
+        emitted += 1
+
+def write_export(out, rows: int, tickers: int = 500, seed: int = 1, date_style: str = 'mixed') -> None:
+    """Write an export (newest first, like Robinhood) to a path or a text stream."""
+    lines = list(generate_rows(rows, tickers, seed, date_style))
+    lines.reverse()
+    if isinstance(out, str):
+        with open(out, 'w', encoding='utf-8', newline='') as f:
+            _write_lines(f, lines)
+    else:
+        _write_lines(out, lines)
+
+def _write_lines(f, lines) -> None:
+    f.write(HEADER + "\n")
+    f.write("\n".join(lines))
+    f.write("\n")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('out', nargs='?', help='output path (stdout if omitted)')
+    ap.add_argument('--rows', type=int, default=10000)
+    ap.add_argument('--tickers', type=int, default=500)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--date-style', default='mixed')
+    args = ap.parse_args()
+    write_export(args.out or sys.stdout, args.rows, args.tickers, args.seed, args.date_style)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from async_quotes import TIMEOUT_ERROR, ChunkedFetcher, HttpQuoteProvider
+from price_cache import PartialFetch, PriceCache
+
+
+class FakeQuoteServer:
+    """
+    Local Yahoo-style quote endpoint. Prices are 100 + len(symbol); requests
+    containing a SLOW* symbol stall, and ones with a FAIL* symbol get a 500.
+    """
+
+    def __init__(self, stall: float = 1.0):
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                symbols = parse_qs(urlsplit(self.path).query)['symbols'][0].split(',')
+                server.requests.append(symbols)
+                if any(s.startswith('SLOW') for s in symbols):
+                    time.sleep(stall)
+                if any(s.startswith('FAIL') for s in symbols):
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                body = json.dumps({'quoteResponse': {'result': [
+                    {'symbol': s, 'regularMarketPrice': 100.0 + len(s)} for s in symbols if not s.startswith('NONE')
+                ]}}).encode()
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(body)
+                except ConnectionError:
+                    pass  # the client gave up on this chunk
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v7/finance/quote"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def quote_server():
+    server = FakeQuoteServer()
+    yield server
+    server.close()
+
+
+def test_chunks_are_fetched_concurrently(quote_server):
+    fetcher = ChunkedFetcher(HttpQuoteProvider(quote_server.url), chunk_size=2, chunk_timeout=1, deadline=2)
+    assert fetcher.fetch(['A', 'BB', 'CCC', 'NONE']) == {'A': 101.0, 'BB': 102.0, 'CCC': 103.0}
+    assert sorted(quote_server.requests) == [['A', 'BB'], ['CCC', 'NONE']]
+
+
+def test_slow_and_failing_chunks_return_partial_results(quote_server):
+    fetcher = ChunkedFetcher(HttpQuoteProvider(quote_server.url), chunk_size=1, chunk_timeout=0.3, deadline=1)
+    start = time.monotonic()
+    with pytest.raises(PartialFetch) as exc:
+        fetcher.fetch(['AAPL', 'SLOW1', 'FAIL1'])
+    assert time.monotonic() - start < 1.0
+    assert exc.value.prices == {'AAPL': 104.0}
+    assert exc.value.errors['SLOW1'] == TIMEOUT_ERROR
+    assert 'HTTP 500' in exc.value.errors['FAIL1']
+
+
+def test_overall_deadline_bounds_queued_chunks():
+    gate = threading.Event()
+
+    class Blocking:
+        def fetch(self, symbols):
+            gate.wait(1)
+            return {s: 1.0 for s in symbols}
+
+    fetcher = ChunkedFetcher(Blocking(), chunk_size=1, chunk_timeout=5, deadline=0.2, max_concurrency=1)
+    start = time.monotonic()
+    prices, errors = asyncio.run(fetcher.fetch_async(['A', 'B', 'C']))
+    gate.set()
+    assert time.monotonic() - start < 0.5
+    assert prices == {} and errors == {s: TIMEOUT_ERROR for s in 'ABC'}
+
+
+def test_price_cache_keeps_arrived_prices_and_retries_failures(quote_server):
+    fetcher = ChunkedFetcher(HttpQuoteProvider(quote_server.url), chunk_size=1, chunk_timeout=0.3, deadline=1)
+    cache = PriceCache(fetcher, coalesce_window=0)
+    errors = {}
+    assert cache.get_many(['AAPL', 'SLOW1'], errors=errors) == {'AAPL': 104.0}
+    assert errors == {'SLOW1': TIMEOUT_ERROR}
+    with pytest.raises(PartialFetch):
+        cache.get_many(['AAPL', 'SLOW1'])
+    # AAPL was cached; SLOW1 was not, so it is requested again each time
+    assert [r for r in quote_server.requests if r == ['AAPL']] == [['AAPL']]
+    assert quote_server.requests.count(['SLOW1']) == 2
+
+
+def test_get_price_returns_207_with_partial_results(quote_server, monkeypatch):
+    import main
+    fetcher = ChunkedFetcher(HttpQuoteProvider(quote_server.url), chunk_size=1, chunk_timeout=0.3, deadline=1)
+    monkeypatch.setattr(main.price_cache, 'provider', fetcher)
+    main.price_cache.clear()
+    client = main.app.test_client()
+    resp = client.get('/api/get_price?tickers=AAPL,SLOW1,NONE1')
+    assert resp.status_code == 207
+    assert resp.get_json() == {
+        'prices': {'AAPL': 104.0},
+        'errors': [{'SLOW1': TIMEOUT_ERROR}, {'NONE1': 'No price found'}],
+    }
+    resp = client.get('/api/get_price?tickers=FAIL1')
+    assert resp.status_code == 502
+    assert 'HTTP 500' in resp.get_json()['errors'][0]['FAIL1']
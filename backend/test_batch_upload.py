@@ -0,0 +1,78 @@
+import io
+
+import pytest
+
+from batch_upload import ExportError, merge_trades, parse_export, parse_exports
+from capital_gains_calculator import calculate_capital_gains
+from csv_parser import iter_export_trades, iter_robinhood_trades
+from synthetic_export import HEADER, generate_rows
+
+FIDELITY_CSV = (
+    '\n\n'
+    'Run Date,Account,Action,Symbol,Security Description,Security Type,Quantity,Price ($),'
+    'Commission ($),Fees ($),Accrued Interest ($),Amount ($),Settlement Date\n'
+    ' 03/01/2024,"Individual X1"," YOU SOLD APPLE INC (AAPL) (Cash)", AAPL," APPLE INC",Cash,-5,180,,,,900,03/05/2024\n'
+    ' 02/15/2024,"Individual X1"," DIVIDEND RECEIVED APPLE INC (AAPL) (Cash)", AAPL," APPLE INC",Cash,0,,,,,2.4,\n'
+    ' 02/01/2024,"Individual X1"," ELECTRONIC FUNDS TRANSFER RECEIVED (Cash)", ," No Description",Cash,0,,,,,500,\n'
+    ' 01/10/2023,"Individual X1"," YOU BOUGHT APPLE INC (AAPL) (Cash)", AAPL," APPLE INC",Cash,10,130,,,,-1300,01/12/2023\n'
+    '\n'
+    '"The data and information in this spreadsheet is provided to you solely for your use."\n'
+)
+
+
+def test_fidelity_export_is_detected_and_parsed():
+    broker, trades = iter_export_trades(io.StringIO(FIDELITY_CSV))
+    assert broker == 'fidelity'
+    trades = list(trades)
+    assert [(t.trans_code, t.instrument, t.quantity, t.price, t.amount) for t in trades] == [
+        ('Sell', 'AAPL', 5.0, 180.0, 900.0),
+        ('CDIV', 'AAPL', 0.0, 0.0, 2.4),
+        ('Buy', 'AAPL', 10.0, 130.0, -1300.0),
+    ]
+    assert trades[0].activity_date == '03/01/2024'
+
+
+def _export(lines) -> str:
+    return HEADER + '\n' + '\n'.join(lines) + '\n'
+
+
+def test_merged_files_match_single_upload():
+    lines = list(generate_rows(3000, tickers=15, seed=5))
+    cut = 1700
+    while lines[cut].split('","')[0] == lines[cut - 1].split('","')[0]:
+        cut += 1
+    # Newest first, as exported; split into an older and a newer file
+    whole = _export(reversed(lines))
+    older, newer = _export(reversed(lines[:cut])), _export(reversed(lines[cut:]))
+
+    parsed = parse_exports([('new.csv', newer.encode()), ('old.csv', older.encode())], parallel=False)
+    assert [(name, broker) for name, broker, _ in parsed] == [('new.csv', 'robinhood'), ('old.csv', 'robinhood')]
+    merged = list(merge_trades([trades for _, _, trades in parsed]))
+    assert [t.date for t in merged] == sorted(t.date for t in merged)
+
+    batch = calculate_capital_gains(iter(merged), parallel=False)
+    single = calculate_capital_gains(iter_robinhood_trades(io.StringIO(whole)), parallel=False)
+    assert batch['gains'] == single['gains']
+    # Per-instrument totals match exactly; overall sums run in another instrument order
+    for key in ('past_gains', 'current_year_gains'):
+        assert batch['summary'][key] == pytest.approx(single['summary'][key])
+    assert batch['summary']['by_year'].keys() == single['summary']['by_year'].keys()
+    for year, totals in batch['summary']['by_year'].items():
+        assert totals['instruments'] == single['summary']['by_year'][year]['instruments']
+    assert sorted(batch['unsold_lots'], key=lambda l: l.lot_id) == sorted(single['unsold_lots'], key=lambda l: l.lot_id)
+
+
+def test_parse_exports_on_pool_matches_serial():
+    files = [('a.csv', _export(generate_rows(500, tickers=5, seed=1)).encode()),
+             ('b.csv', FIDELITY_CSV.encode())]
+    assert parse_exports(files, parallel=True) == parse_exports(files, parallel=False)
+
+
+def test_bad_export_names_the_file():
+    bad = HEADER + '\n"someday","","","AAPL","","Buy","1","$1.00","($1.00)"\n'
+    try:
+        parse_export('bad.csv', bad.encode())
+    except ExportError as e:
+        assert 'bad.csv' in str(e)
+    else:
+        raise AssertionError('expected ExportError')
@@ -0,0 +1,17 @@
+import bench
+
+
+def test_run_reports_each_stage():
+    results = bench.run([300], tickers=10, engines=['fifo', 'vectorized'], repeat=1, memory=True)
+    assert [(r['stage'], r['engine']) for r in results] == [
+        ('parse', None), ('compute', 'fifo'), ('format', 'fifo'),
+        ('compute', 'vectorized'), ('format', 'vectorized'),
+    ]
+    assert all(r['seconds'] > 0 and r['peak_kb'] is not None for r in results)
+
+
+def test_compare_flags_slow_stages():
+    old = [{'rows': 10, 'tickers': 1, 'stage': 'parse', 'engine': None, 'seconds': 1.0}]
+    new = [dict(old[0], seconds=1.2)]
+    assert bench.compare(new, old, tolerance=0.25) == []
+    assert len(bench.compare(new, old, tolerance=0.1)) == 1
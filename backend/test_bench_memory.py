@@ -0,0 +1,11 @@
+import pytest
+
+import bench_memory
+
+
+@pytest.mark.parametrize('engine', ['fifo', 'vectorized'])
+def test_run_reports_the_pipeline(engine):
+    report = bench_memory.run(rows=300, tickers=5, engine=engine)
+    assert report['engine'] == engine and report['rows'] == 300
+    assert report['gains'] > 0 and report['response_bytes'] > 0
+    assert report['peak_rss_kb'] >= report['baseline_rss_kb'] > 0
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+
+import bench_startup
+
+
+def test_import_main_leaves_heavy_dependencies_unloaded():
+    code = ("import sys, main; "
+            "print(sorted(m for m in ('numpy', 'pandas', 'yfinance') if m in sys.modules))")
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == '[]'
+
+
+def test_run_reports_each_stage():
+    results = bench_startup.run(['lazy', 'warm'], ['metrics', 'plan_sale'], repeat=1, rows=200, tickers=5)
+    assert sorted((r['mode'], r['stage'], r['endpoint'] or '') for r in results) == [
+        ('lazy', 'first_request', 'metrics'), ('lazy', 'first_request', 'plan_sale'), ('lazy', 'import', ''),
+        ('warm', 'first_request', 'metrics'), ('warm', 'first_request', 'plan_sale'), ('warm', 'import', ''),
+        ('warm', 'warm_up', ''),
+    ]
+    assert all(r['seconds'] > 0 for r in results)
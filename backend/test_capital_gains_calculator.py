@@ -0,0 +1,332 @@
+import io
+import json
+import random
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pytest
+
+from capital_gains_calculator import (
+    _batch_instruments, calculate_capital_gains, calculate_capital_gains_delta, stream_capital_gains,
+    stream_capital_gains_spilled,
+)
+from csv_parser import iter_robinhood_trades
+from portfolio_snapshot import OutOfOrderDelta, SnapshotError
+from synthetic_export import write_export
+
+
+def _history(n_instruments=12):
+    trades = []
+    for i in range(n_instruments):
+        inst = f"T{i}"
+        for day in range(1, 1 + 2 * (i + 1)):
+            trades.append({'activity_date': f'01/{day:02d}/2022', 'instrument': inst,
+                           'trans_code': 'Buy', 'quantity': 2.0, 'price': 10.0 + day})
+        trades.append({'activity_date': '06/01/2023', 'instrument': inst,
+                       'trans_code': 'Sell', 'quantity': 3.0 + i, 'price': 20.0})
+    return trades
+
+
+def test_parallel_matches_serial():
+    trades = _history()
+    assert calculate_capital_gains(trades, parallel=True) == calculate_capital_gains(trades, parallel=False)
+
+
+def test_sharded_runs_from_a_threaded_process_match_serial():
+    # As in a gunicorn worker: background threads running, requests on threads
+    trades = _history()
+    serial = calculate_capital_gains(trades, parallel=False)
+    stop = threading.Event()
+    busy = threading.Thread(target=lambda: stop.wait(30), daemon=True)
+    busy.start()
+    try:
+        with ThreadPoolExecutor(max_workers=3) as requests:
+            runs = list(requests.map(lambda _: calculate_capital_gains(trades, parallel=True), range(3)))
+    finally:
+        stop.set()
+    assert runs == [serial] * 3
+
+
+@pytest.mark.parametrize('start', [
+    lambda trades: stream_capital_gains(trades, parallel=False),
+    lambda trades: stream_capital_gains(trades, parallel=True),
+    lambda trades: stream_capital_gains_spilled(trades, parallel=False),
+])
+def test_stream_matches_full_run(start, tmp_path, monkeypatch):
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+    trades = _history()
+    expected = calculate_capital_gains(trades, parallel=False)
+    stream = start(iter(trades))
+    gains, lots = {}, []
+    for instrument, instrument_gains, instrument_lots in stream:
+        gains[instrument] = instrument_gains
+        lots.extend(instrument_lots)
+    assert gains == expected['gains']
+    assert sorted(lot.lot_id for lot in lots) == sorted(lot.lot_id for lot in expected['unsold_lots'])
+    assert stream.summary == expected['summary']
+    assert stream.remaining_tickers == expected['remaining_tickers']
+    # A spilled stream's store is gone once it is exhausted
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_batches_pack_small_instruments_together():
+    events = {'BIG': [0] * 100, 'A': [0] * 10, 'B': [0] * 10, 'C': [0] * 5}
+    batches = _batch_instruments(events, 2)
+    assert [[inst for inst, _ in b] for b in batches] == [['BIG'], ['A', 'B', 'C']]
+    assert _batch_instruments({'ONLY': [0]}, 8) == [[('ONLY', [0])]]
+
+
+def _trade(day, code, qty, price, inst='AAPL'):
+    return {'activity_date': day, 'instrument': inst, 'trans_code': code, 'quantity': qty,
+            'extra_shares': qty, 'price': price}
+
+
+def test_delta_continues_from_snapshot():
+    history = [
+        _trade('01/10/2023', 'Buy', 10.0, 100.0),
+        _trade('02/01/2023', 'Buy', 5.0, 120.0),
+        _trade('03/01/2023', 'SPL', 15.0, 0.0),
+        _trade('04/01/2023', 'Buy', 1.0, 70.0),
+    ]
+    delta = [
+        _trade('04/01/2023', 'Buy', 2.0, 71.0),
+        _trade('05/01/2023', 'Sell', 25.0, 80.0),
+        _trade('05/02/2023', 'Buy', 3.0, 90.0, inst='MSFT'),
+    ]
+    full = calculate_capital_gains([dict(t) for t in history + delta])
+    snapshot = json.loads(json.dumps(calculate_capital_gains([dict(t) for t in history], snapshot=True)['snapshot']))
+    result = calculate_capital_gains_delta(snapshot, [dict(t) for t in delta])
+
+    assert result['gains']['AAPL'] == full['gains']['AAPL']
+    assert [lot.to_dict() for lot in result['unsold_lots']] == [lot.to_dict() for lot in full['unsold_lots']]
+    assert [lot.lot_id for lot in result['unsold_lots']] == [
+        'AAPL-20230201-0', 'AAPL-20230401-0', 'AAPL-20230401-1', 'MSFT-20230502-0']
+    assert result['summary'] == full['summary']
+    assert result['remaining_tickers'] == ['AAPL', 'MSFT']
+
+
+def test_delta_rejects_out_of_order_trades():
+    snapshot = calculate_capital_gains([_trade('05/01/2023', 'Sell', 1.0, 10.0),
+                                        _trade('05/01/2023', 'Buy', 2.0, 9.0)], snapshot=True)['snapshot']
+    # Same-day buys would have been applied before that sell
+    with pytest.raises(OutOfOrderDelta):
+        calculate_capital_gains_delta(snapshot, [_trade('05/01/2023', 'Buy', 1.0, 9.0)])
+    with pytest.raises(SnapshotError):
+        calculate_capital_gains_delta({'version': 0}, [])
+    assert calculate_capital_gains_delta(snapshot, [_trade('05/01/2023', 'Sell', 1.0, 9.0)])['gains']['AAPL']
+
+
+def test_summary_totals_match_a_pass_over_gains_and_dividends():
+    trades = synthetic_trades(4000, 20, seed=8)
+    result = calculate_capital_gains(iter(trades), parallel=False)
+    expected = defaultdict(float)
+    for t in trades:
+        if t.trans_code == 'CDIV':
+            expected[(str(t.date.year), t.instrument, 'dividends')] += t.amount
+    for instrument, gains in result['gains'].items():
+        for g in gains:
+            expected[(g.sell_date[-4:], instrument, g.gain_type)] += g.gain_loss
+
+    got = {(year, inst, kind): amount
+           for year, totals in result['summary']['by_year'].items()
+           for inst, inst_totals in totals['instruments'].items()
+           for kind, amount in inst_totals.items()}
+    keys = set(got) | set(expected)
+    assert {k: got.get(k, 0.0) for k in keys} == pytest.approx({k: expected.get(k, 0.0) for k in keys})
+
+
+def test_wash_sales_disallow_losses_into_replacement_lots():
+    trades = [
+        _trade('01/02/2024', 'Buy', 10.0, 100.0),
+        _trade('02/01/2024', 'Sell', 10.0, 80.0),   # $200 loss
+        _trade('02/20/2024', 'Buy', 6.0, 85.0),     # 6 replacement shares, 19 days later
+        _trade('04/01/2024', 'Buy', 5.0, 90.0),     # outside the window
+    ]
+    plain = calculate_capital_gains(trades)
+    assert plain['gains']['AAPL'][0].disallowed_loss is None
+
+    result = calculate_capital_gains(trades, wash_sales=True)
+    loss = result['gains']['AAPL'][0]
+    assert (loss.gain_loss, loss.disallowed_loss) == (-200.0, 120.0)
+    assert result['summary']['by_year']['2024']['short_term'] == -80.0
+    replacement, later = result['unsold_lots']
+    assert replacement.price == 85.0 + 20.0
+    assert later.price == 90.0
+
+
+def test_wash_sales_match_earlier_buys_but_not_the_shares_sold():
+    trades = [
+        _trade('01/02/2024', 'Buy', 10.0, 100.0),
+        _trade('01/20/2024', 'Buy', 4.0, 70.0),     # bought before the sale, kept
+        _trade('02/01/2024', 'Sell', 6.0, 80.0),    # $120 loss on the first lot
+        _trade('02/05/2024', 'SPL', 8.0, 0.0),      # 2-for-1 while the loss waits
+        _trade('02/10/2024', 'Buy', 4.0, 40.0),
+    ]
+    gains = calculate_capital_gains(trades, wash_sales=True)
+    loss, = gains['gains']['AAPL']
+    # The 4 shares left in the sold lot are not replacements; the Jan 20 lot
+    # covers 4 of the 6 loss shares ($80), the post-split buy covers the
+    # other 2 (4 new shares at $10 each)
+    assert loss.disallowed_loss == pytest.approx(120.0)
+    lots = {lot.activity_date: lot for lot in gains['unsold_lots']}
+    assert lots['01/02/2024'].price == pytest.approx(50.0)
+    assert lots['01/20/2024'].price == pytest.approx(35.0 + 80.0 / 8)
+    assert lots['02/10/2024'].price == pytest.approx(40.0 + 40.0 / 4)
+    assert gains['summary']['by_year']['2024']['short_term'] == pytest.approx(0.0)
+
+
+def test_wash_sales_use_the_unsold_part_of_the_last_lot_drawn():
+    trades = [
+        _trade('01/01/2024', 'Buy', 100.0, 10.0),
+        _trade('01/20/2024', 'Buy', 50.0, 12.0),
+        _trade('01/25/2024', 'Sell', 120.0, 8.0),   # all of Jan 1, 20 of Jan 20
+    ]
+    result = calculate_capital_gains(trades, wash_sales=True)
+    first, second = result['gains']['AAPL']
+    # The 30 Jan 20 shares still held replace 30 of the Jan 1 loss shares;
+    # the Jan 20 shares sold have no replacement of their own
+    assert (first.gain_loss, first.disallowed_loss) == (-200.0, 60.0)
+    assert second.disallowed_loss == 0.0
+    lot, = result['unsold_lots']
+    assert lot.quantity == 30.0 and lot.price == pytest.approx(12.0 + 60.0 / 30)
+
+
+def test_relief_methods_match_a_linear_scan():
+    rng = random.Random(7)
+    trades = []
+    day = date(2020, 1, 1)
+    for _ in range(400):
+        day += timedelta(days=rng.randint(0, 5))
+        code = rng.choice(['Buy', 'Buy', 'Sell', 'Sell', 'SPL'] if trades else ['Buy'])
+        qty = float(rng.randint(1, 20))
+        trades.append(_trade(day.strftime('%m/%d/%Y'), code, qty, float(rng.randint(50, 150))))
+
+    def reference(relief):
+        # Open lots as [date, qty, basis, seq]; pick the next lot by scanning them all
+        lots, gains = [], []
+        same_day = {'SPL': 0, 'Buy': 1, 'Sell': 2}
+        dated = sorted(((date(int(t['activity_date'][6:]), int(t['activity_date'][:2]), int(t['activity_date'][3:5])), t)
+                        for t in trades), key=lambda p: (p[0], same_day[p[1]['trans_code']]))
+        for seq, (d, t) in enumerate(dated):
+            if t['trans_code'] == 'Buy':
+                lots.append([d, t['quantity'], t['price'], seq])
+            elif t['trans_code'] == 'SPL' and lots:
+                ratio = 1.0 + t['quantity'] / sum(lot[1] for lot in lots)
+                for lot in lots:
+                    lot[1] *= ratio
+                    lot[2] /= ratio
+            elif t['trans_code'] == 'Sell':
+                want = t['quantity']
+                while want > 0 and lots:
+                    pick = {'lifo': lambda l: -l[3], 'hifo': lambda l: (-l[2], l[3]),
+                            'lofo': lambda l: (l[2], l[3])}[relief]
+                    lot = min(lots, key=pick)
+                    q = min(want, lot[1])
+                    gains.append((lot[0], q, (t['price'] - lot[2]) * q))
+                    lot[1] -= q
+                    want -= q
+                    if lot[1] <= 0:
+                        lots.remove(lot)
+        return gains
+
+    for relief in ('lifo', 'hifo', 'lofo'):
+        result = calculate_capital_gains(trades, relief=relief)
+        got = [(g.buy_date, g.quantity, g.gain_loss) for g in result['gains']['AAPL']]
+        expected = reference(relief)
+        assert [(b, pytest.approx(q), pytest.approx(gl)) for b, q, gl in got] == \
+            [(d.strftime('%m/%d/%Y'), q, gl) for d, q, gl in expected]
+    with pytest.raises(ValueError):
+        calculate_capital_gains(trades, relief='hifo', snapshot=True)
+
+
+def test_specific_relief_relieves_zero_share_lots_like_fifo():
+    trades = [
+        _trade('01/02/2024', 'Buy', 0.0, 10.0),
+        _trade('01/03/2024', 'Buy', 5.0, 12.0),
+        _trade('02/01/2024', 'Sell', 1.0, 15.0),
+        _trade('03/01/2024', 'Sell', 2.0, 15.0),
+    ]
+    fifo = calculate_capital_gains(trades)
+    assert [g.quantity for g in fifo['gains']['AAPL']] == [0.0, 1.0, 2.0]
+    assert calculate_capital_gains(trades, relief='specific') == fifo
+    # A designated lot relieved out of order is not relieved again at the front
+    chosen = calculate_capital_gains(trades, relief='specific',
+                                     selections={'AAPL': {date(2024, 2, 1): ['AAPL-20240103-0']}})
+    assert [g.quantity for g in chosen['gains']['AAPL']] == [1.0, 0.0, 2.0]
+    assert [lot.quantity for lot in chosen['unsold_lots']] == [2.0]
+
+    alone = calculate_capital_gains([_trade('01/02/2024', 'Buy', 0.0, 10.0),
+                                     _trade('02/01/2024', 'Sell', 1.0, 15.0)], relief='specific')
+    assert [g.quantity for g in alone['gains']['AAPL']] == [0.0]
+
+
+def baseline_fifo(trades):
+    """
+    The original list-based FIFO engine (before the lot queue), over Trade
+    records: splits rescale every open lot eagerly from a fresh sum of the
+    holdings. Returns (gains, unsold) with the API's rounding applied.
+    """
+    order = {'SPL': 0, 'Buy': 1, 'Sell': 2}
+    by_instrument = defaultdict(list)
+    for t in trades:
+        by_instrument[t.instrument].append(t)
+    gains, unsold = {}, []
+    for instrument, events in by_instrument.items():
+        events = sorted((t for t in events if t.trans_code in order), key=lambda t: (t.date, order[t.trans_code]))
+        lots, rows, seq = [], [], defaultdict(int)
+        for t in events:
+            if t.trans_code == 'Buy':
+                lot_id = f"{instrument}-{t.date.strftime('%Y%m%d')}-{seq[t.date]}"
+                seq[t.date] += 1
+                lots.append([lot_id, t.activity_date, t.date, t.price, t.quantity])
+            elif t.trans_code == 'SPL':
+                if t.quantity <= 0 or not lots:
+                    continue
+                pre_total = sum(lot[4] for lot in lots)
+                if pre_total <= 0:
+                    continue
+                ratio = 1.0 + t.quantity / pre_total
+                for lot in lots:
+                    lot[4] = lot[4] * ratio
+                    lot[3] = lot[3] / ratio
+            else:
+                remaining = t.quantity
+                while remaining > 0 and lots:
+                    lot = lots[0]
+                    q = min(remaining, lot[4])
+                    term = 'long_term' if (t.date - lot[2]).days > 365 else 'short_term'
+                    rows.append((t.activity_date, lot[1], round(q, 5), round(lot[3], 2), round(t.price, 2),
+                                 round((t.price - lot[3]) * q, 2), term))
+                    remaining -= q
+                    lot[4] = lot[4] - q
+                    if lot[4] <= 0:
+                        lots.pop(0)
+        gains[instrument] = rows
+        unsold.extend((lot[0], instrument, round(lot[4], 5), round(lot[3], 2), lot[1]) for lot in lots if lot[4] > 0)
+    return gains, unsold
+
+
+def api_rows(result):
+    """(gains, unsold) of a calculate_capital_gains() result, rounded like the API."""
+    gains = {inst: [(e.sell_date, e.buy_date, round(e.quantity, 5), round(e.buy_price, 2), round(e.sell_price, 2),
+                     round(e.gain_loss, 2), e.gain_type) for e in entries]
+             for inst, entries in result['gains'].items()}
+    unsold = [(l.lot_id, l.instrument, round(l.quantity, 5), round(l.price, 2), l.activity_date)
+              for l in result['unsold_lots']]
+    return gains, unsold
+
+
+def synthetic_trades(rows, tickers, seed):
+    out = io.StringIO()
+    write_export(out, rows, tickers=tickers, seed=seed)
+    return list(iter_robinhood_trades(io.StringIO(out.getvalue())))
+
+
+@pytest.mark.parametrize('seed', [1, 2, 4])
+def test_matches_baseline_engine_on_fractional_splits(seed):
+    # Synthetic exports carry DRIP fractional shares and splits, where split
+    # ratios are sensitive to how the holdings are summed
+    trades = synthetic_trades(4000, 10, seed)
+    assert api_rows(calculate_capital_gains(trades, parallel=False)) == baseline_fifo(trades)
@@ -0,0 +1,56 @@
+import io
+from datetime import date
+
+from csv_parser import iter_robinhood_trades, open_upload_stream, parse_robinhood_csv
+
+SAMPLE_CSV = (
+    '"Activity Date","Process Date","Settle Date","Instrument","Description","Trans Code","Quantity","Price","Amount"\n'
+    '"3/1/2024","3/1/2024","3/5/2024","AAPL","Apple Inc","Sell","5","$180.00","$900.00"\n'
+    '"2/15/2024","2/15/2024","2/15/2024","AAPL","Apple Inc Cash Div","CDIV","","","$2.40"\n'
+    '"1/10/2023","1/10/2023","1/12/2023","AAPL","Apple Inc","Buy","10","$130.00","($1,300.00)"\n'
+    '"1/11/2023","1/11/2023","1/13/2023","","ACH Deposit","ACH","","","$500.00"\n'
+    '\n'
+)
+
+
+def test_iter_robinhood_trades_streams_rows():
+    trades = iter_robinhood_trades(io.StringIO(SAMPLE_CSV))
+    first = next(trades)
+    assert first.trans_code == 'Sell'
+    assert first.activity_date == '03/01/2024'
+    assert first.date == date(2024, 3, 1)
+    rest = list(trades)
+    assert [t.trans_code for t in rest] == ['CDIV', 'Buy']
+    assert rest[1].amount == -1300.0
+
+
+def test_open_upload_stream_matches_file_parser(tmp_path):
+    path = tmp_path / 'export.csv'
+    path.write_text(SAMPLE_CSV, encoding='utf-8')
+    binary = io.BytesIO(SAMPLE_CSV.encode('utf-8'))
+    streamed = list(iter_robinhood_trades(open_upload_stream(binary)))
+    assert streamed == parse_robinhood_csv(str(path))
+
+
+def test_columns_are_located_by_header_name():
+    reordered = (
+        '\ufeffTrans Code,Instrument,Amount,Activity Date,Quantity,Price,Description\n'
+        'Buy,MSFT,"($2,000.00)",1/10/2023,10,$200.00,Microsoft\n'
+        'Sell,MSFT,$550.00,2/10/2023,2\n'
+    )
+    buy, sell = iter_robinhood_trades(io.StringIO(reordered))
+    assert (buy.instrument, buy.trans_code, buy.quantity, buy.price, buy.amount) == ('MSFT', 'Buy', 10.0, 200.0, -2000.0)
+    assert buy.date == date(2023, 1, 10)
+    # Short row: missing price falls back to 0, the amount column is still read
+    assert (sell.quantity, sell.price, sell.amount) == (2.0, 0.0, 550.0)
+
+
+def test_fast_path_matches_row_parser():
+    from csv import reader
+    from csv_parser import _parse_row
+    from synthetic_export import write_export
+    buf = io.StringIO()
+    write_export(buf, 2000, tickers=20, seed=3)
+    rows = list(reader(io.StringIO(buf.getvalue())))[1:]
+    expected = [t for t in (_parse_row(r) for r in rows) if t is not None]
+    assert list(iter_robinhood_trades(io.StringIO(buf.getvalue()))) == expected
@@ -0,0 +1,28 @@
+from datetime import date
+
+from date_parser import DateParser
+
+
+def test_locks_onto_first_matching_format():
+    parser = DateParser()
+    assert parser.parse('2024-03-01') == date(2024, 3, 1)
+    assert parser.locked_format == '%Y-%m-%d'
+    # Other formats are still understood, and the lock follows the data
+    assert parser.parse('1/9/23') == date(2023, 1, 9)
+    assert parser.locked_format == '%m/%d/%y'
+
+
+def test_normalizes_and_memoizes():
+    parser = DateParser(memo_size=2)
+    assert parser.normalize(' 2024-03-01 09:30 ') == '03/01/2024'
+    assert parser.normalize('2024-03-01 09:30') == '03/01/2024'
+    assert parser.cache_info().hits == 1
+    parser.parse('a')
+    parser.parse('b')
+    assert parser.cache_info().currsize == 2
+
+
+def test_unparseable_values_pass_through():
+    parser = DateParser()
+    assert parser.parse('not a date') is None
+    assert parser.normalize(' not a date ') == 'not a date'
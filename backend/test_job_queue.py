@@ -0,0 +1,99 @@
+import io
+import time
+
+import pytest
+
+import job_queue
+from job_queue import JobRunner, JobStore, QueueFull
+
+
+def _echo(path, params, progress):
+    with open(path, 'rb') as f:
+        data = f.read().decode()
+    if data == 'boom':
+        raise ValueError('bad upload')
+    for row in progress.count_rows(data.splitlines()):
+        pass
+    progress.instruments(1, 1)
+    return ['{"echo":', str(len(data)), '}']
+
+
+def test_jobs_run_to_a_result_file(tmp_path):
+    store = JobStore(str(tmp_path))
+    runner = JobRunner(store, _echo)
+    job_id = store.submit(io.BytesIO(b'a\nb\nc'), {'shape': 'rows'})
+    assert store.get(job_id)['status'] == 'queued'
+    assert runner.run_once()
+    job = store.get(job_id)
+    assert job['status'] == 'done'
+    assert job['progress'] == {'rows': 3, 'instruments_done': 1, 'instruments_total': 1}
+    assert open(store.result_path(job_id)).read() == '{"echo":5}'
+    assert not (tmp_path / (job_id + '.upload')).exists()
+    assert not runner.run_once()
+
+    failed = store.submit(io.BytesIO(b'boom'), {})
+    runner.run_once()
+    assert store.get(failed)['status'] == 'failed'
+    assert store.get(failed)['error'] == 'bad upload'
+
+
+def test_queue_depth_and_stale_jobs(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path), max_depth=2)
+    first = store.submit(io.BytesIO(b'1'), {})
+    store.submit(io.BytesIO(b'2'), {})
+    with pytest.raises(QueueFull):
+        store.submit(io.BytesIO(b'3'), {})
+    assert len(list(tmp_path.glob('*.upload'))) == 2  # the refused upload is not kept
+    assert store.claim('gone')[0] == first  # oldest first
+
+    # The worker running `first` died: its heartbeat goes stale and the job fails
+    monkeypatch.setattr(job_queue, 'STALE_AFTER', -1.0)
+    store.sweep()
+    assert store.get(first)['status'] == 'failed'
+    assert store.depth() == 1
+
+    # Finished jobs expire after the TTL
+    store.ttl = -1.0
+    store.sweep()
+    assert store.get(first) is None
+
+
+def test_a_job_failed_as_stale_stays_failed(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path))
+
+    def stalls(path, params, progress):
+        chunks = _echo(path, params, progress)
+        # A long encode: the heartbeat goes stale and another worker sweeps
+        monkeypatch.setattr(job_queue, 'STALE_AFTER', -1.0)
+        store.sweep()
+        return chunks
+
+    job_id = store.submit(io.BytesIO(b'a'), {})
+    assert JobRunner(store, stalls).run_once()
+    job = store.get(job_id)
+    assert (job['status'], job['error']) == ('failed', 'Worker exited before the job finished')
+    assert not list(tmp_path.glob(job_id + '.*'))
+
+
+def test_status_polls_fail_stale_jobs_without_a_submission(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path))
+    job_id = store.submit(io.BytesIO(b'1'), {})
+    store.claim('gone')
+    monkeypatch.setattr(job_queue, 'STALE_AFTER', -1.0)
+    # Swept moments ago by the submission: the poll is within the interval
+    assert store.get(job_id)['status'] == 'running'
+    # Another worker answering the poll has not swept yet
+    assert JobStore(str(tmp_path)).get(job_id)['status'] == 'failed'
+    assert not list(tmp_path.glob('*.upload'))
+
+
+def test_runner_threads_pick_up_jobs(tmp_path):
+    store = JobStore(str(tmp_path))
+    runner = JobRunner(store, _echo, workers=2)
+    runner.start()
+    job_id = store.submit(io.BytesIO(b'x'), {})
+    runner.wake()
+    deadline = time.time() + 5
+    while store.get(job_id)['status'] != 'done' and time.time() < deadline:
+        time.sleep(0.02)
+    assert store.get(job_id)['status'] == 'done'
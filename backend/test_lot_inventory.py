@@ -0,0 +1,65 @@
+from lot_inventory import LotQueue
+from records import Lot
+
+
+def _lot(qty, price):
+    return Lot('L', 'AAPL', '01/02/2020', None, qty, price)
+
+
+def test_split_adjusts_every_open_lot():
+    lots = LotQueue()
+    lots.append(_lot(10.0, 100.0))
+    lots.append(_lot(30.0, 80.0))
+    assert lots.apply_split(40.0) == 2.0  # 2-for-1
+    assert lots.total_qty == 80.0
+    assert [(l.quantity, l.price) for l in lots] == [(20.0, 50.0), (60.0, 40.0)]
+
+
+def test_lots_bought_after_split_are_not_adjusted():
+    lots = LotQueue()
+    lots.append(_lot(10.0, 100.0))
+    lots.apply_split(10.0)
+    lots.append(_lot(5.0, 55.0))
+    assert [(l.quantity, l.price) for l in lots] == [(20.0, 50.0), (5.0, 55.0)]
+
+
+def test_consume_drops_exhausted_lots():
+    lots = LotQueue()
+    lots.append(_lot(2.0, 10.0))
+    lots.append(_lot(3.0, 12.0))
+    lots.consume(2.0)
+    assert len(lots) == 1
+    assert lots.head().price == 12.0
+    lots.consume(1.0)
+    assert lots.total_qty == 2.0
+    lots.consume(2.0)
+    assert not lots
+    assert lots.total_qty == 0.0
+    assert not lots.apply_split(1.0)
+
+
+def test_relief_order_follows_split_adjusted_basis():
+    from lot_inventory import LotSelectionError, new_inventory
+    import pytest
+    orders = {}
+    for relief in ('lifo', 'hifo', 'lofo', 'specific'):
+        lots = new_inventory(relief)
+        lots.append(Lot('A', 'AAPL', '01/02/2020', None, 10.0, 100.0))
+        lots.append(Lot('B', 'AAPL', '02/02/2020', None, 10.0, 150.0))
+        lots.apply_split(20.0)  # 2-for-1: A at 50, B at 75
+        lots.append(Lot('C', 'AAPL', '03/02/2020', None, 10.0, 60.0))
+        if relief == 'specific':
+            lots.select(['B'])
+        order = []
+        while lots:
+            lot = lots.head()
+            order.append((lot.lot_id, lot.price))
+            lots.consume(lot.quantity)
+        orders[relief] = order
+        assert lots.total_qty == 0.0
+    assert orders['lifo'] == [('C', 60.0), ('B', 75.0), ('A', 50.0)]
+    assert orders['hifo'] == [('B', 75.0), ('C', 60.0), ('A', 50.0)]
+    assert orders['lofo'] == [('A', 50.0), ('C', 60.0), ('B', 75.0)]
+    assert orders['specific'] == [('B', 75.0), ('A', 50.0), ('C', 60.0)]
+    with pytest.raises(LotSelectionError):
+        new_inventory('specific').select(['nope'])
@@ -0,0 +1,370 @@
+import io
+import json
+import os
+from datetime import datetime
+
+from main import app
+from test_csv_parser import SAMPLE_CSV
+
+
+def _upload(data=SAMPLE_CSV, query=''):
+    client = app.test_client()
+    return client.post(
+        f'/api/upload{query}',
+        data={'file': (io.BytesIO(data.encode('utf-8')), 'export.csv')},
+        content_type='multipart/form-data',
+    )
+
+
+def test_upload_streams_without_writing_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    resp = _upload()
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body['gains']['AAPL'][0]['quantity'] == 5
+    assert body['gains']['AAPL'][0]['gain_loss'] == 250.0
+    assert body['unsold_lots'] == [{
+        'lotId': 'AAPL-20230110-0',
+        'instrument': 'AAPL',
+        'qty': 5.0,
+        'costBasisPerShare': 130.0,
+        'purchaseDate': '01/10/2023',
+    }]
+    assert os.listdir(tmp_path) == []
+
+
+def test_upload_requires_file():
+    resp = app.test_client().post('/api/upload', data={})
+    assert resp.status_code == 400
+
+
+def test_upload_engine_selection():
+    assert _upload(query='?engine=vectorized').get_json() == _upload().get_json()
+    assert _upload(query='?engine=nope').status_code == 400
+
+
+def test_get_price_uses_cache(monkeypatch):
+    from test_price_cache import FakeProvider
+    import main
+
+    provider = FakeProvider({'AAPL': 190.123, 'MSFT': 410.0})
+    monkeypatch.setattr(main.price_cache, 'provider', provider)
+    main.price_cache.clear()
+    client = app.test_client()
+    resp = client.get('/api/get_price?tickers=msft;AAPL nope')
+    assert resp.get_json() == {'MSFT': 410.0, 'AAPL': 190.12}
+    client.get('/api/get_price?tickers=AAPL')
+    assert len(provider.calls) == 1
+    assert client.get('/api/get_price?tickers=NOPE').status_code == 404
+
+
+ROUNDING_CSV = (
+    '"Activity Date","Process Date","Settle Date","Instrument","Description","Trans Code","Quantity","Price","Amount"\n'
+    '"6/3/2024","6/3/2024","6/5/2024","VTI","Vanguard","Sell","0.333333333","$250.129","$83.38"\n'
+    '"1/5/2024","1/5/2024","1/5/2024","VTI","Vanguard Dividend Reinvestment","Buy","1.123456789","$220.4567","($247.67)"\n'
+)
+
+
+def _json_body(doc) -> bytes:
+    # What jsonify sends: sorted keys, compact separators, trailing newline
+    return (json.dumps(doc, sort_keys=True, separators=(',', ':')) + '\n').encode()
+
+
+def test_upload_rows_body():
+    # Prices to 2 decimals, quantities to 5
+    totals = {'dividends': 0.0, 'long_term': 0.0, 'short_term': 9.89}
+    expected = {
+        'gains': {'VTI': [{
+            'instrument': 'VTI', 'sell_date': '06/03/2024', 'buy_date': '01/05/2024', 'quantity': 0.33333,
+            'buy_price': 220.46, 'sell_price': 250.13, 'gain_loss': 9.89, 'gain_type': 'short_term',
+        }]},
+        'summary': {
+            'past_gains': 9.89,
+            'current_year_gains': 0.0,
+            'by_year': {'2024': dict(totals, instruments={'VTI': totals})},
+        },
+        'unsold_lots': [{'lotId': 'VTI-20240105-0', 'instrument': 'VTI', 'qty': 0.79012,
+                         'costBasisPerShare': 220.46, 'purchaseDate': '01/05/2024'}],
+        'remaining_tickers': ['VTI'],
+    }
+    assert _upload(ROUNDING_CSV).get_data() == _json_body(expected)
+
+
+def test_upload_columns_format():
+    rows = _upload().get_json()
+    for resp in (_upload(query='?format=columns'),
+                 app.test_client().post(
+                     '/api/upload',
+                     data={'file': (io.BytesIO(SAMPLE_CSV.encode('utf-8')), 'export.csv')},
+                     headers={'Accept': 'application/vnd.capitalgains.columns+json'})):
+        body = resp.get_json()
+        assert body['format'] == 'columns'
+        assert body['summary'] == rows['summary']
+        assert body['gains']['AAPL']['quantity'] == [g['quantity'] for g in rows['gains']['AAPL']]
+        assert body['unsold_lots']['lotId'] == [l['lotId'] for l in rows['unsold_lots']]
+    assert _upload(query='?format=xml').status_code == 400
+
+
+def test_upload_delta_resumes_snapshot():
+    header, *rows = SAMPLE_CSV.strip().split('\n')
+    older = '\n'.join([header] + [r for r in rows if '2023' in r]) + '\n'
+    newer = '\n'.join([header] + [r for r in rows if '2024' in r]) + '\n'
+    snapshot = _upload(older, '?snapshot=1').get_json()['snapshot']
+
+    def delta(data, snap):
+        return app.test_client().post('/api/upload_delta', data={
+            'file': (io.BytesIO(data.encode('utf-8')), 'new.csv'),
+            'snapshot': json.dumps(snap),
+        }, content_type='multipart/form-data')
+
+    body = delta(newer, snapshot).get_json()
+    full = _upload().get_json()
+    assert body['gains']['AAPL'] == full['gains']['AAPL']
+    assert body['unsold_lots'] == full['unsold_lots']
+    assert delta(older, body['snapshot']).status_code == 409
+    assert delta(newer, {'version': 99}).status_code == 400
+    assert _upload(query='?snapshot=1&engine=vectorized').status_code == 400
+
+
+def test_upload_result_cache(monkeypatch):
+    import capital_gains_calculator
+    import main
+
+    calls = []
+    fifo = capital_gains_calculator.calculate_capital_gains
+    monkeypatch.setattr(capital_gains_calculator, 'calculate_capital_gains',
+                        lambda trades: calls.append(1) or fifo(trades))
+    main.result_cache.clear()
+
+    first = _upload()
+    assert first.headers['X-Result-Cache'] == 'miss'
+    body = first.get_data()  # the body is stored once it has been streamed out
+    second = _upload()
+    assert second.headers['X-Result-Cache'] == 'hit'
+    assert second.get_data() == body
+    assert len(calls) == 1
+    assert _upload(query='?format=columns').headers['X-Result-Cache'] == 'miss'
+
+    # The past/current-year summary split moves at New Year
+    class NextYear(datetime):
+        @classmethod
+        def today(cls):
+            return datetime(datetime.today().year + 1, 1, 1)
+
+    monkeypatch.setattr(main, 'datetime', NextYear)
+    assert _upload().headers['X-Result-Cache'] == 'miss'
+    assert len(calls) == 3
+
+
+def test_plan_sale_batches_queries(monkeypatch):
+    import main
+    from test_price_cache import FakeProvider
+
+    monkeypatch.setattr(main.price_cache, 'provider', FakeProvider({'AAPL': 200.0}))
+    main.price_cache.clear()
+    lots = _upload().get_json()['unsold_lots']
+    resp = app.test_client().post('/api/plan_sale', json={
+        'lots': lots,
+        'date': '2024-06-01',
+        'queries': [
+            {'ticker': 'AAPL', 'quantity': 2, 'price': 150.0, 'strategy': 'long_term_only'},
+            {'ticker': 'aapl', 'quantity': 8},
+            {'ticker': 'MSFT', 'quantity': 1, 'price': 10.0},
+        ],
+    })
+    first, second, third = resp.get_json()['plans']
+    assert first['long_term_gain'] == 40.0 and first['lots'][0]['lotId'] == 'AAPL-20230110-0'
+    assert second['price'] == 200.0 and second['quantity'] == 5.0 and second['shortfall'] == 3.0
+    assert third['quantity'] == 0.0 and third['lots'] == []
+    bad = app.test_client().post('/api/plan_sale', json={'lots': lots, 'ticker': 'AAPL', 'quantity': 1,
+                                                         'strategy': 'nope'})
+    assert bad.status_code == 400
+
+
+def test_server_timing_and_metrics():
+    import main
+
+    main.result_cache.clear()
+    resp = _upload()
+    resp.get_data()
+    timing = resp.headers['Server-Timing']
+    for stage in ('hash', 'cache', 'parse', 'compute', 'total'):
+        assert f'{stage};dur=' in timing
+    text = app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'capgains_stage_seconds_count{endpoint="upload_file",stage="encode"}' in text
+    assert 'capgains_upload_trades_count' in text
+    assert 'capgains_cache_hit_ratio{cache="result"}' in text
+
+
+def test_upload_batch_combines_brokers():
+    from test_batch_upload import FIDELITY_CSV
+    robinhood = (
+        '"Activity Date","Process Date","Settle Date","Instrument","Description","Trans Code","Quantity","Price","Amount"\n'
+        '"6/3/2024","6/3/2024","6/5/2024","AAPL","Apple Inc","Sell","8","$200.00","$1,600.00"\n'
+        '"2/1/2022","2/1/2022","2/3/2022","AAPL","Apple Inc","Buy","4","$100.00","($400.00)"\n'
+    )
+    resp = app.test_client().post('/api/upload_batch', data={'files': [
+        (io.BytesIO(FIDELITY_CSV.encode()), 'fidelity.csv'),
+        (io.BytesIO(robinhood.encode()), 'robinhood.csv'),
+    ]}, content_type='multipart/form-data')
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body['sources'] == [
+        {'filename': 'fidelity.csv', 'broker': 'fidelity', 'trades': 3},
+        {'filename': 'robinhood.csv', 'broker': 'robinhood', 'trades': 2},
+    ]
+    # One FIFO run across both accounts: the 2022 Robinhood lot is sold first
+    assert [(g['buy_date'], g['quantity']) for g in body['gains']['AAPL']] == [
+        ('02/01/2022', 4.0), ('01/10/2023', 1.0), ('01/10/2023', 8.0)]
+    assert body['unsold_lots'][0]['qty'] == 1.0
+    assert app.test_client().post('/api/upload_batch', data={}).status_code == 400
+
+
+def test_large_upload_uses_trade_store(monkeypatch, tmp_path):
+    import main
+    expected = _upload().get_json()
+    monkeypatch.setattr(main, 'TRADE_STORE_MIN_BYTES', 1)
+    monkeypatch.setattr(main, 'TRADE_STORE_DIR', str(tmp_path))
+    main.result_cache.clear()
+    assert _upload().get_json() == expected
+    assert list(tmp_path.iterdir()) == []
+
+
+WASH_CSV = (
+    '"Activity Date","Process Date","Settle Date","Instrument","Description","Trans Code","Quantity","Price","Amount"\n'
+    '"2/20/2024","2/20/2024","2/22/2024","MSFT","Microsoft","Buy","6","$85.00","($510.00)"\n'
+    '"2/1/2024","2/1/2024","2/5/2024","MSFT","Microsoft","Sell","10","$80.00","$800.00"\n'
+    '"1/2/2024","1/2/2024","1/4/2024","MSFT","Microsoft","Buy","10","$100.00","($1,000.00)"\n'
+)
+
+
+def test_upload_wash_sales():
+    resp = _upload(WASH_CSV, '?wash_sales=1')
+    totals = {'dividends': 0.0, 'long_term': 0.0, 'short_term': -80.0}
+    assert resp.get_data() == _json_body({
+        'gains': {'MSFT': [{
+            'instrument': 'MSFT', 'sell_date': '02/01/2024', 'buy_date': '01/02/2024', 'quantity': 10.0,
+            'buy_price': 100.0, 'sell_price': 80.0, 'gain_loss': -200.0, 'disallowed_loss': 120.0,
+            'gain_type': 'short_term',
+        }]},
+        'summary': {
+            'past_gains': -80.0,
+            'current_year_gains': 0.0,
+            'by_year': {'2024': dict(totals, instruments={'MSFT': totals})},
+        },
+        # The disallowed $120 moves into the replacement lot's basis
+        'unsold_lots': [{'lotId': 'MSFT-20240220-0', 'instrument': 'MSFT', 'qty': 6.0,
+                         'costBasisPerShare': 105.0, 'purchaseDate': '02/20/2024'}],
+        'remaining_tickers': ['MSFT'],
+    })
+    columns = _upload(WASH_CSV, '?wash_sales=1&format=columns').get_json()
+    assert columns['gains']['MSFT']['disallowed_loss'] == [120.0]
+    assert 'disallowed_loss' not in _upload(WASH_CSV).get_json()['gains']['MSFT'][0]
+    assert _upload(WASH_CSV, '?wash_sales=1&engine=vectorized').status_code == 400
+    assert _upload(WASH_CSV, '?wash_sales=1&snapshot=1').status_code == 400
+
+
+def test_upload_relief_methods():
+    csv = (
+        '"Activity Date","Process Date","Settle Date","Instrument","Description","Trans Code","Quantity","Price","Amount"\n'
+        '"3/1/2024","3/1/2024","3/5/2024","AAPL","Apple Inc","Sell","5","$180.00","$900.00"\n'
+        '"6/1/2023","6/1/2023","6/5/2023","AAPL","Apple Inc","Buy","5","$170.00","($850.00)"\n'
+        '"1/10/2023","1/10/2023","1/12/2023","AAPL","Apple Inc","Buy","10","$130.00","($1,300.00)"\n'
+    )
+    hifo = _upload(csv, '?relief=hifo').get_json()
+    assert [g['buy_date'] for g in hifo['gains']['AAPL']] == ['06/01/2023']
+    client = app.test_client()
+
+    def specific(selections):
+        return client.post('/api/upload?relief=specific', data={
+            'file': (io.BytesIO(csv.encode('utf-8')), 'export.csv'),
+            'lot_selections': json.dumps(selections),
+        }, content_type='multipart/form-data')
+
+    body = specific({'AAPL': {'2024-03-01': ['AAPL-20230601-0']}}).get_json()
+    assert body['gains'] == hifo['gains']
+    assert specific({'AAPL': {'2024-03-01': ['AAPL-20990101-0']}}).status_code == 400
+    assert specific({'AAPL': {'March 1': []}}).status_code == 400
+    assert _upload(csv, '?relief=nope').status_code == 400
+    assert _upload(csv, '?relief=lifo&engine=vectorized').status_code == 400
+
+
+def test_upload_job_round_trip(tmp_path, monkeypatch):
+    import time
+    import main
+    from job_queue import JobRunner, JobStore
+    store = JobStore(str(tmp_path))
+    monkeypatch.setattr(main, 'job_store', store)
+    monkeypatch.setattr(main, 'job_runner', JobRunner(store, main._run_upload_job))
+    client = app.test_client()
+
+    def submit():
+        return client.post('/api/jobs?relief=hifo', data={'file': (io.BytesIO(SAMPLE_CSV.encode('utf-8')), 'export.csv')},
+                           content_type='multipart/form-data')
+
+    resp = submit()
+    assert resp.status_code == 202
+    job = resp.get_json()
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        status = client.get(job['status_url']).get_json()
+        if status['status'] in ('done', 'failed'):
+            break
+        time.sleep(0.02)
+    assert status['status'] == 'done'
+    assert status['progress'] == {'rows': 3, 'instruments_done': 1, 'instruments_total': 1}
+    assert client.get(job['result_url']).get_data() == _upload(query='?relief=hifo').get_data()
+    assert client.get('/api/jobs/nope').status_code == 404
+    store.max_depth = 0
+    full = submit()
+    assert full.status_code == 503 and full.headers['Retry-After'] == '30'
+    assert client.post('/api/jobs?relief=nope', data={'file': (io.BytesIO(b'x'), 'x.csv')}).status_code == 400
+
+
+def test_scenarios_matrix():
+    lots = _upload().get_json()['unsold_lots']
+    resp = app.test_client().post('/api/scenarios', json={
+        'lots': lots,
+        'prices': {'aapl': [100.0, 200.0]},
+        'dates': ['2024-01-01', '2025-06-01'],
+    })
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body['dates'] == ['2024-01-01', '2025-06-01']
+    aapl = body['scenarios']['AAPL']
+    assert aapl['prices'] == [100.0, 200.0]
+    assert len(aapl['long_term']) == 2 and len(aapl['long_term'][0]) == 2
+    for i in range(2):
+        for j in range(2):
+            assert abs(aapl['long_term'][i][j] + aapl['short_term'][i][j] - aapl['net'][i]) <= 0.02
+    bad = app.test_client().post('/api/scenarios', json={'lots': lots, 'prices': {'AAPL': [1]}, 'dates': ['nope']})
+    assert bad.status_code == 400
+
+
+def test_upload_ndjson_streams_the_rows_content():
+    rows = _upload().get_json()
+    resp = _upload(query='?format=ndjson')
+    assert resp.mimetype == 'application/x-ndjson' and 'X-Result-Cache' not in resp.headers
+    records = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert records[-1]['type'] == 'summary'
+    assert records[-1]['summary'] == rows['summary']
+    assert records[-1]['remaining_tickers'] == rows['remaining_tickers']
+    gains = {r['instrument']: r['gains'] for r in records if r['type'] == 'gains'}
+    assert gains == rows['gains']
+    lots = [lot for r in records if r['type'] == 'lots' for lot in r['lots']]
+    assert sorted(lots, key=lambda l: l['lotId']) == sorted(rows['unsold_lots'], key=lambda l: l['lotId'])
+
+    # Engines that compute everything first send the same records, just not incrementally
+    vectorized = _upload(query='?format=ndjson&engine=vectorized', data=SAMPLE_CSV)
+    assert vectorized.get_data(as_text=True).splitlines()[-1] == resp.get_data(as_text=True).splitlines()[-1]
+    # ... and are not cached: a repeat is computed and streamed again
+    again = _upload(query='?format=ndjson&engine=vectorized', data=SAMPLE_CSV)
+    assert again.mimetype == 'application/x-ndjson' and 'X-Result-Cache' not in again.headers
+    assert again.get_data() == vectorized.get_data()
+
+    # Errors after the response has started end the stream with an error record
+    bad = app.test_client().post('/api/upload?format=ndjson&relief=specific', data={
+        'file': (io.BytesIO(SAMPLE_CSV.encode('utf-8')), 'export.csv'),
+        'lot_selections': json.dumps({'AAPL': {'2024-03-01': ['nope']}}),
+    }, content_type='multipart/form-data')
+    assert json.loads(bad.get_data(as_text=True).splitlines()[-1]) == {'error': 'Unknown lot: nope', 'type': 'error'}
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import metrics
+
+
+def test_histogram_renders_prometheus_text():
+    h = metrics.Histogram('t_seconds', 'Test.', ('stage',), buckets=(0.1, 1.0))
+    h.observe(0.05, 'parse')
+    h.observe(0.5, 'parse')
+    text = '\n'.join(h.render())
+    assert '# TYPE t_seconds histogram' in text
+    assert 't_seconds_bucket{stage="parse",le="0.1"} 1' in text
+    assert 't_seconds_bucket{stage="parse",le="+Inf"} 2' in text
+    assert 't_seconds_count{stage="parse"} 2' in text
+
+
+def test_timed_iterator_counts_and_reports_once():
+    done = []
+    it = metrics.TimedIterator(iter([1, 2, 3]), lambda seconds, count: done.append(count))
+    assert list(it) == [1, 2, 3]
+    assert list(it) == []
+    assert it.count == 3 and done == [3]
+
+
+def test_sampling_profiler_collects_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=lambda: stop.wait(5))
+    worker.start()
+    try:
+        profiler = metrics.SamplingProfiler(interval=1.0)
+        profiler.sample()
+        assert profiler.samples == 1
+        assert 'threading.py:wait' in profiler.collapsed(reset=True)
+        assert profiler.collapsed() == "\n"
+    finally:
+        stop.set()
+        worker.join()
+
+
+def test_registries_sharing_a_directory_report_the_sum(tmp_path):
+    def worker():
+        registry = metrics.Registry(str(tmp_path))
+        hist = registry.add(metrics.Histogram('t_seconds', 'Test.', ('stage',), buckets=(1.0,)))
+        hits = registry.add(metrics.Counter('t_hits_total', 'Test.', ('cache',), lambda: {('result',): 3}))
+        misses = registry.add(metrics.Counter('t_misses_total', 'Test.', ('cache',), lambda: {('result',): 1}))
+        registry.add(metrics.Ratio('t_hit_ratio', 'Test.', hits, misses))
+        return registry, hist
+
+    first, first_hist = worker()
+    second, second_hist = worker()
+    first_hist.observe(0.5, 'parse')
+    second_hist.observe(2.0, 'parse')
+    second_hist.observe(0.5, 'encode')
+    first.flush()
+
+    text = second.render()
+    assert 't_seconds_count{stage="parse"} 2' in text
+    assert 't_seconds_bucket{stage="parse",le="1.0"} 1' in text
+    assert 't_seconds_count{stage="encode"} 1' in text
+    assert 't_hits_total{cache="result"} 6' in text
+    assert 't_hit_ratio{cache="result"} 0.75' in text
+    # The second worker has not flushed yet: the first sees only its own
+    assert 't_seconds_count{stage="parse"} 1' in first.render()
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from price_cache import PriceCache
+
+
+class FakeProvider:
+    def __init__(self, prices, delay=None):
+        self.prices = prices
+        self.calls = []
+        self.delay = delay
+
+    def fetch(self, symbols):
+        self.calls.append(list(symbols))
+        if self.delay is not None:
+            self.delay.wait(2)
+        return {s: self.prices[s] for s in symbols if s in self.prices}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_partial_hits_fetch_only_missing_symbols():
+    provider = FakeProvider({'AAPL': 190.0, 'MSFT': 410.0})
+    cache = PriceCache(provider, coalesce_window=0)
+    assert cache.get_many(['AAPL']) == {'AAPL': 190.0}
+    assert cache.get_many(['AAPL', 'MSFT', 'NOPE']) == {'AAPL': 190.0, 'MSFT': 410.0}
+    assert provider.calls == [['AAPL'], ['MSFT', 'NOPE']]
+    # Unknown symbols are negatively cached too
+    cache.get_many(['NOPE'])
+    assert len(provider.calls) == 2
+
+
+def test_entries_expire_and_evict_lru():
+    clock = Clock()
+    provider = FakeProvider({'A': 1.0, 'B': 2.0, 'C': 3.0})
+    cache = PriceCache(provider, ttl=60, max_entries=2, coalesce_window=0, clock=clock)
+    cache.get_many(['A'])
+    cache.get_many(['B'])
+    cache.get_many(['A'])  # A is now most recent
+    cache.get_many(['C'])  # evicts B
+    cache.get_many(['A', 'C'])
+    assert provider.calls == [['A'], ['B'], ['C']]
+    clock.now = 61
+    cache.get_many(['A'])
+    assert provider.calls[-1] == ['A']
+
+
+def test_concurrent_requests_share_one_fetch():
+    release = threading.Event()
+    provider = FakeProvider({'AAPL': 1.0, 'MSFT': 2.0, 'GOOG': 3.0}, delay=release)
+    cache = PriceCache(provider, coalesce_window=0.2)
+    results = {}
+
+    def request(name, symbols):
+        results[name] = cache.get_many(symbols)
+
+    threads = [
+        threading.Thread(target=request, args=('a', ['AAPL', 'MSFT'])),
+        threading.Thread(target=request, args=('b', ['MSFT', 'GOOG'])),
+    ]
+    for t in threads:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join()
+    assert provider.calls == [['AAPL', 'GOOG', 'MSFT']]
+    assert results == {'a': {'AAPL': 1.0, 'MSFT': 2.0}, 'b': {'MSFT': 2.0, 'GOOG': 3.0}}
+
+
+def test_provider_errors_reach_waiters_and_are_not_cached():
+    class Failing:
+        calls = 0
+
+        def fetch(self, symbols):
+            Failing.calls += 1
+            raise RuntimeError('upstream down')
+
+    cache = PriceCache(Failing(), coalesce_window=0)
+    with pytest.raises(RuntimeError):
+        cache.get_many(['AAPL'])
+    with pytest.raises(RuntimeError):
+        cache.get_many(['AAPL'])
+    assert Failing.calls == 2
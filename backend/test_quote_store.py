@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from quote_store import PriceRefresher, QuoteStore, QuoteStoreProvider
+from test_price_cache import FakeProvider
+
+
+def test_store_provider_reads_through_and_shares_quotes(tmp_path):
+    path = str(tmp_path / 'quotes.db')
+    upstream = FakeProvider({'AAPL': 190.0})
+    first = QuoteStoreProvider(QuoteStore(path), upstream)
+    assert first.fetch(['AAPL', 'NOPE']) == {'AAPL': 190.0}
+
+    # A second worker opening the same file is served from the store
+    second = QuoteStoreProvider(QuoteStore(path), upstream)
+    assert second.fetch(['AAPL', 'NOPE']) == {'AAPL': 190.0}
+    assert upstream.calls == [['AAPL', 'NOPE']]
+
+
+def test_refresher_keeps_recent_symbols_warm_under_one_lease(tmp_path):
+    path = str(tmp_path / 'quotes.db')
+    store = QuoteStore(path)
+    store.touch(['MSFT', 'AAPL'])
+    upstream = FakeProvider({'AAPL': 191.0, 'MSFT': 411.0})
+    refresher = PriceRefresher(store, upstream, interval=30, chunk_size=1)
+    other = PriceRefresher(QuoteStore(path), upstream, interval=30)
+
+    assert refresher.refresh_once() == 2
+    assert other.refresh_once() == 0  # lease held by the first worker
+    assert upstream.calls == [['AAPL'], ['MSFT']]
+    assert store.get_many(['AAPL', 'MSFT'], max_age=60) == {'AAPL': 191.0, 'MSFT': 411.0}
+    assert store.get_many(['AAPL'], max_age=-1) == {}
+
+
+def test_refresher_prunes_symbols_outside_the_window(tmp_path):
+    store = QuoteStore(str(tmp_path / 'quotes.db'))
+    upstream = FakeProvider({'AAPL': 191.0, 'MSFT': 411.0})
+    store.touch(['AAPL', 'MSFT'])
+    store.put_many(['AAPL', 'MSFT'], {'AAPL': 190.0, 'MSFT': 410.0})
+    conn = store._conn()
+    conn.execute("UPDATE requested SET last_requested = last_requested - 7200 WHERE symbol = 'MSFT'")
+
+    assert PriceRefresher(store, upstream, window=3600).refresh_once() == 1
+    assert upstream.calls == [['AAPL']]
+    assert conn.execute("SELECT symbol FROM requested").fetchall() == [('AAPL',)]
+    assert conn.execute("SELECT symbol FROM quotes").fetchall() == [('AAPL',)]
+
+
+def test_store_provider_keeps_touches_to_one_interval(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('quote_store.time.monotonic', lambda: clock[0])
+    provider = QuoteStoreProvider(QuoteStore(str(tmp_path / 'quotes.db')), FakeProvider({}))
+    provider.fetch(['A', 'B'])
+    clock[0] += 30
+    provider.fetch(['B', 'C'])
+    assert list(provider._touched) == ['A', 'B', 'C']
+    clock[0] += 45
+    provider.fetch(['D'])
+    assert list(provider._touched) == ['C', 'D']
+
+
+def test_store_provider_is_safe_across_fetcher_threads(tmp_path):
+    provider = QuoteStoreProvider(QuoteStore(str(tmp_path / 'quotes.db')), FakeProvider({}))
+    symbols = [f'S{i}' for i in range(400)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(provider.fetch, [symbols[i:i + 10] for i in range(0, 400, 10)] * 3))
+    assert sorted(provider._touched) == sorted(symbols)
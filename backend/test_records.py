@@ -0,0 +1,23 @@
+import pickle
+
+from records import Lot, RealizedGain, Trade, as_trade
+
+
+def test_records_are_compact_and_picklable():
+    gain = RealizedGain('AAPL', '03/01/2024', '01/10/2023', 5.0, 130.0, 180.0, 250.0, 'long_term')
+    assert not hasattr(gain, '__dict__')
+    assert pickle.loads(pickle.dumps(gain)) == gain
+    assert gain.to_dict()['gain_type'] == 'long_term'
+
+
+def test_legacy_trade_dicts_are_converted():
+    split = as_trade({'activity_date': '06/01/2021', 'instrument': 'AAPL', 'trans_code': 'SPL', 'extra_shares': 3})
+    assert split == Trade('06/01/2021', None, 'AAPL', 'SPL', 3.0, 0.0, 0.0)
+    assert split.extra_shares == 3.0
+    assert as_trade(split) is split
+
+
+def test_lot_to_dict_uses_api_keys():
+    lot = Lot('AAPL-20230110-0', 'AAPL', '01/10/2023', None, 5.0, 130.0)
+    assert lot.to_dict() == {'lotId': 'AAPL-20230110-0', 'instrument': 'AAPL', 'qty': 5.0,
+                             'costBasisPerShare': 130.0, 'purchaseDate': '01/10/2023'}
@@ -0,0 +1,32 @@
+import io
+
+from result_cache import ResultCache, hash_upload
+
+
+def test_evicts_least_recently_used_by_size():
+    cache = ResultCache(max_bytes=10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb')
+    assert cache.get('a') == b'aaaa'
+    cache.put('c', b'cccc')  # over budget: 'b' is the least recently used
+    assert cache.get('b') is None
+    assert cache.get('c') == b'cccc'
+    assert cache.size == 8
+    cache.put('huge', b'x' * 11)
+    assert cache.get('huge') is None and len(cache) == 2
+
+
+def test_tee_stores_streamed_body_unless_too_large():
+    cache = ResultCache(max_bytes=100, max_entry_bytes=6)
+    assert b''.join(cache.tee('k', iter(['ab', 'cd']))) == b'abcd'
+    assert cache.get('k') == b'abcd'
+    assert b''.join(cache.tee('big', iter(['abcd', 'efgh']))) == b'abcdefgh'
+    assert cache.get('big') is None
+
+
+def test_hash_upload_rewinds_stream():
+    stream = io.BytesIO(b'header\nrow\n')
+    stream.read(3)
+    digest = hash_upload(stream)
+    assert stream.tell() == 3
+    assert digest == hash_upload(io.BytesIO(b'der\nrow\n'))
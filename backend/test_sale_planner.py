@@ -0,0 +1,46 @@
+from datetime import date
+
+import pytest
+
+from records import Lot
+from sale_planner import TickerLots
+
+AS_OF = date(2024, 6, 1)
+
+
+def _lots():
+    # Two long-term lots (2022) and two short-term lots (2024)
+    return [
+        Lot('A-0', 'A', '01/10/2022', date(2022, 1, 10), 10.0, 50.0),
+        Lot('A-1', 'A', '03/01/2022', date(2022, 3, 1), 5.0, 150.0),
+        Lot('A-2', 'A', '01/05/2024', date(2024, 1, 5), 4.0, 120.0),
+        Lot('A-3', 'A', '02/05/2024', date(2024, 2, 5), 6.0, 80.0),
+    ]
+
+
+def _sold(plan):
+    return [(lot.lot_id, qty) for lot, qty, _ in plan['lots']]
+
+
+def test_fifo_splits_gain_by_term():
+    plan = TickerLots(_lots(), AS_OF).plan(17.0, 100.0, 'fifo')
+    assert _sold(plan) == [('A-0', 10.0), ('A-1', 5.0), ('A-2', 2.0)]
+    assert plan['long_term_gain'] == pytest.approx(10 * 50 - 5 * 50)
+    assert plan['short_term_gain'] == pytest.approx(2 * -20)
+    assert plan['shortfall'] == 0.0
+
+
+def test_highest_cost_and_long_term_only():
+    lots = TickerLots(_lots(), AS_OF)
+    assert _sold(lots.plan(7.0, 100.0, 'highest_cost')) == [('A-1', 5.0), ('A-2', 2.0)]
+    plan = lots.plan(20.0, 100.0, 'long_term_only')
+    assert _sold(plan) == [('A-0', 10.0), ('A-1', 5.0)]
+    assert plan['shortfall'] == 5.0
+
+
+def test_max_loss_orders_losses_before_gains():
+    # At 100: A-2 is a short-term loss, A-1 a long-term loss; A-3 a short-term gain, A-0 long-term gain
+    plan = TickerLots(_lots(), AS_OF).plan(25.0, 100.0, 'max_loss')
+    assert _sold(plan) == [('A-2', 4.0), ('A-1', 5.0), ('A-0', 10.0), ('A-3', 6.0)]
+    assert plan['gain_loss'] == pytest.approx(100.0 * 25 - (4 * 120 + 5 * 150 + 10 * 50 + 6 * 80))
+    assert 'lots' not in TickerLots(_lots(), AS_OF).plan(1.0, 100.0, 'max_loss', with_lots=False)
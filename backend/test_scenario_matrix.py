@@ -0,0 +1,57 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from records import Lot
+from scenario_matrix import ScenarioError, scenario_matrix
+
+
+def _naive(lots, price, as_of):
+    """Per-lot loop, as the frontend's computeTickerSummary does it, plus the term split."""
+    net = gains = losses = long_term = 0.0
+    for lot in lots:
+        pl = (price - lot.price) * lot.quantity
+        net += pl
+        if pl >= 0:
+            gains += pl
+        else:
+            losses += pl
+        if (as_of - lot.date).days > 365:
+            long_term += pl
+    return net, gains, losses, long_term, net - long_term
+
+
+def test_matches_per_lot_loop():
+    rng = random.Random(7)
+    start = date(2020, 1, 1)
+    lots = [Lot(f'L{i}', rng.choice(['AAPL', 'MSFT']), None, start + timedelta(days=rng.randrange(1500)),
+                rng.choice([0.5, 1.0, 3.0, 10.0]), rng.choice([50.0, 99.5, 100.0, 150.25]))
+            for i in range(300)]
+    prices = {'AAPL': [40.0, 100.0, 120.5], 'MSFT': [99.5]}
+    dates = [date(2021, 6, 1), date(2023, 2, 28), date(2024, 12, 31)]
+
+    result = scenario_matrix(lots, prices, dates)
+    for ticker, grid in prices.items():
+        ticker_lots = [lot for lot in lots if lot.instrument == ticker]
+        got = result[ticker]
+        assert got['quantity'] == pytest.approx(sum(lot.quantity for lot in ticker_lots))
+        for i, price in enumerate(grid):
+            for j, as_of in enumerate(dates):
+                net, gains, losses, lt, st = _naive(ticker_lots, price, as_of)
+                assert got['net'][i] == pytest.approx(net)
+                assert got['gains'][i] == pytest.approx(gains)
+                assert got['losses'][i] == pytest.approx(losses)
+                assert got['long_term'][i][j] == pytest.approx(lt, abs=1e-6)
+                assert got['short_term'][i][j] == pytest.approx(st, abs=1e-6)
+
+
+def test_holding_boundary_and_missing_ticker():
+    lot = Lot('L0', 'AAPL', None, date(2023, 1, 1), 2.0, 10.0)
+    # Held 365 days is still short term; 366 days is long term
+    result = scenario_matrix([lot], {'AAPL': [15.0], 'NONE': [1.0]}, [date(2024, 1, 1), date(2024, 1, 2)])
+    assert result['AAPL']['long_term'].tolist() == [[0.0, 10.0]]
+    assert result['AAPL']['short_term'].tolist() == [[10.0, 0.0]]
+    assert result['NONE']['net'].tolist() == [0.0] and result['NONE']['quantity'] == 0.0
+    with pytest.raises(ScenarioError):
+        scenario_matrix([lot], {'AAPL': []}, [date(2024, 1, 1)])
@@ -0,0 +1,48 @@
+import io
+
+import pytest
+
+from capital_gains_calculator import calculate_capital_gains, calculate_capital_gains_spilled
+from csv_parser import iter_robinhood_trades
+from synthetic_export import write_export
+from trade_store import StoreError, TradeStore, write_store
+
+
+def _trades(rows=3000, seed=4):
+    buf = io.StringIO()
+    write_export(buf, rows, tickers=25, seed=seed)
+    return list(iter_robinhood_trades(io.StringIO(buf.getvalue())))
+
+
+def test_store_round_trips_trades_per_instrument(tmp_path):
+    trades = _trades()
+    path = str(tmp_path / 'trades.cgts')
+    assert write_store(iter(trades), path) == {'trades': len(trades), 'instruments': len({t.instrument for t in trades})}
+    with TradeStore(path) as store:
+        assert store.instruments == list(dict.fromkeys(t.instrument for t in trades))
+        assert len(store) == len(trades)
+        for instrument in store.instruments:
+            assert store.trades(instrument) == [t for t in trades if t.instrument == instrument]
+        sells = store.trades(store.instruments[0], ('Sell',))
+        assert sells and all(t.trans_code == 'Sell' for t in sells)
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_spilled_calculation_matches_in_memory(tmp_path, parallel):
+    trades = _trades(seed=6)
+    expected = calculate_capital_gains(iter(trades), parallel=False, snapshot=True)
+    result = calculate_capital_gains_spilled(iter(trades), directory=str(tmp_path), parallel=parallel, snapshot=True)
+    assert list(result['gains']) == list(expected['gains'])
+    assert result['gains'] == expected['gains']
+    assert [l.to_dict() for l in result['unsold_lots']] == [l.to_dict() for l in expected['unsold_lots']]
+    assert result['summary'] == expected['summary']
+    assert result['snapshot'] == expected['snapshot']
+    # The temporary store is removed afterwards
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rejects_files_that_are_not_stores(tmp_path):
+    path = tmp_path / 'export.csv'
+    path.write_bytes(b'"Activity Date","Process Date"\n' * 4)
+    with pytest.raises(StoreError):
+        TradeStore(str(path))
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from capital_gains_calculator import _group_events, calculate_capital_gains
+from test_capital_gains_calculator import synthetic_trades
+from vectorized_engine import _exact, calculate_capital_gains_vectorized
+
+
+def _trade(date, code, qty=0.0, price=0.0, instrument='AAPL'):
+    if code == 'SPL':
+        return {'activity_date': date, 'instrument': instrument, 'trans_code': code, 'extra_shares': qty}
+    return {'activity_date': date, 'instrument': instrument, 'trans_code': code, 'quantity': qty, 'price': price}
+
+
+TRADES = [
+    _trade('01/10/2020', 'Buy', 10, 100.0),
+    _trade('02/10/2020', 'Buy', 5, 120.0),
+    _trade('02/10/2020', 'Buy', 0, 125.0),  # zero-share lot still yields a zero match
+    _trade('03/01/2020', 'Sell', 12, 130.0),
+    _trade('06/01/2021', 'SPL', 3),  # 2-for-1 on the 3 shares still held
+    _trade('06/02/2021', 'Buy', 4, 70.0),
+    _trade('06/03/2021', 'Sell', 50, 80.0),  # more than held: excess is ignored
+    _trade('07/01/2021', 'Buy', 2, 75.0),
+    _trade('07/01/2021', 'Buy', 1, 76.0),
+    _trade('07/02/2021', 'CDIV', instrument='MSFT'),
+    _trade('01/05/2022', 'Buy', 3, 300.0, instrument='MSFT'),
+    _trade('02/05/2023', 'Sell', 1, 250.0, instrument='MSFT'),
+]
+
+
+def test_vectorized_matches_reference_engine():
+    expected = calculate_capital_gains(list(TRADES))
+    actual = calculate_capital_gains_vectorized(iter(TRADES))
+    assert actual == expected
+    assert [g.quantity for g in actual['gains']['AAPL']] == [10.0, 2.0, 6.0, 0.0, 4.0]
+    assert [l.lot_id for l in actual['unsold_lots']] == [
+        'AAPL-20210701-0', 'AAPL-20210701-1', 'MSFT-20220105-0',
+    ]
+
+
+def test_empty_history():
+    assert calculate_capital_gains_vectorized([]) == calculate_capital_gains([])
+
+
+def _whole_share_trades(n, seed):
+    rng = random.Random(seed)
+    trades = []
+    for _ in range(n):
+        day = f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(2019, 2023)}"
+        code = rng.choice(('Buy', 'Buy', 'Sell', 'CDIV'))
+        trades.append(_trade(day, code, rng.randint(0, 40), round(rng.uniform(5, 500), 2),
+                             instrument=rng.choice(('AAPL', 'MSFT', 'NVDA'))))
+    return trades
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_vectorized_equals_reference_on_random_histories(seed):
+    # Synthetic exports carry splits and DRIP fractions (the FIFO fallback);
+    # whole-share histories run through the interval matching
+    for trades in (synthetic_trades(3000, 10, seed), _whole_share_trades(2000, seed)):
+        expected = calculate_capital_gains(list(trades), parallel=False)
+        actual = calculate_capital_gains_vectorized(iter(trades))
+        assert actual == expected
+
+
+def test_only_splits_and_fractions_take_the_fifo_path():
+    events = _group_events(_whole_share_trades(500, 1))
+    assert all(_exact(e) for e in events.values())
+    next(t for t in events['AAPL'] if t.trans_code == 'Buy').quantity = 0.5
+    assert not _exact(events['AAPL'])
+    assert not _exact(_group_events(TRADES)['AAPL'])  # has a split
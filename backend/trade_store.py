@@ -0,0 +1,202 @@
+"""
+Memory-mapped columnar trade store for very large histories.
+
+write_store() spills a parsed trade stream to a binary file once; TradeStore
+then maps it read-only (numpy.memmap, zero copy) and hands out one
+instrument's trades at a time through a per-instrument offset index, so a
+gains run holds the largest single instrument in memory rather than the
+whole history.
+
+File layout (little endian):
+
+    0      header: magic b'CGTS', u32 version, u64 record count,
+           u64 metadata offset, u64 metadata length (padded to 64 bytes)
+    64     records, RECORD_DTYPE, grouped by instrument (file order kept
+           within an instrument)
+    meta   UTF-8 JSON: {"instruments": [...], "index": [[start, count], ...]}
+
+Instruments are interned into the table in order of first appearance and
+records refer to them by number. Dates are epoch days (days since
+1970-01-01); the activity date string is rebuilt as mm/dd/YYYY, the form the
+CSV parser normalizes to.
+"""
+import json
+import os
+import struct
+from array import array
+from datetime import date
+
+import numpy as np
+
+from date_parser import default_parser
+from records import Trade, as_trade
+
+MAGIC = b'CGTS'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQQ')
+HEADER_SIZE = 64
+
+# Fixed-width record: 40 bytes with alignment
+RECORD_DTYPE = np.dtype([
+    ('day', '<i4'),
+    ('instrument', '<u4'),
+    ('quantity', '<f8'),
+    ('price', '<f8'),
+    ('amount', '<f8'),
+    ('code', 'u1'),
+], align=True)
+
+# Trade codes by number; anything else is stored as OTHER so its instrument still registers
+CODES = ('Buy', 'Sell', 'SPL', 'CDIV')
+OTHER = len(CODES)
+_CODE_NUMBERS = {code: i for i, code in enumerate(CODES)}
+
+_EPOCH = date(1970, 1, 1).toordinal()
+
+# Records buffered per write while spilling
+WRITE_CHUNK = 65536
+
+class StoreError(ValueError):
+    """A file that is not a readable trade store."""
+
+def _epoch_day(t) -> int:
+    d = t.date if t.date is not None else default_parser.parse(t.activity_date)
+    if d is None:
+        raise ValueError(f"Unrecognized date: {t.activity_date!r}")
+    return d.toordinal() - _EPOCH
+
+# Column buffers for one chunk: typecode per RECORD_DTYPE field
+_BUFFER_TYPES = (('day', 'i'), ('instrument', 'I'), ('quantity', 'd'),
+                 ('price', 'd'), ('amount', 'd'), ('code', 'B'))
+
+def _flush(f, columns: list) -> int:
+    """Write buffered columns as records and empty them; returns the number written."""
+    n = len(columns[0])
+    if n:
+        chunk = np.zeros(n, dtype=RECORD_DTYPE)
+        for (name, _), col in zip(_BUFFER_TYPES, columns):
+            chunk[name] = np.frombuffer(col, dtype=RECORD_DTYPE[name])
+        f.write(chunk.tobytes())
+        del chunk
+        for col in columns:
+            del col[:]
+    return n
+
+def write_store(trades, path: str) -> dict:
+    """
+    Write trades (Trade records or legacy dicts, e.g. a streamed upload) to a
+    store at `path`. Records are spilled in arrival order through typed
+    column buffers, then regrouped by instrument with one stable argsort of
+    the instrument column, so the writer holds one chunk of raw values plus
+    8 bytes per trade, never the trades themselves.
+    Returns {'trades': n, 'instruments': k}.
+    """
+    table = {}
+    spill = path + '.spill'
+    n = 0
+    try:
+        with open(spill, 'wb') as f:
+            columns = [array(typecode) for _, typecode in _BUFFER_TYPES]
+            day, inst, qty, price, amount, code = (col.append for col in columns)
+            for t in trades:
+                t = as_trade(t)
+                i = table.get(t.instrument)
+                if i is None:
+                    i = table[t.instrument] = len(table)
+                day(_epoch_day(t))
+                inst(i)
+                qty(t.quantity or 0.0)
+                price(t.price or 0.0)
+                amount(t.amount or 0.0)
+                code(_CODE_NUMBERS.get(t.trans_code, OTHER))
+                if len(columns[0]) >= WRITE_CHUNK:
+                    n += _flush(f, columns)
+            n += _flush(f, columns)
+
+        with open(path, 'wb') as out:
+            out.write(b'\0' * HEADER_SIZE)
+            counts = np.zeros(len(table), dtype=np.int64)
+            if n:
+                spilled = np.memmap(spill, dtype=RECORD_DTYPE, mode='r', shape=(n,))
+                order = np.argsort(spilled['instrument'], kind='stable')
+                for i in range(0, n, WRITE_CHUNK):
+                    out.write(spilled[order[i:i + WRITE_CHUNK]].tobytes())
+                counts = np.bincount(spilled['instrument'], minlength=len(table))
+                del spilled, order
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1])) if len(table) else counts
+            meta = json.dumps({
+                'instruments': list(table),
+                'index': [[int(s), int(c)] for s, c in zip(starts, counts)],
+            }).encode('utf-8')
+            meta_offset = out.tell()
+            out.write(meta)
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, VERSION, n, meta_offset, len(meta)))
+    finally:
+        if os.path.exists(spill):
+            os.remove(spill)
+    return {'trades': n, 'instruments': len(table)}
+
+class TradeStore:
+    """
+    Read-only view of a store written by write_store(). Records stay on disk
+    (mapped, paged in on access); trades(instrument) builds Trade records for
+    one instrument's slice only.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            head = f.read(HEADER_SIZE)
+            if len(head) < HEADER.size:
+                raise StoreError(f"{path}: not a trade store")
+            magic, version, n, meta_offset, meta_len = HEADER.unpack_from(head)
+            if magic != MAGIC or version != VERSION:
+                raise StoreError(f"{path}: not a version {VERSION} trade store")
+            f.seek(meta_offset)
+            meta = json.loads(f.read(meta_len))
+        self.instruments = meta['instruments']
+        self._index = {inst: (start, count) for inst, (start, count) in zip(self.instruments, meta['index'])}
+        self._records = (np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(n,))
+                         if n else np.zeros(0, dtype=RECORD_DTYPE))
+        self._dates = {}  # epoch day -> (date, mm/dd/YYYY)
+
+    def __len__(self):
+        return len(self._records)
+
+    def count(self, instrument: str) -> int:
+        return self._index[instrument][1]
+
+    def records(self, instrument: str) -> np.ndarray:
+        """The instrument's records as a zero-copy view of the mapping."""
+        start, count = self._index[instrument]
+        return self._records[start:start + count]
+
+    def trades(self, instrument: str, codes=None) -> list:
+        """Trade records for one instrument, in file order, optionally only `codes`."""
+        recs = self.records(instrument)
+        if codes is not None:
+            recs = recs[np.isin(recs['code'], [_CODE_NUMBERS[c] for c in codes])]
+        dates = self._dates
+        out = []
+        for day, code, qty, price, amount in zip(recs['day'].tolist(), recs['code'].tolist(),
+                                                 recs['quantity'].tolist(), recs['price'].tolist(),
+                                                 recs['amount'].tolist()):
+            d = dates.get(day)
+            if d is None:
+                when = date.fromordinal(day + _EPOCH)
+                d = dates[day] = (when, when.strftime('%m/%d/%Y'))
+            out.append(Trade(d[1], d[0], instrument, CODES[code] if code < OTHER else None,
+                             qty, price, amount))
+        return out
+
+    def close(self) -> None:
+        """Drop the mapping (unmapped once no record view still refers to it)."""
+        self._records = np.zeros(0, dtype=RECORD_DTYPE)
+        self._dates.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,239 @@
+from collections import defaultdict
+from datetime import date
+
+import numpy as np
+
+from capital_gains_calculator import _process_instrument as fifo_process_instrument
+from capital_gains_calculator import _group_events, _summary_from_totals
+from records import Lot, RealizedGain
+
+# Bump whenever a change alters results, so cached responses are not reused
+ENGINE_VERSION = '3'
+
+# Event kinds, in same-day processing order: splits, then buys, then sells
+SPL, BUY, SELL = 0, 1, 2
+_KINDS = {'SPL': SPL, 'Buy': BUY, 'Sell': SELL}
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+class _Columns:
+    """Column buffers for one instrument's events, in input order."""
+
+    __slots__ = ('kind', 'day', 'qty', 'price', 'activity_date', 'div_day', 'div_amount')
+
+    def __init__(self, events):
+        self.kind = []
+        self.day = []
+        self.qty = []
+        self.price = []
+        self.activity_date = []
+        self.div_day = []
+        self.div_amount = []
+        for t in events:
+            kind = _KINDS.get(t.trans_code)
+            if kind is None:
+                self.div_day.append(t.date.toordinal())
+                self.div_amount.append(t.amount)
+                continue
+            self.kind.append(kind)
+            self.day.append(t.date.toordinal())
+            self.activity_date.append(t.activity_date)
+            self.qty.append(t.quantity)
+            self.price.append(t.price)
+
+def _exact(events) -> bool:
+    """
+    Whether interval matching reproduces the FIFO engine bit for bit: no
+    splits and whole, non-negative share counts whose sums stay below 2**53.
+    Every cumulative sum is then exact, so matches, residues and lots come
+    out as the FIFO engine's sequential subtractions leave them. Split
+    ratios and fractional (DRIP) shares leave float residue whose exact
+    value depends on the order of operations, so such instruments go
+    through the FIFO engine instead.
+    """
+    total = 0.0
+    for t in events:
+        code = t.trans_code
+        if code == 'SPL':
+            return False
+        if code != 'CDIV':
+            qty = t.quantity
+            if qty < 0 or qty != int(qty):
+                return False
+            total += qty
+    return total < 2.0 ** 53
+
+def _years(ordinals):
+    """Calendar years of an array of date ordinals."""
+    return (ordinals - _EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[Y]').astype(int) + 1970
+
+def _add_totals(totals, keys, amounts, kinds) -> None:
+    """totals[(key // len(kinds), kinds[key % len(kinds)])] += the amounts per distinct key."""
+    if keys.size == 0:
+        return
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=amounts)
+    for key, amount in zip(uniq.tolist(), sums.tolist()):
+        totals[(key // len(kinds), kinds[key % len(kinds)])] += amount
+
+def _process_instrument(instrument: str, cols: _Columns):
+    """
+    FIFO-match one instrument's events with cumulative-quantity interval
+    intersection. Returns (gains, unsold_lots, totals) where totals is
+    {(year, kind): amount} as in the FIFO engine's report totals. Only
+    exact for instruments that pass _exact.
+    """
+    totals = defaultdict(float)
+    if cols.div_day:
+        # Chronological, as the FIFO engine adds them
+        div_day = np.asarray(cols.div_day, dtype=np.int64)
+        by_day = np.argsort(div_day, kind='stable')
+        _add_totals(totals, _years(div_day[by_day]),
+                    np.asarray(cols.div_amount, dtype=np.float64)[by_day], ('dividends',))
+    n = len(cols.kind)
+    if n == 0:
+        return [], [], totals
+
+    kind = np.asarray(cols.kind, dtype=np.int8)
+    qty = np.asarray(cols.qty, dtype=np.float64)
+    day = np.asarray(cols.day, dtype=np.int64)
+    price = np.asarray(cols.price, dtype=np.float64)
+
+    # Chronological order; lexsort is stable, so same-day ties keep input order
+    order = np.lexsort((kind, day))
+    kind, day, qty, price = kind[order], day[order], qty[order], price[order]
+
+    is_buy = kind == BUY
+    is_sell = (kind == SELL) & (qty > 0)
+
+    # Holdings after every event (reflected at zero: sells past the holdings
+    # are dropped, as in the FIFO engine), and the quantity each sell relieves
+    flow = np.where(is_buy, qty, 0.0) - np.where(is_sell, qty, 0.0)
+    x = np.cumsum(flow)
+    held = x - np.minimum(np.minimum.accumulate(x), 0.0)
+    held_before = np.concatenate(([0.0], held[:-1]))
+    relieved = np.where(is_sell, held_before - held, 0.0)
+
+    buy_pos = np.flatnonzero(is_buy)
+    sell_pos = np.flatnonzero(is_sell)
+    buy_len = qty[buy_pos]
+    buy_hi = np.cumsum(buy_len)
+    buy_lo = buy_hi - buy_len
+    sell_hi = np.cumsum(relieved[sell_pos])
+    sell_lo = sell_hi - relieved[sell_pos]
+
+    # Every sell interval overlaps a contiguous run of buy intervals
+    first = np.searchsorted(buy_hi, sell_lo, side='right')
+    last = np.minimum(np.searchsorted(buy_lo, sell_hi, side='left') - 1, buy_pos.size - 1)
+    counts = np.maximum(last - first + 1, 0)
+    pair_sell = np.repeat(np.arange(sell_pos.size), counts)
+    run_start = np.repeat(np.cumsum(counts) - counts, counts)
+    pair_buy = np.repeat(first, counts) + (np.arange(pair_sell.size) - run_start)
+
+    overlap = (np.minimum(buy_hi[pair_buy], sell_hi[pair_sell])
+               - np.maximum(buy_lo[pair_buy], sell_lo[pair_sell]))
+    keep = overlap > 0
+    pair_sell, pair_buy, overlap = pair_sell[keep], pair_buy[keep], overlap[keep]
+
+    # Zero-quantity buys have empty intervals, but the FIFO engine still emits
+    # a zero-share match when the first sell reaching them pops them off the
+    # queue: the first later sell whose relief ends at or past the lot, or the
+    # one after it if that sell was filled exactly at the lot's position.
+    empty = np.flatnonzero(buy_len == 0)
+    if empty.size and sell_pos.size:
+        lo = buy_lo[empty]
+        j = np.maximum(np.searchsorted(sell_pos, buy_pos[empty]),
+                       np.searchsorted(sell_hi, lo, side='left'))
+        valid = j < sell_pos.size
+        jj = np.minimum(j, sell_pos.size - 1)
+        shortfall = qty[sell_pos] > held_before[sell_pos]
+        filled_at_lot = valid & (sell_hi[jj] == lo) & ~shortfall[jj]
+        j = np.where(filled_at_lot, j + 1, j)
+        valid = j < sell_pos.size
+        if valid.any():
+            pair_sell = np.concatenate((pair_sell, j[valid]))
+            pair_buy = np.concatenate((pair_buy, empty[valid]))
+            overlap = np.concatenate((overlap, np.zeros(int(valid.sum()))))
+            by_sell = np.lexsort((pair_buy, pair_sell))
+            pair_sell, pair_buy, overlap = pair_sell[by_sell], pair_buy[by_sell], overlap[by_sell]
+
+    s_ev = sell_pos[pair_sell]
+    b_ev = buy_pos[pair_buy]
+    buy_price = price[b_ev]
+    sell_price = price[s_ev]
+    gain_loss = (sell_price - buy_price) * overlap
+    long_term = (day[s_ev] - day[b_ev]) > 365
+    # Gains are in the FIFO engine's emission order, so the sums are too
+    _add_totals(totals, _years(day[s_ev]) * 2 + long_term, gain_loss, ('short_term', 'long_term'))
+
+    activity = [cols.activity_date[i] for i in order]
+    gains = [
+        RealizedGain(instrument, activity[s], activity[b], q, bp, sp, gl,
+                     'long_term' if lt else 'short_term')
+        for s, b, q, bp, sp, gl, lt in zip(
+            s_ev.tolist(), b_ev.tolist(), overlap.tolist(), buy_price.tolist(),
+            sell_price.tolist(), gain_loss.tolist(), long_term.tolist(),
+        )
+    ]
+
+    # Open lots: whatever part of each buy interval lies beyond the last relief
+    sold_total = sell_hi[-1] if sell_hi.size else 0.0
+    remaining = buy_hi - np.maximum(buy_lo, sold_total)
+    buy_day = day[buy_pos]
+    day_start = np.concatenate(([0], np.flatnonzero(np.diff(buy_day)) + 1))
+    seq = np.arange(buy_pos.size) - np.repeat(day_start, np.diff(np.append(day_start, buy_pos.size)))
+
+    open_idx = np.flatnonzero(remaining > 0)
+    if open_idx.size == 0:
+        return gains, [], totals
+    open_ev = buy_pos[open_idx]
+    # Same ids as _stable_lot_id: <instrument>-<YYYYMMDD>-<per-date seq>
+    ymd = np.char.replace(np.datetime_as_string(
+        (buy_day[open_idx] - _EPOCH_ORDINAL).astype('datetime64[D]'), unit='D'), '-', '')
+    unsold_lots = [
+        Lot(f"{instrument}-{d}-{q}", instrument, activity[ev], date.fromordinal(day_ord), rem, basis)
+        for d, q, rem, basis, ev, day_ord in zip(
+            ymd.tolist(), seq[open_idx].tolist(), remaining[open_idx].tolist(),
+            price[open_ev].tolist(), open_ev.tolist(), buy_day[open_idx].tolist(),
+        )
+    ]
+    return gains, unsold_lots, totals
+
+def calculate_capital_gains_vectorized(trades):
+    """
+    Columnar FIFO engine; returns the same structure as calculate_capital_gains().
+
+    Each instrument's events are loaded into NumPy arrays and sorted once.
+    FIFO matching reduces to intersecting cumulative-quantity intervals of
+    buys and sells (searchsorted + cumsum) with no per-lot loop; prices,
+    gain/loss and the long/short-term split are derived as array
+    expressions. That is exact only for whole share counts without splits
+    (see _exact); other instruments run through the FIFO engine, so the
+    result equals calculate_capital_gains() for every input. It is faster
+    than the FIFO engine on whole-share histories only: exports with DRIP
+    fractions or splits take the FIFO path for most instruments.
+    """
+    all_capital_gains = {}
+    all_unsold_lots = []
+    totals_by_instrument = {}
+    events_by_instrument = _group_events(trades)
+    for instrument in list(events_by_instrument):
+        events = events_by_instrument.pop(instrument)
+        if _exact(events):
+            gains, unsold, totals = _process_instrument(instrument, _Columns(events))
+        else:
+            gains, unsold, state = fifo_process_instrument(instrument, events)
+            totals = state.totals
+        all_capital_gains[instrument] = gains
+        all_unsold_lots.extend(unsold)
+        totals_by_instrument[instrument] = totals
+
+    summary = _summary_from_totals(totals_by_instrument)
+    remaining_tickers = sorted(list({lot.instrument for lot in all_unsold_lots}))
+
+    return {
+        'gains': all_capital_gains,
+        'summary': summary,
+        'unsold_lots': all_unsold_lots,
+        'remaining_tickers': remaining_tickers,
+    }